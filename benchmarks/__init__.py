@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Same path layout as the Lambda runtime, see tests/conftest.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "streaming_bot_websockets"))
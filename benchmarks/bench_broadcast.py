@@ -0,0 +1,52 @@
+'''Fan-out time of a broadcast to many connections, against an in-memory
+connection registry and a stub post_to_connection with per-call latency.
+A share of the connections is gone and gets pruned from the registry.
+The serial time is extrapolated from a sample, posting 10k one by one
+takes minutes.
+
+    python -m benchmarks.bench_broadcast --connections 10000 --post-ms 20 --workers 16,48,128
+'''
+import argparse
+import time
+
+from tests.fakes import FakeDynamoDb, FakeWebSocketClient
+from utils.connections import ConnectionRegistry, broadcast
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--post-ms", type=float, default=20)
+    parser.add_argument("--gone-percent", type=float, default=2)
+    parser.add_argument("--workers", default="16,48,128")
+    args = parser.parse_args()
+
+    connection_ids = [f"conn-{n:05d}" for n in range(args.connections)]
+    gone_every = int(100 / args.gone_percent) if args.gone_percent else 0
+    gone = set(connection_ids[::gone_every]) if gone_every else set()
+
+    sample = connection_ids[:100]
+    client = FakeWebSocketClient(latency=args.post_ms / 1000)
+    start = time.perf_counter()
+    for connection_id in sample:
+        try:
+            client.post_to_connection(ConnectionId=connection_id, Data="notice")
+        except Exception:
+            pass
+    serial_secs = (time.perf_counter() - start) * args.connections / len(sample)
+    print(f"serial (extrapolated): {serial_secs:8.1f} s")
+
+    for workers in [int(w) for w in args.workers.split(",")]:
+        registry = ConnectionRegistry("events_table", dynamodb=FakeDynamoDb())
+        for connection_id in connection_ids:
+            registry.register(connection_id)
+        client = FakeWebSocketClient(latency=args.post_ms / 1000)
+        client.gone = gone
+        stats = broadcast(client, registry.connection_ids(), "notice", registry=registry, workers=workers)
+        remaining = sum(1 for _ in registry.connection_ids())
+        print(f"{workers:4} workers: {stats['seconds']:7.2f} s, {stats['sent'] / stats['seconds']:8.0f} posts/sec, "
+              f"{stats['gone']} gone pruned, {remaining} left, speedup {serial_secs / stats['seconds']:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+'''Chunks produced and parsing throughput on a multi-hundred page PDF with
+running headers/footers, headings and wrapped lines: the previous
+CharacterTextSplitter(500, 100) versus strip_boilerplate + StructuredChunker,
+and serial versus multi-process page parsing.
+
+    python -m benchmarks.bench_chunker --pages 300 --workers 2
+'''
+import argparse
+import io
+import random
+import statistics
+import time
+import textwrap
+
+from tests.fakes import make_pdf
+from utils.chunker import StructuredChunker, strip_boilerplate
+from utils.context_builder import estimate_tokens
+from utils.ingestion_pipeline import iter_page_chunks, iter_pdf_pages, iter_pdf_pages_parallel
+from benchmarks.corpus import CATEGORIES, FEATURES, POLICIES
+
+
+def page_lines(page, seed=11):
+    rng = random.Random(seed * 100003 + page)
+    lines = ["ACME Outdoor Retail - Store Operations Manual", f"Revision 4 - Confidential"]
+    for section in range(rng.randint(1, 3)):
+        lines.append(f"{page + 1}.{section + 1} {rng.choice(CATEGORIES).title()} Returns")
+        sentences = [f"A {rng.choice(FEATURES)} {rng.choice(CATEGORIES)} may be exchanged once. {rng.choice(POLICIES)}"
+                     for _ in range(rng.randint(3, 8))]
+        lines.extend(textwrap.wrap(" ".join(sentences), 95))
+        lines.append("")
+    lines.append(f"Page {page + 1} - Printed copies are uncontrolled")
+    return lines
+
+
+def character_splitter():
+    try:
+        from langchain.text_splitter import CharacterTextSplitter
+        return CharacterTextSplitter(chunk_size=500, chunk_overlap=100).split_text
+    except ImportError:
+        return split_like_character_text_splitter
+
+
+def split_like_character_text_splitter(text, separator="\n\n", chunk_size=500, chunk_overlap=100):
+    '''Same merge rule as langchain's CharacterTextSplitter, when it is not installed'''
+    chunks, current, total = [], [], 0
+    for split in (s for s in text.split(separator) if s):
+        if current and total + len(split) + len(separator) > chunk_size:
+            chunks.append(separator.join(current))
+            while current and (total > chunk_overlap or total + len(split) + len(separator) > chunk_size):
+                total -= len(current.pop(0)) + len(separator)
+        current.append(split)
+        total += len(split) + len(separator)
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def report(name, chunks, seconds):
+    tokens = [estimate_tokens(chunk) for chunk in chunks]
+    print(f"{name:30} chunks {len(chunks):6}   tokens mean {statistics.mean(tokens):5.0f} max {max(tokens):5}   "
+          f"under 40 {sum(t < 40 for t in tokens):5}   over 300 {sum(t > 300 for t in tokens):5}   "
+          f"embedded tokens {sum(tokens):8}   {seconds:5.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    pdf = make_pdf(args.pages, page_lines=page_lines)
+    print(f"{args.pages} pages, {len(pdf) / 2 ** 20:.1f} MB")
+
+    start = time.perf_counter()
+    chunks = [c["doc_text"] for c in iter_page_chunks(iter_pdf_pages(io.BytesIO(pdf)), character_splitter())]
+    report("CharacterTextSplitter(500)", chunks, time.perf_counter() - start)
+
+    chunker = StructuredChunker()
+    start = time.perf_counter()
+    pages = strip_boilerplate(iter_pdf_pages(io.BytesIO(pdf)))
+    chunks = [c["doc_text"] for c in iter_page_chunks(pages, chunker.split_text)]
+    report("StructuredChunker serial", chunks, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    pages = strip_boilerplate(iter_pdf_pages_parallel(io.BytesIO(pdf), workers=args.workers))
+    chunks = [c["doc_text"] for c in iter_page_chunks(pages, chunker.split_text)]
+    report(f"StructuredChunker {args.workers} workers", chunks, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+'''Per-invocation overhead of building boto3 clients in the handler versus
+reusing them from the chatbot_utils registry, against a local HTTP endpoint
+that stands in for DynamoDB so connection reuse is measured as well.
+
+    python -m benchmarks.bench_clients --invocations 100
+'''
+import argparse
+import os
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+
+from utils.chatbot_utils import clear_registry, get_client
+
+
+class StubDynamoDbHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    connections = set()
+
+    def do_POST(self):
+        self.connections.add(self.client_address)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def put_item(client):
+    client.put_item(TableName="events_table", Item={"pk": {"S": "session"}, "sk": {"S": "msg"}})
+
+
+def measure(invocations, invoke):
+    StubDynamoDbHandler.connections.clear()
+    timings = []
+    for _ in range(invocations):
+        start = time.perf_counter()
+        invoke()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), max(timings), len(StubDynamoDbHandler.connections)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--invocations", type=int, default=100)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubDynamoDbHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+
+    per_call = measure(args.invocations,
+                       lambda: put_item(boto3.client("dynamodb", endpoint_url=endpoint)))
+    clear_registry()
+    registry = measure(args.invocations,
+                       lambda: put_item(get_client("dynamodb", endpoint_url=endpoint)))
+    server.shutdown()
+
+    print(f"{'':20} {'p50 ms':>8} {'max ms':>8} {'connections':>12}")
+    print(f"{'client per call':20} {per_call[0]:8.2f} {per_call[1]:8.2f} {per_call[2]:12}")
+    print(f"{'registry':20} {registry[0]:8.2f} {registry[1]:8.2f} {registry[2]:12}")
+
+
+if __name__ == "__main__":
+    main()
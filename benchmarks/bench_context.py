@@ -0,0 +1,79 @@
+'''Prompt tokens for the retrieved context when hits are concatenated as
+before versus assembled by build_context, over a policy manual split into
+overlapping chunks the way CharacterTextSplitter(500, 100) does.
+
+    python -m benchmarks.bench_context --top 5 --budget 1500
+'''
+import argparse
+import random
+import statistics
+import time
+
+from tests.fakes import hash_embedding
+from utils.context_builder import build_context, estimate_tokens
+from utils.document_manifest import assign_chunk_ids
+from utils.local_vector_store import LocalVectorStore
+from benchmarks.corpus import CATEGORIES, FEATURES, POLICIES
+
+
+def policy_manual(sections=60, seed=3):
+    rng = random.Random(seed)
+    paragraphs = []
+    for n in range(sections):
+        category = rng.choice(CATEGORIES)
+        sku = f"sku-{10000 + n * 37}"
+        paragraphs.append(f"Returns for {sku}. {rng.choice(POLICIES)} For a {rng.choice(FEATURES)} {category} "
+                          f"the {category} must be unused and in its original packaging. "
+                          f"{rng.choice(POLICIES)} Contact support quoting {sku} for exceptions.")
+    return " ".join(paragraphs)
+
+
+def overlapping_chunks(text, chunk_size=500, overlap=100):
+    words, chunks, start = text.split(" "), [], 0
+    while start < len(words):
+        end, size = start, 0
+        while end < len(words) and size + len(words[end]) + 1 <= chunk_size:
+            size += len(words[end]) + 1
+            end += 1
+        chunks.append(" ".join(words[start:end]))
+        if end >= len(words):
+            break
+        back, size = end, 0
+        while back > start + 1 and size + len(words[back - 1]) + 1 <= overlap:
+            size += len(words[back - 1]) + 1
+            back -= 1
+        start = back
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--budget", type=int, default=1500)
+    args = parser.parse_args()
+
+    store = LocalVectorStore(dimension=256)
+    chunks = list(assign_chunk_ids(({"doc_text": t, "doc_page": 1} for t in overlapping_chunks(policy_manual())),
+                                   "s3://docs/policy-manual.pdf"))
+    store.add_many([c["chunk_id"] for c in chunks], [hash_embedding(c["doc_text"], 256) for c in chunks], chunks)
+
+    naive, built_tokens, durations = [], [], []
+    for n in range(0, 60, 3):
+        question = f"what are the exceptions for returning sku-{10000 + n * 37}"
+        hits = store.search(hash_embedding(question, 256), args.top, query_text=question,
+                            mode="hybrid", size=args.top)["hits"]["hits"]
+        naive.append(estimate_tokens("".join(f" {hit['_source']['doc_text']}" for hit in hits)))
+        start = time.perf_counter()
+        built = build_context(hits, token_budget=args.budget)
+        durations.append((time.perf_counter() - start) * 1000)
+        built_tokens.append(built["tokens"])
+
+    saved = 1 - sum(built_tokens) / sum(naive)
+    print(f"{len(chunks)} chunks, top {args.top} hits per question, budget {args.budget} tokens")
+    print(f"concatenated context  mean {statistics.mean(naive):6.0f} tokens")
+    print(f"build_context         mean {statistics.mean(built_tokens):6.0f} tokens   "
+          f"saved {saved:.0%}   p50 {statistics.median(durations):.2f} ms to build")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+'''Latency conversation memory adds to a turn, against an in-memory events
+table with per-request latency: loading the history with one Query (cold
+container) or from the container cache (warm), building the bounded
+history and rewriting the query. Also compares the prompt size with
+replaying the whole conversation.
+
+    python -m benchmarks.bench_conversation --sessions 50 --turns 20 --dynamodb-ms 5
+'''
+import argparse
+import time
+
+from tests.fakes import FakeDynamoDb
+from utils.context_builder import estimate_tokens
+from utils.conversation import ConversationStore, format_turns, new_msg_id, rewrite_query
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--dynamodb-ms", type=float, default=5)
+    parser.add_argument("--history-tokens", type=int, default=400)
+    args = parser.parse_args()
+
+    dynamodb = FakeDynamoDb(latency=args.dynamodb_ms / 1000)
+    table = dynamodb.Table("events_table")
+    answer = "The trail tent packs down to 40cm and sleeps two, returns are accepted within 30 days. " * 4
+    timings = {"cold": [], "warm": [], "history": [], "rewrite": []}
+    bounded, replayed = [], []
+    for session in range(args.sessions):
+        session_id = f"conn-{session}"
+        store = ConversationStore("events_table", dynamodb=dynamodb)
+        everything = []
+        for turn in range(args.turns):
+            message = f"question {turn} about sku-{session}" if turn % 2 == 0 else "and is it waterproof?"
+            start = time.perf_counter()
+            conversation = store.load(session_id)
+            timings["warm" if turn else "cold"].append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            history = conversation.history(args.history_tokens, store.window)
+            timings["history"].append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            rewrite_query(message, conversation)
+            timings["rewrite"].append((time.perf_counter() - start) * 1000)
+            bounded.append(estimate_tokens(history))
+            replayed.append(estimate_tokens(format_turns(everything)))
+
+            msg_id = new_msg_id()
+            table.put_item(Item={"pk": session_id, "sk": msg_id, "body": {"user_msg": message, "ai_msg": answer}})
+            everything.append((msg_id, message, answer))
+            store.append(session_id, conversation, msg_id, message, answer)
+            if store.needs_summary(conversation):
+                store.summarize(session_id, conversation, lambda summary, turns: f"{summary} {len(turns)} turns."[:400])
+        # a container that has not seen the session, reads summary and window back
+        start = time.perf_counter()
+        ConversationStore("events_table", dynamodb=dynamodb).load(session_id)
+        timings["cold"].append((time.perf_counter() - start) * 1000)
+
+    for name, samples in timings.items():
+        print(f"{name:8} p50 {percentile(samples, 50):7.3f} ms   p95 {percentile(samples, 95):7.3f} ms")
+    print(f"prompt history tokens, last turn: bounded {bounded[-1]}, full replay {replayed[-1]} "
+          f"(max {max(bounded)} vs {max(replayed)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+'''Compare embedding texts one call at a time (text_embedding, Python lists)
+with embed_batch for Titan (one text per request, run concurrently) and
+Cohere (96 texts per request), against a stub Bedrock with per-request
+latency. Also times turning the vectors into index ready ones.
+
+    python -m benchmarks.bench_embeddings --texts 500 --embed-ms 20
+'''
+import argparse
+import time
+
+from tests.fakes import FakeBedrockClient
+from utils.chatbot_utils import text_embedding
+from utils.embeddings import CohereProvider, TitanProvider, embed_batch
+from utils.index_profiles import get_index_profile, prepare_vector, prepare_vectors
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--texts", type=int, default=300)
+    parser.add_argument("--embed-ms", type=float, default=20)
+    parser.add_argument("--dimension", type=int, default=1024)
+    args = parser.parse_args()
+
+    texts = [f"chunk {i} of the synthetic retail manual, product sku-{i}" for i in range(args.texts)]
+    profile = get_index_profile("titan-v2-512-fp16")
+
+    def bedrock():
+        return FakeBedrockClient(latency=args.embed_ms / 1000, dimension=args.dimension)
+
+    serial_client = bedrock()
+    vectors, serial_secs = timed(lambda: [text_embedding(serial_client, text) for text in texts])
+    _, prepare_secs = timed(lambda: [prepare_vector(vector, profile) for vector in vectors])
+    print(f"one by one:    {args.texts / serial_secs:8.1f} texts/sec, {serial_client.calls} requests, "
+          f"prepare_vector {prepare_secs * 1000:.1f} ms")
+
+    for name, provider_class, model_id in [("titan batch", TitanProvider, "amazon.titan-embed-text-v1"),
+                                           ("cohere batch", CohereProvider, "cohere.embed-english-v3")]:
+        client = bedrock()
+        matrix, secs = timed(lambda: embed_batch(texts, provider_class(model_id, client=client)))
+        _, prepare_secs = timed(lambda: prepare_vectors(matrix, profile))
+        print(f"{name + ':':14} {args.texts / secs:8.1f} texts/sec, {client.calls} requests, "
+              f"prepare_vectors {prepare_secs * 1000:.1f} ms, speedup {serial_secs / secs:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+'''Wall clock of ingesting one large PDF in a single invocation versus
+fanned out over page range shards to N simulated workers. Workers are
+threads sharing fake DynamoDB/Bedrock/OpenSearch clients; Bedrock latency
+is simulated per call, so embedding overlaps across workers the way it does
+across Lambda invocations, while PDF parsing here stays on one CPU (in
+Lambda each worker has its own).
+
+    python -m benchmarks.bench_fan_out --pages 400 --workers 1,4,8 --latency 0.05
+'''
+import argparse
+import io
+import time
+
+from tests.fakes import FakeBedrockClient, FakeDynamoDb, FakeOpenSearch, LocalDispatcher, make_pdf
+from utils.chatbot_utils import text_embedding
+from utils.chunker import StructuredChunker
+from utils.document_manifest import InMemoryManifestStore
+from utils.ingestion_pipeline import ingest_document, iter_page_chunks, iter_pdf_pages
+from utils.ingestion_shards import ShardStore, coordinate, finalize, process_shard
+
+SOURCE = "s3://docs/manual.pdf"
+
+
+def single_invocation(pdf, split_fn, embed_fn):
+    client = FakeOpenSearch()
+    start = time.perf_counter()
+    chunks = iter_page_chunks(iter_pdf_pages(io.BytesIO(pdf)), split_fn)
+    stats = ingest_document(chunks, SOURCE, InMemoryManifestStore(), embed_fn, client, "docs-index")
+    return time.perf_counter() - start, stats["indexed"]
+
+
+def fanned_out(pdf, page_count, split_fn, embed_fn, workers, pages_per_shard):
+    shard_store = ShardStore("events_table", dynamodb=FakeDynamoDb())
+    manifests, client, finalized = InMemoryManifestStore(), FakeOpenSearch(), []
+
+    def worker(message):
+        done, total = process_shard(message, io.BytesIO(pdf), split_fn, embed_fn, shard_store)
+        if done == total and shard_store.claim_finalize(SOURCE, message["run_id"], f"worker-{message['shard']}"):
+            finalized.append(finalize(SOURCE, message["run_id"], shard_store, manifests, client, "docs-index"))
+
+    dispatcher = LocalDispatcher(worker, workers=workers)
+    start = time.perf_counter()
+    shards = coordinate("docs", "manual.pdf", SOURCE, page_count, "run-1", shard_store, dispatcher, pages_per_shard)
+    dispatcher.results()
+    return time.perf_counter() - start, finalized[0]["indexed"], shards
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--pages-per-shard", type=int, default=50)
+    parser.add_argument("--workers", default="1,4,8")
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    pdf = make_pdf(args.pages, lines_per_page=30,
+                   line_text="Store manual page {page} line {line} explains returns, refunds and warranty claims.")
+    bedrock = FakeBedrockClient(latency=args.latency)
+    embed_fn = lambda text: text_embedding(bedrock, text)
+    split_fn = StructuredChunker().split_text
+
+    baseline, indexed = single_invocation(pdf, split_fn, embed_fn)
+    print(f"{args.pages} pages, {indexed} chunks, {args.latency * 1000:.0f} ms per embedding call")
+    print(f"{'single invocation':24} {baseline:7.2f} s")
+    for workers in (int(n) for n in args.workers.split(",")):
+        seconds, fanned_indexed, shards = fanned_out(pdf, args.pages, split_fn, embed_fn, workers,
+                                                     args.pages_per_shard)
+        assert fanned_indexed == indexed
+        print(f"{f'{shards} shards, {workers} workers':24} {seconds:7.2f} s   speedup {baseline / seconds:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+'''Compare the serial embed + index() loop with the batched ingestion pipeline
+against a stub embedder and a stub OpenSearch with per-request latency.
+
+    python -m benchmarks.bench_ingestion --chunks 500 --embed-ms 20 --index-ms 10
+'''
+import argparse
+import time
+
+from tests.fakes import FakeBedrockClient, FakeOpenSearch
+from utils.chatbot_utils import text_embedding
+from utils.ingestion_pipeline import ingest_chunks
+
+
+def serial_ingest(texts, embed_fn, client, index_name):
+    for text in texts:
+        client.index(index=index_name, body={"doc_text": text, "doc_vector": embed_fn(text)})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=300)
+    parser.add_argument("--embed-ms", type=float, default=20)
+    parser.add_argument("--index-ms", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    texts = [f"chunk {i} of the synthetic retail manual, product sku-{i}" for i in range(args.chunks)]
+    bedrock = FakeBedrockClient(latency=args.embed_ms / 1000)
+    embed_fn = lambda text: text_embedding(bedrock, text)
+
+    serial_client = FakeOpenSearch(latency=args.index_ms / 1000)
+    start = time.perf_counter()
+    serial_ingest(texts, embed_fn, serial_client, "docs-index")
+    serial_secs = time.perf_counter() - start
+
+    pipeline_client = FakeOpenSearch(latency=args.index_ms / 1000)
+    stats = ingest_chunks(({"doc_text": t} for t in texts), embed_fn, pipeline_client, "docs-index", embed_workers=args.workers)
+
+    print(f"serial:   {args.chunks / serial_secs:8.1f} chunks/sec, {serial_client.requests} index requests")
+    print(f"pipeline: {args.chunks / stats['seconds']:8.1f} chunks/sec, {pipeline_client.requests} bulk requests")
+    print(f"speedup:  {serial_secs / stats['seconds']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
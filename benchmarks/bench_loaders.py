@@ -0,0 +1,79 @@
+'''Parse throughput per document format: a synthetic store manual of about
+the same text rendered as PDF, HTML, Markdown, DOCX, CSV and plain text,
+loaded, split with the StructuredChunker and timed (no embedding calls).
+
+    python -m benchmarks.bench_loaders --sections 400
+'''
+import argparse
+import html
+import io
+import random
+import time
+import zipfile
+
+from tests.fakes import make_pdf
+from utils.chunker import StructuredChunker
+from utils.ingestion_pipeline import iter_page_chunks
+from utils.loaders import load_pages
+from benchmarks.corpus import CATEGORIES, FEATURES, POLICIES
+
+W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+
+def manual(sections, seed=7):
+    rng = random.Random(seed)
+    for n in range(sections):
+        heading = f"{n + 1} {rng.choice(CATEGORIES).title()} {rng.choice(['Returns', 'Warranty', 'Care'])}"
+        paragraphs = [" ".join(f"A {rng.choice(FEATURES)} {rng.choice(CATEGORIES)} is covered. {rng.choice(POLICIES)}"
+                               for _ in range(rng.randint(2, 5))) for _ in range(rng.randint(2, 4))]
+        yield heading, paragraphs
+
+
+def render(name, sections):
+    if name == "pdf":
+        lines = [[heading] + [line for p in paragraphs for line in (p[i:i + 95] for i in range(0, len(p), 95))]
+                 for heading, paragraphs in sections]
+        return make_pdf(len(lines), page_lines=lambda page: lines[page])
+    if name == "html":
+        body = "".join(f"<h2>{html.escape(h)}</h2>" + "".join(f"<p>{html.escape(p)}</p>" for p in ps)
+                       for h, ps in sections)
+        return f"<html><body><nav>Home | Shop</nav>{body}<footer>Copyright</footer></body></html>".encode()
+    if name == "markdown":
+        return "".join(f"## {h}\n\n" + "".join(f"{p}\n\n" for p in ps) for h, ps in sections).encode()
+    if name == "docx":
+        paragraph = '<w:p>{}<w:r><w:t>{}</w:t></w:r></w:p>'
+        body = "".join(paragraph.format('<w:pPr><w:pStyle w:val="Heading2"/></w:pPr>', html.escape(h)) +
+                       "".join(paragraph.format("", html.escape(p)) for p in ps) for h, ps in sections)
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("word/document.xml", f'<w:document xmlns:w="{W}"><w:body>{body}</w:body></w:document>')
+        return data.getvalue()
+    if name == "csv":
+        rows = "".join(f'"{h}",{n},"{p}"\n' for h, ps in sections for n, p in enumerate(ps))
+        return ("section,paragraph,text\n" + rows).encode()
+    return "".join(f"{h}\n\n" + "".join(f"{p}\n\n" for p in ps) for h, ps in sections).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sections", type=int, default=400)
+    parser.add_argument("--formats", default="pdf,html,markdown,docx,csv,text")
+    args = parser.parse_args()
+    sections = list(manual(args.sections))
+    split = StructuredChunker().split_text
+
+    for name in args.formats.split(","):
+        data = render(name, sections)
+        start = time.perf_counter()
+        pages, chunks, characters = set(), 0, 0
+        for chunk in iter_page_chunks(load_pages(io.BytesIO(data), name), split):
+            pages.add(chunk["doc_page"])
+            chunks += 1
+            characters += len(chunk["doc_text"])
+        seconds = time.perf_counter() - start
+        print(f"{name:9} {len(data) / 2 ** 20:6.2f} MB   {len(pages):5} pages/sections   {chunks:6} chunks   "
+              f"{seconds:6.2f} s   {len(data) / 2 ** 20 / seconds:7.2f} MB/s   {characters / seconds / 1000:8.0f} k chars/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+'''Recall, context size and per-query latency of the rerank stage over the
+fixture corpus: fixed k=2 retrieval as before versus over-fetching
+candidates and reranking with an adaptive k.
+
+    python -m benchmarks.bench_rerank --candidates 10 --max-k 5
+'''
+import argparse
+import statistics
+import time
+
+from tests.fakes import hash_embedding
+from utils.local_vector_store import LocalVectorStore
+from utils.reranker import rerank
+from benchmarks.corpus import build_corpus
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--candidates", type=int, default=10)
+    parser.add_argument("--max-k", type=int, default=5)
+    parser.add_argument("--mode", default="knn", choices=["knn", "hybrid"])
+    args = parser.parse_args()
+
+    documents, questions = build_corpus(args.products)
+    store = LocalVectorStore(dimension=256)
+    store.add_many([d["chunk_id"] for d in documents], [hash_embedding(d["doc_text"], 256) for d in documents],
+                   documents)
+
+    fixed_found, found, kept, durations = 0, 0, [], []
+    for question, expected in questions:
+        vector = hash_embedding(question, 256)
+        fixed = store.search(vector, 2, query_text=question, mode=args.mode, size=2)["hits"]["hits"]
+        fixed_found += any(hit["_id"] == expected for hit in fixed)
+        candidates = store.search(vector, args.candidates, query_text=question, mode=args.mode,
+                                  size=args.candidates)["hits"]["hits"]
+        start = time.perf_counter()
+        hits = rerank(question, candidates, max_k=args.max_k)
+        durations.append((time.perf_counter() - start) * 1000)
+        found += any(hit["_id"] == expected for hit in hits)
+        kept.append(len(hits))
+
+    print(f"{args.mode} retrieval, {len(questions)} questions")
+    print(f"fixed k=2          recall {fixed_found / len(questions):.2f}   k 2")
+    print(f"rerank {args.candidates:>2} -> k    recall {found / len(questions):.2f}   "
+          f"mean k {statistics.mean(kept):.2f}   rerank p50 {statistics.median(durations):.2f} ms   "
+          f"p99 {percentile(durations, 99):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
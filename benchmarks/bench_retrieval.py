@@ -0,0 +1,42 @@
+'''Recall@k and latency of search_index in knn and hybrid mode over the
+fixture corpus in benchmarks/corpus.py.
+
+    python -m benchmarks.bench_retrieval --products 500 --k 2
+'''
+import argparse
+import statistics
+import time
+
+from tests.fakes import FakeOpenSearch, hash_embedding
+from utils.chatbot_utils import search_index
+from benchmarks.corpus import build_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--k", type=int, default=2)
+    parser.add_argument("--dimension", type=int, default=256)
+    args = parser.parse_args()
+
+    documents, questions = build_corpus(args.products)
+    client = FakeOpenSearch()
+    for doc in documents:
+        client.index("docs-index", dict(doc, doc_vector=hash_embedding(doc["doc_text"], args.dimension)),
+                     id=doc["chunk_id"])
+
+    for mode in ("knn", "hybrid"):
+        found, durations = 0, []
+        for question, expected in questions:
+            vector = hash_embedding(question, args.dimension)
+            start = time.perf_counter()
+            hits = search_index(client, "docs-index", vector, no_of_results=args.k,
+                                query_text=question, mode=mode, size=args.k)['hits']['hits']
+            durations.append((time.perf_counter() - start) * 1000)
+            found += any(hit["_id"] == expected for hit in hits)
+        print(f"{mode:8} recall@{args.k} {found / len(questions):.2f}   "
+              f"p50 {statistics.median(durations):6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
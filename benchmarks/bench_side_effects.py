@@ -0,0 +1,64 @@
+'''p50/p99 duration of ws_message_handler for a MESSAGE with the post-response
+side effects (event echo, DynamoDB log, EventBridge publish) run serially, as
+before, versus in the background SideEffects pool.
+
+    python -m benchmarks.bench_side_effects --requests 200
+'''
+import argparse
+import statistics
+import time
+
+from tests.fakes import (FakeBedrockClient, FakeDynamoDb, FakeEventsClient, FakeOpenSearch,
+                         FakeWebSocketClient, install_fakes, load_lambda, websocket_event)
+
+
+class SerialSideEffects:
+    '''The previous behaviour: every side effect runs inline when submitted'''
+
+    def submit(self, name, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+    def wait(self, timeout):
+        return {}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(app, requests):
+    durations = []
+    for i in range(requests):
+        start = time.perf_counter()
+        app.lambda_handler(websocket_event(f"conn-{i % 10}", body=f"question {i} about returns"), None)
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations), percentile(durations, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--dynamodb-ms", type=float, default=15)
+    parser.add_argument("--events-ms", type=float, default=25)
+    parser.add_argument("--post-ms", type=float, default=10)
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ("serial", "background"):
+        install_fakes(bedrock=FakeBedrockClient(latency=0.005),
+                      opensearch=FakeOpenSearch(),
+                      websocket=FakeWebSocketClient(latency=args.post_ms / 1000),
+                      events=FakeEventsClient(latency=args.events_ms / 1000),
+                      dynamodb=FakeDynamoDb(latency=args.dynamodb_ms / 1000))
+        app = load_lambda("ws_message_handler", QUERY_CACHE_SIZE="1")
+        if mode == "serial":
+            app.SideEffects = SerialSideEffects
+        results[mode] = run(app, args.requests)
+
+    for mode, (p50, p99) in results.items():
+        print(f"{mode:12} p50 {p50:7.1f} ms   p99 {p99:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+'''Query latency of LocalVectorStore brute force versus the IVF index, with
+IVF recall@k measured against the brute force results.
+
+    python -m benchmarks.bench_vector_store --sizes 10000,100000,1000000 --dimension 128
+'''
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from utils.local_vector_store import LocalVectorStore
+
+
+def clustered_vectors(rng, centres, count, batch=100000):
+    for i in range(0, count, batch):
+        n = min(batch, count - i)
+        yield (centres[rng.integers(len(centres), size=n)]
+               + 0.5 * rng.normal(size=(n, centres.shape[1]))).astype(np.float32)
+
+
+def timed_queries(store, queries, k, exact):
+    durations, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = store.search(query, k, size=k, exact=exact)["hits"]["hits"]
+        durations.append((time.perf_counter() - start) * 1000)
+        results.append({hit["_id"] for hit in hits})
+    return statistics.median(durations), results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--dimension", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=8)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centres = rng.normal(size=(256, args.dimension))
+    queries = next(clustered_vectors(rng, centres, args.queries))
+    for size in (int(s) for s in args.sizes.split(",")):
+        store = LocalVectorStore(args.dimension, capacity=size, lexical=False)
+        added = 0
+        for batch in clustered_vectors(rng, centres, size):
+            store.add_many([str(added + i) for i in range(len(batch))], batch, [{}] * len(batch))
+            added += len(batch)
+        start = time.perf_counter()
+        store.build_ivf(nprobe=args.nprobe)
+        build_seconds = time.perf_counter() - start
+
+        brute_ms, exact = timed_queries(store, queries, args.k, exact=True)
+        ivf_ms, approx = timed_queries(store, queries, args.k, exact=False)
+        recall = statistics.mean(len(e & a) / args.k for e, a in zip(exact, approx))
+        print(f"{size:>9} vectors   brute force p50 {brute_ms:7.2f} ms   ivf p50 {ivf_ms:6.2f} ms   "
+              f"recall@{args.k} {recall:.2f}   ivf build {build_seconds:5.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+'''Import cost of each Lambda handler, measured the way a cold start pays
+it: a fresh interpreter running `import app` from the function directory
+with -X importtime. Reports the wall time of the import (module level
+clients included) and the self time per top-level package.
+
+Modules in DEFERRED must not be loaded by the import, they belong to the
+first request that needs them. With --baseline the wall times are compared
+against a previous run written with --write-baseline, and the script exits
+non-zero on a regression, so it can gate a build:
+
+    python -m benchmarks.cold_start --write-baseline cold_start_baseline.json
+    python -m benchmarks.cold_start --baseline cold_start_baseline.json
+'''
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import Counter
+
+from tests.fakes import HANDLER_ENV
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDAS = os.path.join(ROOT, "streaming_bot_websockets", "lambdas")
+
+HANDLERS = ["ws_message_handler", "vectordb_ingestion_handler", "sentiment_analysis_message_handler",
+            "billing_message_handler"]
+
+DEFERRED = {
+    "ws_message_handler": ["opensearchpy", "requests", "numpy", "pypdf", "langchain"],
+    "vectordb_ingestion_handler": ["opensearchpy", "requests", "numpy", "pypdf", "langchain"],
+    "sentiment_analysis_message_handler": ["opensearchpy", "requests", "numpy", "pypdf", "langchain"],
+    "billing_message_handler": ["boto3", "botocore"],
+}
+
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+PROBE = ("import json, sys, time\n"
+         "start = time.perf_counter()\n"
+         "import app\n"
+         "print(json.dumps({'wall_ms': (time.perf_counter() - start) * 1000,\n"
+         "                  'modules': sorted({name.split('.')[0] for name in sys.modules})}))\n")
+
+
+def import_profile(handler):
+    '''Import a handler in a fresh interpreter, returns wall_ms, loaded packages and self time per package'''
+    env = dict(os.environ, **HANDLER_ENV)
+    env.update(LLM_STREAMING_ENABLED="YES",
+               PYTHONPATH=os.path.join(ROOT, "streaming_bot_websockets"))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=os.path.join(LAMBDAS, handler),
+                            env=env, capture_output=True, text=True, check=True)
+    self_us = Counter()
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match:
+            self_us[match.group(4).split(".")[0]] += int(match.group(1))
+    profile = json.loads(result.stdout.strip().splitlines()[-1])
+    profile["self_ms"] = {name: us / 1000 for name, us in self_us.most_common()}
+    profile["deferred_loaded"] = [name for name in DEFERRED.get(handler, []) if name in profile["modules"]]
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--handlers", default=",".join(HANDLERS))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=6)
+    parser.add_argument("--baseline")
+    parser.add_argument("--write-baseline")
+    parser.add_argument("--tolerance", type=float, default=1.3)
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results, regressions = {}, []
+    for handler in args.handlers.split(","):
+        # the fastest run is the least disturbed by the rest of the machine
+        profile = min((import_profile(handler) for _ in range(args.runs)), key=lambda p: p["wall_ms"])
+        results[handler] = round(profile["wall_ms"], 1)
+        top = ", ".join(f"{name} {ms:.0f}" for name, ms in list(profile["self_ms"].items())[:args.top])
+        print(f"{handler:36} import {profile['wall_ms']:7.1f} ms   by package (ms): {top}")
+        if profile["deferred_loaded"]:
+            regressions.append(f"{handler} imports {', '.join(profile['deferred_loaded'])} at load")
+        if handler in baseline and profile["wall_ms"] > baseline[handler] * args.tolerance:
+            regressions.append(f"{handler} import {profile['wall_ms']:.1f} ms, baseline {baseline[handler]:.1f} ms")
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
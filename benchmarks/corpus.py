@@ -0,0 +1,41 @@
+'''Deterministic retail fixture corpus for the retrieval benchmarks: product
+pages that share most of their wording and differ by SKU, plus policy pages,
+with questions that name the product they are about.'''
+import random
+
+CATEGORIES = ["jacket", "backpack", "tent", "boots", "stove", "lantern", "sleeping bag", "water filter"]
+FEATURES = ["waterproof", "lightweight", "insulated", "packable", "recycled", "reinforced", "breathable"]
+POLICIES = [
+    "Returns are accepted within 30 days of delivery with the original receipt.",
+    "Standard shipping takes 3 to 5 business days, express shipping takes 1 to 2.",
+    "Gift cards cannot be exchanged for cash and do not expire.",
+    "Items bought on clearance are final sale and cannot be returned.",
+    "Price matching applies to identical items sold by authorised retailers.",
+]
+
+
+def build_corpus(products=500, seed=7):
+    """
+    Returns (documents, questions). Documents are dicts with doc_text and
+    chunk_id, questions are (question, expected chunk_id) pairs.
+    """
+    rng = random.Random(seed)
+    documents, questions = [], []
+    for n in range(products):
+        sku = f"sku-{10000 + n * 37}"
+        category = rng.choice(CATEGORIES)
+        features = " ".join(rng.sample(FEATURES, 3))
+        warranty = rng.choice([1, 2, 5])
+        text = (f"Product {sku} is a {features} {category}. It comes with a {warranty} year warranty "
+                f"and can be returned within 30 days. Care instructions for the {category} are on the label.")
+        documents.append({"chunk_id": f"product-{n}", "doc_text": text, "doc_page": n // 10 + 1})
+        if n % 5 == 0:
+            questions.append((f"what is the warranty on {sku}", f"product-{n}"))
+    for n, policy in enumerate(POLICIES):
+        documents.append({"chunk_id": f"policy-{n}", "doc_text": policy, "doc_page": 1})
+    questions.extend([
+        ("how many days do I have to return an item", "policy-0"),
+        ("how long does express shipping take", "policy-1"),
+        ("can I exchange a gift card for cash", "policy-2"),
+    ])
+    return documents, questions
@@ -0,0 +1,116 @@
+'''Replay the fixture query set against each index profile and report
+recall@k, query latency and vector storage, to pick a profile with data.
+
+Offline (default) the embeddings come from the hash embedder at each
+profile's dimension and the profile's encoding is applied locally, which
+shows the recall cost of fp16/byte vectors. The hash embedder collides
+more at low dimensions than a trained model does, so judge the Titan v2
+dimension profiles from an online run:
+
+    python -m benchmarks.eval_index_profiles --profiles default,faiss-fp16,titan-v2-256-byte
+
+Against a real collection each profile gets its own eval-<profile> index
+and real Bedrock embeddings, and --ef-search sweeps the search setting:
+
+    python -m benchmarks.eval_index_profiles --endpoint https://<collection>.aoss.amazonaws.com \
+        --region us-east-1 --ef-search 32,100,512
+'''
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from tests.fakes import hash_embedding
+from utils.chatbot_utils import get_client, get_opensearch_client, search_index, text_embedding
+from utils.index_profiles import INDEX_PROFILES, embedding_dimensions, get_index_profile, index_body, \
+                                 prepare_vector, vector_storage_bytes
+from utils.ingestion_pipeline import bulk_index
+from benchmarks.corpus import build_corpus
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def encode(vectors, profile):
+    '''What the index would store: fp16 round trip or the int8 values'''
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if profile["encoder"] == "fp16":
+        return matrix.astype(np.float16).astype(np.float32)
+    return matrix
+
+
+def evaluate_offline(profile, documents, questions, k):
+    embed = lambda text: prepare_vector(hash_embedding(text, profile["dimension"]), profile)
+    matrix = encode([embed(d["doc_text"]) for d in documents], profile)
+    ids = [d["chunk_id"] for d in documents]
+    found, durations = 0, []
+    for question, expected in questions:
+        query = np.asarray(embed(question), dtype=np.float32)
+        start = time.perf_counter()
+        scores = matrix @ query
+        best = np.argpartition(-scores, k)[:k]
+        durations.append((time.perf_counter() - start) * 1000)
+        found += expected in {ids[i] for i in best}
+    return found / len(questions), durations
+
+
+def evaluate_online(profile, documents, questions, k, client, bedrock, ef_search):
+    index_name = f"eval-{profile['name']}"
+    embed = lambda text: prepare_vector(text_embedding(bedrock, text, model_id=profile["embedding_model_id"],
+                                                       dimensions=embedding_dimensions(profile)), profile)
+    if not client.indices.exists(index=index_name):
+        client.indices.create(index=index_name, body=index_body(profile))
+        actions = ({"_index": index_name, "_id": d["chunk_id"], "_source": dict(d, doc_vector=embed(d["doc_text"]))}
+                   for d in documents)
+        print(f"Indexed {bulk_index(client, actions)[0]} documents into {index_name}")
+    try:
+        client.indices.put_settings(index=index_name, body={"index": {"knn.algo_param.ef_search": ef_search}})
+    except Exception as ex:
+        print(f"Could not set ef_search {ef_search} on {index_name}, measuring the current setting: {ex}")
+    found, durations = 0, []
+    for question, expected in questions:
+        vector = embed(question)
+        start = time.perf_counter()
+        hits = search_index(client, index_name, vector, no_of_results=k, size=k)['hits']['hits']
+        durations.append((time.perf_counter() - start) * 1000)
+        found += expected in {hit["_id"] for hit in hits}
+    return found / len(questions), durations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", default=",".join(INDEX_PROFILES))
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--endpoint")
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--ef-search", default="")
+    args = parser.parse_args()
+
+    documents, questions = build_corpus(args.products)
+    if args.endpoint:
+        client = get_opensearch_client(args.endpoint, args.region)
+        bedrock = get_client('bedrock-runtime', region_name=args.region)
+
+    print(f"{len(documents)} documents, {len(questions)} questions, recall@{args.k}")
+    for name in args.profiles.split(","):
+        profile = get_index_profile(name)
+        storage_mb = vector_storage_bytes(profile, 1_000_000) / 2 ** 20
+        sweeps = [int(v) for v in args.ef_search.split(",") if v] or [profile["ef_search"]]
+        for ef_search in sweeps:
+            if args.endpoint:
+                recall, durations = evaluate_online(profile, documents, questions, args.k, client, bedrock, ef_search)
+            else:
+                recall, durations = evaluate_offline(profile, documents, questions, args.k)
+            print(f"{name:20} ef_search {ef_search:4}   recall {recall:.2f}   "
+                  f"p50 {statistics.median(durations):7.2f} ms   p99 {percentile(durations, 99):7.2f} ms   "
+                  f"{storage_mb:6.0f} MB per 1M vectors")
+            if not args.endpoint:
+                break
+
+
+if __name__ == "__main__":
+    main()
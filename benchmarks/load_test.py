@@ -0,0 +1,233 @@
+'''End to end load test of the handlers against in-process stand-ins:
+Bedrock with configurable latency and throttling, a local kNN store (or
+the fake OpenSearch), a recording post_to_connection and in-memory
+DynamoDB, EventBridge and S3.
+
+The ingestion handler is driven with S3 ObjectCreated events for a mix of
+PDF, Markdown and HTML documents, then ws_message_handler with MESSAGE
+events from `--concurrency` threads. Reports requests/sec, p50/p95/p99 of
+every stage (from the handlers' EMF records) and peak traced memory.
+
+    python -m benchmarks.load_test --requests 300 --concurrency 4
+    python -m benchmarks.load_test --write-baseline benchmarks/load_test_baseline.json
+    python -m benchmarks.load_test --baseline benchmarks/load_test_baseline.json
+
+With --baseline the run fails (exit 1) when requests/sec drops, or a
+stage's p95 grows, by more than --tolerance.
+'''
+import argparse
+import contextlib
+import html
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from tests.fakes import (FakeBedrockClient, FakeDynamoDb, FakeEventsClient, FakeOpenSearch, FakeS3Client,
+                         FakeWebSocketClient, install_fakes, load_lambda, make_pdf, s3_event, websocket_event)
+from utils.chatbot_utils import Trace
+from utils.vector_store import close_vector_stores
+from benchmarks.corpus import build_corpus
+
+BUCKET = "knowledge-bucket"
+FORMATS = ["pdf", "markdown", "html"]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def render_documents(documents, files):
+    '''Spread the corpus over `files` objects, one section (or PDF page) per product'''
+    for n in range(files):
+        sections = documents[n::files]
+        name = FORMATS[n % len(FORMATS)]
+        if name == "pdf":
+            key = f"manuals/manual-{n}.pdf"
+            body = make_pdf(len(sections), page_lines=lambda page: [f"Product Sheet {sections[page]['chunk_id']}",
+                                                                    sections[page]["doc_text"]])
+            yield key, body, "application/pdf"
+        elif name == "markdown":
+            text = "".join(f"## Product Sheet {d['chunk_id']}\n\n{d['doc_text']}\n\n" for d in sections)
+            yield f"manuals/manual-{n}.md", text.encode(), "text/markdown"
+        else:
+            text = "".join(f"<h2>Product Sheet {d['chunk_id']}</h2><p>{html.escape(d['doc_text'])}</p>"
+                           for d in sections)
+            yield f"manuals/manual-{n}.html", f"<html><body>{text}</body></html>".encode(), "text/html"
+
+
+@contextlib.contextmanager
+def collect_traces():
+    '''EMF records the handlers emit, collected instead of printed, with the rest of stdout discarded'''
+    records, lock = [], threading.Lock()
+    original = Trace.emit
+
+    def emit(self):
+        record = self.emf()
+        with lock:
+            records.append(record)
+        return record
+
+    Trace.emit = emit
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield records
+    finally:
+        Trace.emit = original
+
+
+def stage_percentiles(records):
+    stages = {}
+    for record in records:
+        for name, value in record.items():
+            if name.endswith("_ms") and isinstance(value, (int, float)):
+                stages.setdefault(name, []).append(value)
+    return {name: {"p50": round(percentile(v, 50), 2), "p95": round(percentile(v, 95), 2),
+                   "p99": round(percentile(v, 99), 2)} for name, v in sorted(stages.items())}
+
+
+def run_phase(fn, items, concurrency):
+    '''Run fn over items on `concurrency` threads, returns per call durations, errors and wall time'''
+    durations, errors = [], []
+
+    def call(item):
+        start = time.perf_counter()
+        try:
+            fn(item)
+        except Exception as ex:
+            errors.append(repr(ex))
+        durations.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, items))
+    return durations, errors, time.perf_counter() - start
+
+
+def summarize(durations, errors, seconds, records, peak_bytes):
+    return {"requests": len(durations), "errors": len(errors), "requests_per_sec": round(len(durations) / seconds, 2),
+            "latency_ms": {"p50": round(percentile(durations, 50), 2), "p95": round(percentile(durations, 95), 2),
+                           "p99": round(percentile(durations, 99), 2)},
+            "stages": stage_percentiles(records), "peak_traced_mb": round(peak_bytes / 2 ** 20, 2)}
+
+
+def run_load_test(requests=300, concurrency=4, files=12, products=240, vector_store="local", embed_ms=20,
+                  token_ms=2, tokens=60, throttles=0, post_ms=5, dynamodb_ms=5, events_ms=10, s3_ms=20,
+                  streaming="YES", bedrock_rps=1000):
+    documents, questions = build_corpus(products)
+    fakes = install_fakes(bedrock=FakeBedrockClient(latency=embed_ms / 1000, dimension=512, throttles=throttles,
+                                                    stream_tokens=tokens, token_delay=token_ms / 1000),
+                          opensearch=FakeOpenSearch(), websocket=FakeWebSocketClient(latency=post_ms / 1000),
+                          events=FakeEventsClient(latency=events_ms / 1000),
+                          dynamodb=FakeDynamoDb(latency=dynamodb_ms / 1000), s3=FakeS3Client(latency=s3_ms / 1000))
+    keys = []
+    for key, body, content_type in render_documents(documents, files):
+        fakes["s3"].put_object(Bucket=BUCKET, Key=key, Body=body, ContentType=content_type)
+        keys.append(key)
+
+    results, saved_environ = {}, dict(os.environ)
+    with tempfile.TemporaryDirectory() as path, collect_traces() as records:
+        env = {"VECTOR_STORE": vector_store, "LOCAL_VECTOR_STORE_PATH": path, "INDEX_PROFILE": "titan-v2-512-fp16",
+               "LLM_STREAMING_ENABLED": streaming, "PARSE_WORKERS": "1", "RETRIEVAL_MODE": "hybrid",
+               "RERANK_ENABLED": "YES", "BEDROCK_MAX_RPS": str(bedrock_rps)}
+        close_vector_stores()
+        ingestion = load_lambda("vectordb_ingestion_handler", **env)
+        ws = load_lambda("ws_message_handler", **env)
+        try:
+            tracemalloc.start()
+            durations, errors, seconds = run_phase(lambda key: ingestion.lambda_handler(s3_event(BUCKET, key), None),
+                                                   keys, 1)
+            results["ingest"] = summarize(durations, errors, seconds, list(records), tracemalloc.get_traced_memory()[1])
+            del records[:]
+            tracemalloc.reset_peak()
+
+            messages = [questions[i % len(questions)][0] + ("" if i < len(questions) else f" (ask {i})")
+                        for i in range(requests)]
+            durations, errors, seconds = run_phase(
+                lambda i: ws.lambda_handler(websocket_event(f"conn-{i % 50}", body=messages[i]), None),
+                range(requests), concurrency)
+            results["query"] = summarize(durations, errors, seconds, list(records), tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+            close_vector_stores()
+            # load_lambda sets the handler environment for the whole process
+            os.environ.clear()
+            os.environ.update(saved_environ)
+    results["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for phase in ("ingest", "query"):
+        if phase not in baseline:
+            continue
+        current, previous = results[phase], baseline[phase]
+        if current["requests_per_sec"] < previous["requests_per_sec"] / tolerance:
+            found.append(f"{phase} requests/sec {current['requests_per_sec']} vs {previous['requests_per_sec']}")
+        for stage, values in current["stages"].items():
+            before = previous["stages"].get(stage)
+            # sub-millisecond stages are noise, allow 1ms on top of the tolerance
+            if before and values["p95"] > before["p95"] * tolerance + 1:
+                found.append(f"{phase} {stage} p95 {values['p95']} ms vs {before['p95']} ms")
+        if current["errors"] > previous["errors"]:
+            found.append(f"{phase} errors {current['errors']} vs {previous['errors']}")
+    return found
+
+
+def report(results):
+    for phase in ("ingest", "query"):
+        r = results[phase]
+        print(f"{phase}: {r['requests']} requests, {r['errors']} errors, {r['requests_per_sec']} req/s, "
+              f"p50 {r['latency_ms']['p50']} ms, p95 {r['latency_ms']['p95']} ms, p99 {r['latency_ms']['p99']} ms, "
+              f"peak traced {r['peak_traced_mb']} MB")
+        for stage, values in r["stages"].items():
+            print(f"    {stage:20} p50 {values['p50']:9.2f}   p95 {values['p95']:9.2f}   p99 {values['p99']:9.2f}")
+    print(f"max RSS {results['max_rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--files", type=int, default=12)
+    parser.add_argument("--products", type=int, default=240)
+    parser.add_argument("--vector-store", default="local", choices=["local", "opensearch"])
+    parser.add_argument("--embed-ms", type=float, default=20)
+    parser.add_argument("--token-ms", type=float, default=2)
+    parser.add_argument("--tokens", type=int, default=60)
+    parser.add_argument("--throttles", type=int, default=0, help="Bedrock calls to throttle before succeeding")
+    parser.add_argument("--post-ms", type=float, default=5)
+    parser.add_argument("--dynamodb-ms", type=float, default=5)
+    parser.add_argument("--events-ms", type=float, default=10)
+    parser.add_argument("--s3-ms", type=float, default=20)
+    parser.add_argument("--streaming", default="YES", choices=["YES", "NO"])
+    parser.add_argument("--bedrock-rps", type=float, default=1000, help="Token bucket rate per model")
+    parser.add_argument("--baseline")
+    parser.add_argument("--write-baseline")
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    args = parser.parse_args()
+
+    results = run_load_test(args.requests, args.concurrency, args.files, args.products, args.vector_store,
+                            args.embed_ms, args.token_ms, args.tokens, args.throttles, args.post_ms,
+                            args.dynamodb_ms, args.events_ms, args.s3_ms, args.streaming, args.bedrock_rps)
+    report(results)
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION: {regression}")
+        sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
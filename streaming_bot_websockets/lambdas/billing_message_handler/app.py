@@ -1,5 +1,4 @@
 import json
-import boto3 
 
 def lambda_handler(event, context):
     response = {"statusCode": 200}
@@ -1,7 +1,7 @@
 import json
-import boto3 
 import os
-from utils.chatbot_utils import invoke_model,log_to_db
+from utils.chatbot_utils import invoke_model,log_to_db,get_client
+from utils.bedrock_calls import resilient_client
 
 
 
@@ -20,7 +20,7 @@ def lambda_handler(event, context):
                  language - two letter code of the language \
                  emotion - happy,sad \
                  <msg>{user_msg}</msg>"
-        bedrock_client = bedrock_client = boto3.client(service_name='bedrock-runtime')
+        bedrock_client = resilient_client(get_client('bedrock-runtime'))
         senti_analysis_response =invoke_model(bedrock_client,prompt)
         json_evt = json.loads(senti_analysis_response)
         log_to_db(pk=session_id,
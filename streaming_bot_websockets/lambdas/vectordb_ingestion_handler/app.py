@@ -1,60 +1,56 @@
 import json
-import boto3 
 import os
 import urllib.parse
-from langchain.document_loaders import PyPDFLoader
-from langchain.text_splitter import CharacterTextSplitter
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth, helpers
-
-bedrock = boto3.client(
- service_name='bedrock-runtime'
-)
-host = urllib.parse.urlparse(os.environ['OPENSEARCH_EP']).netloc #replace this with the value from the AWS Management Console
+from uuid import uuid4
+from utils.ingestion_pipeline import ingest_document, remove_document, iter_page_chunks, \
+                                     pdf_page_count, spool_s3_object
+from utils.loaders import document_format, load_pages
+from utils.ingestion_shards import ShardStore, SHARD_EVENT_SOURCE, coordinate, eventbridge_dispatcher, \
+                                   finalize, process_shard
+from utils.chunker import StructuredChunker, strip_boilerplate
+from utils.embedding_cache import EmbeddingCache, DynamoDbEmbeddingStore
+from utils.document_manifest import DynamoDbManifestStore, document_source
+from utils.query_cache import IndexGeneration
+from utils.index_profiles import get_index_profile, embedding_dimensions, embedding_cache_key, prepare_vectors, \
+                                 index_body as index_body_for_profile
+from utils.embeddings import embed_batch, embedding_provider
+from utils.chatbot_utils import get_client, Trace
+from utils.bedrock_calls import resilient_client
+from utils.connections import publish_broadcast
+from utils.vector_store import open_vector_store, OpenSearchVectorStore
+
 region = os.environ['AWS_DEFAULT_REGION']
-service = "aoss"
-credentials = boto3.Session().get_credentials()
-auth = AWSV4SignerAuth(credentials, region, service)
 index_name = "docs-index"
-
-
-client = OpenSearch(
-    hosts = [{"host": host, "port": 443}],
-    http_auth = auth,
-    use_ssl = True,
-    verify_certs = True,
-    connection_class = RequestsHttpConnection,
-    pool_maxsize = 20
-)
+index_profile = get_index_profile()
+embedding_model_id = index_profile['embedding_model_id']
+events_table_name = os.environ['EVENTS_TABLE_NAME']
+event_bus_name = os.environ.get('EVENT_BUS_NAME')
+embedding_cache_enabled = os.environ.get("EMBEDDING_CACHE_ENABLED", "NO")
+chunk_target_tokens = int(os.environ.get("CHUNK_TARGET_TOKENS", "200"))
+chunk_overlap_tokens = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "30"))
+'''Page parsing processes, Lambda gets a second vCPU from 1769MB of memory'''
+parse_workers = int(os.environ.get("PARSE_WORKERS", str(os.cpu_count() or 1)))
+'''Documents of at least FAN_OUT_MIN_PAGES are split into shards ingested by parallel invocations'''
+fan_out_enabled = os.environ.get("INGEST_FAN_OUT_ENABLED", "NO")
+fan_out_min_pages = int(os.environ.get("FAN_OUT_MIN_PAGES", "200"))
+pages_per_shard = int(os.environ.get("PAGES_PER_SHARD", "50"))
+'''Chunks per embed_batch call, Cohere takes up to 96 texts in one request'''
+embed_batch_size = int(os.environ.get("EMBED_BATCH_SIZE", "16"))
+'''Tell connected clients when a document is searchable, through a broadcast event on the bus'''
+ingest_notifications_enabled = os.environ.get("INGEST_NOTIFICATIONS_ENABLED", "NO")
+
+#OpenSearch collection by default, VECTOR_STORE=local keeps the index in process
+vector_store = open_vector_store(index_name, region)
+bedrock = None
+embedder = None
 
 
 def create_index_for_documents(index_name):
     
-    index_body = {
-        "mappings": {
-            "properties": {
-                "doc_text": {"type": "text"},
-                "doc_vector": {
-                    "type": "knn_vector",
-                    "dimension": 1536,
-                    "method": {
-                        "engine": "nmslib",
-                        "space_type": "cosinesimil",
-                        "name": "hnsw",
-                        "parameters": {"ef_construction": 512, "m": 16},
-                    },
-                },
-            }
-        },
-        "settings": {
-            "index": {
-                "number_of_shards": 2,
-                "knn.algo_param": {"ef_search": 512},
-                "knn": True,
-            }
-        },
-        }
+    #Engine, dimension and quantization come from the index profile
+    index_body = index_body_for_profile(index_profile)
     try:
-        response = client.indices.create(index_name, body=index_body)
+        response = vector_store.client.indices.create(index_name, body=index_body)
         print(json.dumps(response, indent=2))
     except Exception as ex:
         print(ex)
@@ -62,43 +58,150 @@ def create_index_for_documents(index_name):
 def check_if_index_exists(index_name):
     l_return = 0
     try:
-        print(client.indices.get(index_name))
+        print(vector_store.client.indices.get(index_name))
         l_return = 1
     except Exception as ex:
         print(ex)
     return l_return
 
-def lambda_handler(event, context):
-    print("Received event: " + json.dumps(event, indent=2))
-    try:
-        bucket_name = event['Records'][0]['s3']['bucket']['name']
-        filename = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
-        print(f'Bucket name: {bucket_name}')
-        print(f'Object/File name: {filename}')
-        '''If index does not exist create one'''
-        if check_if_index_exists(index_name) == 0:
-            print("Index not found, creating index now...")
-            create_index_for_documents(index_name)
-        else:
-            print("Index present, progress with ingestion")
-    
-        storage_file = f"/tmp/{filename}"
-        s3 = boto3.resource('s3')
-        s3.meta.client.download_file(bucket_name, \
-                                    filename, storage_file)
-        loader = PyPDFLoader(storage_file)
-        documents = loader.load()
-        text_splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-        document_paras = text_splitter.split_documents(documents)
-
-        print(f"Number of pages being ingested to Opensearch: {len(document_paras)}")
-        for para in document_paras:
-            v_embedding = text_embedding(para.page_content)
-            add_document(v_embedding,para.page_content)
-        print("Finished ingestion")   
+def make_text_splitter():
+    return StructuredChunker(target_tokens=chunk_target_tokens,
+                             max_tokens=chunk_target_tokens * 3 // 2,
+                             overlap_tokens=chunk_overlap_tokens)
 
+
+def make_embedding_cache():
+    if embedding_cache_enabled != "YES":
+        return None
+    return EmbeddingCache(DynamoDbEmbeddingStore(events_table_name), embedding_cache_key(index_profile))
+
+
+def notify_ingested(source, stats):
+    if ingest_notifications_enabled != "YES":
+        return
+    try:
+        publish_broadcast(event_bus_name, {"type": "ingestion_complete", "source": source,
+                                           "indexed": stats['indexed'], "failed": stats['failed']})
     except Exception as e:
-        print(f"Exception hit during ingest {str(e)}")
+        print(f"Ingestion notice for {source} not sent: {str(e)}")
+
+
+def ingest_shard(message, context):
+    '''Embed and stage one shard, the worker completing the last shard indexes the document'''
+    shard_store = ShardStore(events_table_name)
+    trace = Trace("vectordb_ingestion_handler", source=message['source'], shard=message['shard'])
+    with trace.span("download"):
+        shard_file = spool_s3_object(get_client('s3'), message['bucket'], message['key'])
+    with shard_file as pdf_file, trace.span("shard"):
+        #embedding_ms adds up the calls of every embedding thread
+        done, total = process_shard(message, pdf_file, make_text_splitter().split_text,
+                                    text_embedding, shard_store, embedding_cache=make_embedding_cache(),
+                                    pages_fn=strip_boilerplate,
+                                    embed_many_fn=trace.timed("embedding", embed_texts),
+                                    embed_batch_size=embed_batch_size)
+    print(f"Shard {message['shard']} of {message['source']} staged, {done}/{total} shards done")
+    #Lambda keeps the request id when it retries an async invocation, so the retry of a failed finalize
+    #can claim the run again
+    worker_id = getattr(context, "aws_request_id", None) or str(uuid4())
+    if done < total or not shard_store.claim_finalize(message['source'], message['run_id'], worker_id):
+        trace.emit()
+        return {"shard": message['shard'], "finalized": False}
+    with trace.span("finalize"):
+        stats = finalize(message['source'], message['run_id'], shard_store, DynamoDbManifestStore(events_table_name),
+                         vector_store, index_name)
+        vector_store.flush()
+    print(f"Finished sharded ingestion of {message['source']}: {stats}")
+    IndexGeneration(events_table_name, index_name).bump()
+    notify_ingested(message['source'], stats)
+    trace.count("chunks_indexed", stats['indexed'])
+    trace.emit()
+    return {"shard": message['shard'], "finalized": True, **stats}
+
+
+def lambda_handler(event, context):
+    print("Received event: " + json.dumps(event, indent=2))
+    if event.get('source') == SHARD_EVENT_SOURCE:
+        return ingest_shard(event['detail'], context)
+    manifest_store = DynamoDbManifestStore(events_table_name)
+    failed_sources = []
+    for record in event['Records']:
+        try:
+            bucket_name = record['s3']['bucket']['name']
+            filename = urllib.parse.unquote_plus(record['s3']['object']['key'], encoding='utf-8')
+            print(f'Bucket name: {bucket_name}')
+            print(f'Object/File name: {filename}')
+            source = document_source(bucket_name, filename)
+            #Stage timings of this document, emitted as one CloudWatch EMF record
+            trace = Trace("vectordb_ingestion_handler", source=source)
+            if record['eventName'].startswith('ObjectRemoved'):
+                with trace.span("remove"):
+                    stats = remove_document(source, manifest_store, vector_store, index_name)
+                    vector_store.flush()
+                print(f"Removed {source} from the index: {stats}")
+                IndexGeneration(events_table_name, index_name).bump()
+                trace.emit()
+                continue
+
+            #Loader by file extension, keys without a known extension fall back to the Content-Type
+            s3_client = get_client('s3')
+            document_type = document_format(filename)
+            if document_type is None:
+                content_type = s3_client.head_object(Bucket=bucket_name, Key=filename).get('ContentType')
+                document_type = document_format(filename, content_type)
+            if document_type is None:
+                print(f"Skipping {source}, no loader for this type of document")
+                continue
+
+            '''If index does not exist create one'''
+            if not isinstance(vector_store, OpenSearchVectorStore):
+                print("Local vector store, no index to create")
+            elif check_if_index_exists(index_name) == 0:
+                print("Index not found, creating index now...")
+                create_index_for_documents(index_name)
+            else:
+                print("Index present, progress with ingestion")
+
+            text_splitter = make_text_splitter()
+            #Pages are parsed, split, embedded and indexed as a stream, nothing holds the whole document
+            with trace.span("download"):
+                document_file = spool_s3_object(s3_client, bucket_name, filename)
+            with document_file:
+                if fan_out_enabled == "YES" and document_type == "pdf":
+                    page_count = pdf_page_count(document_file)
+                    if page_count >= fan_out_min_pages:
+                        shards = coordinate(bucket_name, filename, source, page_count, str(uuid4()),
+                                            ShardStore(events_table_name), eventbridge_dispatcher(event_bus_name),
+                                            pages_per_shard=pages_per_shard)
+                        print(f"Dispatched {shards} shards for {page_count} pages of {source}")
+                        trace.emit()
+                        continue
+                #PDF pages or sections of other formats, PDF headers and footers are dropped before chunking
+                pages = load_pages(document_file, document_type, workers=parse_workers)
+                chunks = iter_page_chunks(pages, text_splitter.split_text)
+                #Only new or changed chunks are embedded, chunks no longer in the document are deleted,
+                #embedding_ms adds up the calls of every embedding thread
+                with trace.span("ingest"):
+                    stats = ingest_document(chunks, source, manifest_store, text_embedding,
+                                            vector_store, index_name, embedding_cache=make_embedding_cache(),
+                                            embed_many_fn=trace.timed("embedding", embed_texts),
+                                            embed_batch_size=embed_batch_size)
+                with trace.span("flush"):
+                    vector_store.flush()
+            print(f"Finished ingestion: {stats}")
+            #Cached retrieval results in the message handler are keyed by generation
+            IndexGeneration(events_table_name, index_name).bump()
+            notify_ingested(source, stats)
+            trace.count("chunks_indexed", stats['indexed'])
+            trace.count("chunks_unchanged", stats['unchanged'])
+            trace.emit()
+
+        except Exception as e:
+            print(f"Exception hit during ingest {str(e)}")
+            failed_sources.append(record['s3']['object']['key'])
+    #Fail the invocation so the async invoke is retried and then goes to the dead-letter queue,
+    #a retry only embeds chunks missing from the manifest
+    if failed_sources:
+        raise RuntimeError(f"Ingestion failed for {', '.join(failed_sources)}")
 
 
 def add_document(vector,text):
@@ -107,44 +210,39 @@ def add_document(vector,text):
       "doc_text": text
     }
     
-    response = client.index(
-        index = index_name,
-        body = document
-    )
+    response = vector_store.add_document(document)
     print('\nAdding document:')
     print(response) 
 
     #loader = PyPDFLoader("example_data/layout-parser-paper.pdf")
     #pages = loader.load_and_split()
 
-def text_embedding(text):
-    body=json.dumps({"inputText": text})
-    response = bedrock.invoke_model(body=body, modelId='amazon.titan-embed-text-v1', accept='application/json', contentType='application/json')
-    response_body = json.loads(response.get('body').read())
-    embedding = response_body.get('embedding')
-    return embedding  
+def bedrock_client():
+    '''Registry client behind the shared rate limiter, retries and fallbacks, built on the first embedding'''
+    global bedrock
+    if bedrock is None:
+        bedrock = resilient_client(get_client('bedrock-runtime'), region)
+    return bedrock
 
 
+def get_embedder():
+    '''Embedding provider of the index profile's model (or EMBEDDING_MODEL_ID)'''
+    global embedder
+    if embedder is None:
+        embedder = embedding_provider(embedding_model_id, embedding_dimensions(index_profile), client=bedrock_client())
+    return embedder
 
-def search_index(index_name,vector,no_of_results):
-    
-    document = {
-        "size": 15,
-        "_source": {"excludes": ["doc_vector"]},
-        "query": {
-            "knn": {
-                 "doc_vector": {
-                     "vector": vector,
-                     "k":no_of_results
-                 }
-            }
-        }
-    }
-    response = client.search(
-    body = document,
-    index = index_name
-    )
-    return response
 
+def embed_texts(texts):
+    '''Index ready vectors of texts, one matrix row each'''
+    return prepare_vectors(embed_batch(texts, get_embedder()), index_profile)
 
 
+def text_embedding(text):
+    return embed_texts([text])[0].tolist()
+
+
+
+def search_index(index_name,vector,no_of_results):
+    
+    return vector_store.search(vector, no_of_results, size=15)
@@ -1,39 +1,102 @@
-import json, urllib.parse
-import boto3
+import json
 import os
-from uuid import uuid4
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth, helpers
+import time
 from utils.chatbot_utils import invoke_model, invoke_model_with_streaming_response, \
-                                search_index, log_to_db, text_embedding, send_message, send_to_msg_bus 
-                                
+                                log_to_db, send_message, send_to_msg_bus, get_client, SideEffects, Trace
+from utils.bedrock_calls import resilient_client
+from utils.embeddings import embed_batch, embedding_provider
+from utils.vector_store import open_vector_store
+from utils.context_builder import build_context, estimate_tokens
+from utils.reranker import rerank
+from utils.index_profiles import get_index_profile, embedding_dimensions, embedding_cache_key, prepare_vectors
+from utils.embedding_cache import EmbeddingCache, DynamoDbEmbeddingStore
+from utils.query_cache import QueryCache, DynamoDbTTLStore, IndexGeneration
+from utils.semantic_cache import SemanticAnswerCache, LocalSemanticStore, answer_pieces
+from utils.stream_sender import CoalescingStreamSender, relay_stream, stream_metrics
+from utils.conversation import ConversationStore, new_msg_id, rewrite_query, summary_prompt
+from utils.connections import BROADCAST_EVENT_SOURCE, CONNECTION_TTL_SECONDS, ConnectionRegistry, broadcast
+
 
 ws_api_url = os.environ['WS_API_URL']
-#Remove all hardcoding, TODO
-ws_client = boto3.client('apigatewaymanagementapi',endpoint_url=ws_api_url)
 evt_bus_name = os.environ['EVENT_BUS_NAME']
-host = urllib.parse.urlparse(os.environ['OPENSEARCH_EP']).netloc #replace this with the value from the AWS Management Console
 region = os.environ['AWS_DEFAULT_REGION']
 is_streaming = os.environ["LLM_STREAMING_ENABLED"]
 events_table_name = os.environ['EVENTS_TABLE_NAME']
+stream_flush_interval = float(os.environ.get("STREAM_FLUSH_INTERVAL_SECONDS", "0.05"))
+side_effects_timeout = float(os.environ.get("SIDE_EFFECTS_TIMEOUT_SECONDS", "10"))
+'''Embedding model, vector size and encoding must match the index, see utils/index_profiles.py'''
+index_profile = get_index_profile()
+embedding_cache = None
+if os.environ.get("EMBEDDING_CACHE_ENABLED", "NO") == "YES":
+    embedding_cache = EmbeddingCache(DynamoDbEmbeddingStore(events_table_name),
+                                     embedding_cache_key(index_profile, "search_query"))
 
-service = "aoss"
-credentials = boto3.Session().get_credentials()
-auth = AWSV4SignerAuth(credentials, region, service)
 index_name = "docs-index"
+retrieval_mode = os.environ.get("RETRIEVAL_MODE", "knn")
+context_token_budget = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1500"))
+rerank_enabled = os.environ.get("RERANK_ENABLED", "NO")
+rerank_candidates = int(os.environ.get("RERANK_CANDIDATES", "10"))
+rerank_max_k = int(os.environ.get("RERANK_MAX_K", "5"))
+
+'''Retrieval cache, kept at module level so it survives warm invocations'''
+query_cache_shared_store = None
+if os.environ.get("QUERY_CACHE_SHARED", "NO") == "YES":
+    query_cache_shared_store = DynamoDbTTLStore(events_table_name,
+                                                ttl_seconds=int(os.environ.get("QUERY_CACHE_TTL_SECONDS", "3600")))
+query_cache = QueryCache(maxsize=int(os.environ.get("QUERY_CACHE_SIZE", "512")),
+                         shared_store=query_cache_shared_store,
+                         generation=IndexGeneration(events_table_name, index_name))
+
+'''Opt-in, answers near-duplicate questions over the same context without calling the LLM'''
+semantic_cache = None
+if os.environ.get("SEMANTIC_CACHE_ENABLED", "NO") == "YES":
+    semantic_cache = SemanticAnswerCache(LocalSemanticStore(),
+                                         threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95")))
+
+'''Conversation memory per connection, a bounded history plus a rolling summary of older turns'''
+conversation_store = None
+if os.environ.get("CONVERSATION_ENABLED", "NO") == "YES":
+    conversation_store = ConversationStore(events_table_name,
+                                           window=int(os.environ.get("CONVERSATION_WINDOW", "6")),
+                                           summarize_after=int(os.environ.get("CONVERSATION_SUMMARIZE_AFTER", "8")))
+history_token_budget = int(os.environ.get("HISTORY_TOKEN_BUDGET", "400"))
+'''How follow-ups are turned into a retrieval query: concat (no model call), llm or none'''
+query_rewrite_mode = os.environ.get("QUERY_REWRITE_MODE", "concat")
+
+'''Open connections, for broadcasts from the event bus'''
+connection_registry = ConnectionRegistry(events_table_name,
+                                         ttl_seconds=int(os.environ.get("CONNECTION_TTL_SECONDS",
+                                                                        str(CONNECTION_TTL_SECONDS))))
+broadcast_workers = int(os.environ.get("BROADCAST_WORKERS", "48"))
+
+
+
+def side_effects_deadline(context):
+    '''Seconds we can wait for side effects, leaving a second to return before the Lambda timeout'''
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return side_effects_timeout
+    return min(side_effects_timeout, context.get_remaining_time_in_millis() / 1000 - 1)
+
 
-client = OpenSearch(
-    hosts = [{"host": host, "port": 443}],
-    http_auth = auth,
-    use_ssl = True,
-    verify_certs = True,
-    connection_class = RequestsHttpConnection,
-    pool_maxsize = 20
-)
+def broadcast_handler(event, context):
+    '''Post an event's detail to every registered connection, connections found gone are removed'''
+    trace = Trace("ws_message_handler", broadcast=event.get('id'))
+    ws_client = get_client('apigatewaymanagementapi', endpoint_url=ws_api_url)
+    with trace.span("broadcast"):
+        stats = broadcast(ws_client, connection_registry.connection_ids(), json.dumps(event['detail']),
+                          registry=connection_registry, workers=broadcast_workers)
+    print(f"Broadcast: {stats}")
+    trace.count("broadcast_sent", stats['sent'])
+    trace.count("broadcast_gone", stats['gone'])
+    trace.emit()
+    return {'statusCode': 200, 'body': json.dumps(stats)}
 
 
 def lambda_handler(event, context):
     
     #print("Received event: " + json.dumps(event, indent=2))
+    if event.get('source') == BROADCAST_EVENT_SOURCE:
+        return broadcast_handler(event, context)
     connection_id = event['requestContext']['connectionId']
     print(f"Connection Id: {connection_id}")
     domain = event.get("requestContext", {}).get("domainName")
@@ -45,6 +108,7 @@ def lambda_handler(event, context):
     if event['requestContext']['eventType'] == 'CONNECT':
         # Handle connect event
         print("CONNECT event: ")
+        connection_registry.register(connection_id, domain=domain, stage=stage)
         response = {
             'statusCode': 200,
             'body': json.dumps({'message': 'Connect successful'}),
@@ -52,67 +116,152 @@ def lambda_handler(event, context):
     elif event['requestContext']['eventType'] == 'DISCONNECT':
         # Handle disconnect event
         print("DISCONNECT event: ")
+        connection_registry.remove(connection_id)
         response = {
             'statusCode': 200,
             'body': json.dumps({'message': 'Disconnect successful'}),
         }
     elif event['requestContext']['eventType'] == 'MESSAGE':
         # Handle data event
-        request_id = str(uuid4())
-        bedrock_client = boto3.client(service_name='bedrock-runtime',
-                                      region_name=region)
+        #Time sortable, the conversation of a connection is read back newest first by msg id
+        request_id = new_msg_id()
+        #Stage timings of this request, emitted as one CloudWatch EMF record at the end
+        trace = Trace("ws_message_handler", request_id=request_id)
+        #Clients come from the registry, created on the first message and reused while warm,
+        #Bedrock calls go through the shared rate limiter, retries and fallback models
+        bedrock_client = resilient_client(get_client('bedrock-runtime', region_name=region), region)
+        ws_client = get_client('apigatewaymanagementapi', endpoint_url=ws_api_url)
+        vector_store = open_vector_store(index_name, region)
+        embedder = embedding_provider(index_profile['embedding_model_id'], embedding_dimensions(index_profile),
+                                      client=bedrock_client)
         message = event['body']
         
         print(f"MESSAGE event: {message}")
-        vector = text_embedding(bedrock_client,message)
-        response = search_index(client,"docs-index",vector,no_of_results=2)
-        data=response['hits']['hits']
+        conversation = None
+        retrieval_query = message
+        if conversation_store is not None:
+            with trace.span("history"):
+                conversation = conversation_store.load(connection_id)
+            with trace.span("rewrite"):
+                retrieval_query = rewrite_query(message, conversation, query_rewrite_mode,
+                                                lambda prompt: invoke_model(bedrock_client, prompt))
+            print(f"Retrieval query: {retrieval_query}")
+        with trace.span("embedding"):
+            vector = query_cache.embedding(retrieval_query,
+                                           lambda q: prepare_vectors(embed_batch([q], embedder, input_type="search_query",
+                                                                                 cache=embedding_cache),
+                                                                     index_profile)[0].tolist())
+        #With reranking we over-fetch candidates and let the reranker pick how many to keep
+        fetch_k = rerank_candidates if rerank_enabled == "YES" else 2
+        with trace.span("search"):
+            data = query_cache.search(vector, fetch_k,
+                                      lambda: vector_store.search(vector, fetch_k, query_text=retrieval_query,
+                                                                  mode=retrieval_mode, size=max(5, fetch_k))['hits']['hits'])
+        if rerank_enabled == "YES":
+            with trace.span("rerank"):
+                data = rerank(retrieval_query, data, max_k=rerank_max_k)
+        print(f"Query cache: {query_cache.stats()}")
         print(f"We have {len(data)} context retrieved")
-        context=""
-        context_arr = []
-        for item in data:
-            context = f"{context} {item['_source']['doc_text']}"
-            context_arr.append(item['_source']['doc_text'])
-            print(f"Length of item Context: {len(item['_source']['doc_text'])}")
-        print(f" Context: {context} \n Context array {context_arr}")
+        #Overlapping chunks are merged and the context is capped at the token budget
+        built_context = build_context(data, token_budget=context_token_budget)
+        prompt_context = built_context['text']
+        context_arr = built_context['passages']
+        context_ids = built_context['ids']
+        print(f"Context tokens: {built_context['tokens']} (from {built_context['raw_tokens']} retrieved)")
+        print(f" Context: {prompt_context} \n Context array {context_arr}")
         query_with_context = f"I'm a virtual Agent, answer the question in <question> \
             with the provided context in <context> \
-            <question>{message}</question> <context>{context}</context>"
+            <question>{message}</question> <context>{prompt_context}</context>"
+        history = conversation.history(history_token_budget, conversation_store.window) if conversation else ""
+        if history:
+            query_with_context += f" The conversation so far is in <history>, use it to understand the question \
+            <history>{history}</history>"
+        trace.count("history_tokens", estimate_tokens(history))
 
-        if is_streaming == "YES":
+        #An answer built on a conversation is only right for that connection, and the history
+        #may hold what the user told us, so turns with history neither read nor fill the cache
+        use_semantic_cache = semantic_cache is not None and not history
+        cached_answer = None
+        if use_semantic_cache:
+            cached_answer = semantic_cache.lookup(vector, context_ids)
+
+        llm_metrics = {}
+        if cached_answer is not None:
+            response_message = cached_answer
+            with trace.span("send"):
+                if is_streaming == "YES":
+                    for piece in answer_pieces(cached_answer):
+                        send_message(ws_client,connection_id,piece)
+                else:
+                    send_message(ws_client,connection_id,response_message)
+        elif is_streaming == "YES":
+            llm_start = time.perf_counter()
             stream = invoke_model_with_streaming_response(bedrock_client,query_with_context)
-            if stream:
-                for event in stream:
-                    chunk = event.get('chunk')
-                    if chunk:
-                        data = json.loads(chunk.get('bytes').decode())
-                        send_message(ws_client,connection_id,data['completion'].strip())
-    
-            response = {
-                'statusCode': 200
-            }
+            #Tokens are coalesced into frames and posted from a background thread,
+            #the sender also keeps them so the full answer can be logged
+            with CoalescingStreamSender(ws_client, connection_id,
+                                        flush_interval=stream_flush_interval) as sender:
+                chunks_read, output_tokens = relay_stream(stream, sender)
+            response_message = sender.text()
+            llm_metrics = stream_metrics(sender, chunks_read, llm_start, output_tokens)
+            print(f"Streamed {chunks_read} chunks in {sender.posts} frames: {llm_metrics}")
+            trace.record("ttft", llm_metrics['ttft_ms'])
+            trace.record("llm", llm_metrics['llm_ms'])
+            trace.record("send", llm_metrics['send_ms'])
+            trace.count("output_chunks", chunks_read)
+            trace.count("output_tokens", output_tokens)
         else:
-            response_message = invoke_model(bedrock_client,query_with_context)
-            send_message(ws_client,connection_id,response_message)
-            pk_str = f"{connection_id}"
-            sk_str = f"{request_id}"
-            event = {
-                "msg_id": request_id,
-                "session_id": connection_id,
-                "event_type": "com.onebyzero.chatter.chat_message",
-                "user_msg": message,
-                "ai_msg": response_message,
-                "context": context_arr,
-                "query_with_prompt": query_with_context
-            }
-            #Customer first, logging later
-            send_message(ws_client,connection_id,json.dumps(event))
-            logged_evt = log_to_db(pk=pk_str, \
-                                   sk=sk_str,\
-                                   table_name=events_table_name, \
-                                   event_json_obj=event)
-            send_to_msg_bus(evt_bus_name,event)
-            
+            with trace.span("llm"):
+                response_message = invoke_model(bedrock_client,query_with_context)
+            with trace.span("send"):
+                send_message(ws_client,connection_id,response_message)
+
+        if use_semantic_cache and cached_answer is None and response_message:
+            semantic_cache.add(vector, context_ids, response_message)
+
+        pk_str = f"{connection_id}"
+        sk_str = f"{request_id}"
+        event = {
+            "msg_id": request_id,
+            "session_id": connection_id,
+            "event_type": "com.onebyzero.chatter.chat_message",
+            "user_msg": message,
+            "ai_msg": response_message,
+            "context": context_arr,
+            "query_with_prompt": query_with_context,
+            "semantic_cache_hit": cached_answer is not None,
+            "streaming": is_streaming == "YES",
+            **llm_metrics
+        }
+        #Customer first, logging later: these run in the background and are awaited before returning
+        side_effects = SideEffects()
+        #Streaming clients concatenate every frame into the answer, only non-streaming clients get the event echoed
+        if is_streaming != "YES":
+            side_effects.submit("send_event", trace.timed("send", send_message), ws_client, connection_id,
+                                json.dumps(event))
+        side_effects.submit("log_to_db", trace.timed("log", log_to_db), pk=pk_str, \
+                            sk=sk_str, \
+                            table_name=events_table_name, \
+                            event_json_obj=event)
+        side_effects.submit("send_to_msg_bus", trace.timed("publish", send_to_msg_bus), evt_bus_name, event)
+        if llm_metrics.get('client_gone'):
+            #The client left mid answer, broadcasts should not keep posting to it
+            side_effects.submit("forget_connection", connection_registry.remove, connection_id)
+        if conversation is not None:
+            conversation_store.append(connection_id, conversation, request_id, message, response_message)
+            #Older turns are folded into the summary after the answer is out, off the reply path
+            if conversation_store.needs_summary(conversation):
+                side_effects.submit("summarize", trace.timed("summarize", conversation_store.summarize),
+                                    connection_id, conversation,
+                                    lambda summary, turns: invoke_model(bedrock_client,
+                                                                        summary_prompt(summary, turns)).strip())
+        side_effects.wait(side_effects_deadline(context))
+        trace.count("semantic_cache_hit", int(cached_answer is not None))
+        trace.emit()
+        response = {
+            'statusCode': 200
+        }
+
     else:
         # Return an error for unknown event types
         print("UNKNOWN event: ")
@@ -0,0 +1,16 @@
+#!/bin/bash
+# Build one zip per dependency set for Lambda (Linux x86_64, Python 3.11).
+# Functions attach only the sets they import, see the stack.
+set -euo pipefail
+cd "$(dirname "$0")"
+for layer in common search documents; do
+    rm -rf "build/$layer" "$layer/layer-$layer-libs.zip"
+    mkdir -p "build/$layer/python"
+    pip install --quiet --platform manylinux2014_x86_64 --implementation cp --python-version 3.11 \
+        --only-binary=:all: -r "$layer/requirements.txt" -t "build/$layer/python"
+    if [ "$layer" = "common" ]; then
+        cp -r ../utils "build/$layer/python/utils"
+    fi
+    (cd "build/$layer" && zip -qr "../../$layer/layer-$layer-libs.zip" python -x '*/__pycache__/*')
+done
+rm -rf build
@@ -19,6 +19,7 @@ from aws_cdk.aws_apigatewayv2_integrations_alpha import WebSocketLambdaIntegrati
 from aws_cdk import aws_opensearchserverless as opensearchserverless
 import json
 from streaming_bot_websockets.config.config_parser import get_config
+from streaming_bot_websockets.utils.index_profiles import INDEX_PROFILES
 
 class StreamingBotWebsocketsStack(Stack):
 
@@ -27,7 +28,8 @@ class StreamingBotWebsocketsStack(Stack):
 
         config_data = get_config()
         
-        EMBEDDING_MODEL_ID_DEFAULT='amazon.titan-embed-text-v1'
+        #The embedding model defaults to the index profile's, a different model must produce the same dimension
+        EMBEDDING_MODEL_ID_DEFAULT=INDEX_PROFILES[config_data.get('retrieval', {}).get('index_profile', 'default')]['embedding_model_id']
        
         embedding_model_aws_id = CfnParameter(self, "embeddingModelId", 
                                           type="String",
@@ -36,11 +38,19 @@ class StreamingBotWebsocketsStack(Stack):
         
         events_table = create_dynamodb_table(self,scope=scope,table_name='events_table')
 
-        '''Create a platform specific langchain layer - Linux'''
-        boto3_lanchain_lyr = _lambda.LayerVersion(self,id="boto3-langchain-layer",\
-                                                    code=_lambda.AssetCode("streaming_bot_websockets/layers/boto3_langchain/layer-boto3-langchain-libs.zip"),
-                                                    compatible_architectures=[_lambda.Architecture.X86_64],
-                                                    compatible_runtimes=[_lambda.Runtime.PYTHON_3_11])
+        '''Create platform specific dependency layers - Linux, built by layers/build_layers.sh.
+        Each function attaches only the sets it imports, a smaller package starts faster'''
+        def dependency_layer(name):
+            return _lambda.LayerVersion(self,id=f"{name}-layer",\
+                                        code=_lambda.AssetCode(f"streaming_bot_websockets/layers/{name}/layer-{name}-libs.zip"),
+                                        compatible_architectures=[_lambda.Architecture.X86_64],
+                                        compatible_runtimes=[_lambda.Runtime.PYTHON_3_11])
+        #boto3 and the shared utils package
+        common_lyr = dependency_layer("common")
+        #opensearch-py and numpy, for functions using the vector index
+        search_lyr = dependency_layer("search")
+        #pypdf, for ingestion only
+        documents_lyr = dependency_layer("documents")
                                                     
         
         '''An Eventbridge bus for custom events'''
@@ -102,7 +112,7 @@ class StreamingBotWebsocketsStack(Stack):
                 runtime=_lambda.Runtime.PYTHON_3_11,
                 code=_lambda.AssetCode('streaming_bot_websockets/lambdas/ws_message_handler'),
                 timeout=Duration.seconds(600),
-                layers=[boto3_lanchain_lyr],
+                layers=[common_lyr, search_lyr],
                 handler='app.lambda_handler')
         lambda_ws_message_handler.add_environment("WS_API_URL",(web_socket_api_stage.url).replace('wss','https'))
         
@@ -132,7 +142,7 @@ class StreamingBotWebsocketsStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_11,
             code=_lambda.AssetCode('streaming_bot_websockets/lambdas/sentiment_analysis_message_handler'),
             timeout=Duration.seconds(120),
-            layers=[boto3_lanchain_lyr],
+            layers=[common_lyr],
             handler='app.lambda_handler')
         
         lambda_sentiment_analysis_message_handler_role.attach_inline_policy(iam.Policy(self, \
@@ -215,19 +225,49 @@ class StreamingBotWebsocketsStack(Stack):
                 role=lambda_vector_db_ingestion_handler_role,
                 code=_lambda.AssetCode('streaming_bot_websockets/lambdas/vectordb_ingestion_handler'),
                 timeout=Duration.seconds(900),
-                layers=[boto3_lanchain_lyr],
+                layers=[common_lyr, search_lyr, documents_lyr],
                 memory_size=2048,
+                #S3 notifications and shard events invoke asynchronously, failed documents are retried and then kept here
+                dead_letter_queue_enabled=True,
                 handler='app.lambda_handler')
         
         #Grant the vector db ingest function access to the S3 bucket
         bucket.grant_read(lambda_vector_db_ingestion_handler)
 
+        '''Large documents are split into page range shards, each shard comes back as an event'''
+        ingest_shard_events_rule = events.Rule(self, "IngestShardRule",
+        event_pattern=events.EventPattern(
+            source=["com.onebyzero.chatter.ingest_shard"]
+        ),
+        event_bus=messaging_app_event_bus
+        )
+        ingest_shard_events_rule.add_target(targets.LambdaFunction(lambda_vector_db_ingestion_handler))
+        messaging_app_event_bus.grant_put_events_to(lambda_vector_db_ingestion_handler)
+        lambda_vector_db_ingestion_handler.add_environment("EVENT_BUS_NAME",messaging_app_event_bus.event_bus_name)
+        lambda_vector_db_ingestion_handler.add_environment("INGEST_FAN_OUT_ENABLED","YES")
+
+        '''Broadcast events (admin notices, ingestion completion) are posted to every open connection
+        by the message handler, which keeps the connection registry (see utils/connections.py)'''
+        broadcast_events_rule = events.Rule(self, "BroadcastRule",
+        event_pattern=events.EventPattern(
+            source=["com.onebyzero.chatter.broadcast"]
+        ),
+        event_bus=messaging_app_event_bus
+        )
+        broadcast_events_rule.add_target(targets.LambdaFunction(lambda_ws_message_handler))
+        lambda_ws_message_handler.add_environment("BROADCAST_WORKERS","48")
+        lambda_vector_db_ingestion_handler.add_environment("INGEST_NOTIFICATIONS_ENABLED","YES")
+        lambda_vector_db_ingestion_handler.add_environment("FAN_OUT_MIN_PAGES","200")
+        lambda_vector_db_ingestion_handler.add_environment("PAGES_PER_SHARD","50")
+
         notification = s3_notify.LambdaDestination(lambda_vector_db_ingestion_handler)
         notification.bind(self, bucket)
 
-        # Add Create Event only for Object creation
+        # Object creation ingests the document, removal deletes its chunks from the index
         bucket.add_object_created_notification(
            notification)
+        bucket.add_object_removed_notification(
+           notification)
         
         collection_name = f"vectorcoll-{config_data['deployment']['name']}".lower()
         vector_collection = opensearchserverless.CfnCollection(self,collection_name,
@@ -294,8 +334,19 @@ class StreamingBotWebsocketsStack(Stack):
                                                            vector_collection.attr_collection_endpoint)
         lambda_vector_db_ingestion_handler.add_environment("EMBEDDING_MODEL_ID",
                                                            embedding_model_aws_id.value_as_string)
+        lambda_ws_message_handler.add_environment("EMBEDDING_MODEL_ID",
+                                                  embedding_model_aws_id.value_as_string)
         
         lambda_ws_message_handler.add_environment("LLM_STREAMING_ENABLED","NO")
+        lambda_ws_message_handler.add_environment("EMBEDDING_CACHE_ENABLED","YES")
+        lambda_vector_db_ingestion_handler.add_environment("EMBEDDING_CACHE_ENABLED","YES")
+        lambda_ws_message_handler.add_environment("QUERY_CACHE_SHARED","YES")
+        lambda_ws_message_handler.add_environment("QUERY_CACHE_TTL_SECONDS","3600")
+        lambda_ws_message_handler.add_environment("SEMANTIC_CACHE_ENABLED","NO")
+        lambda_ws_message_handler.add_environment("SEMANTIC_CACHE_THRESHOLD","0.95")
+        lambda_ws_message_handler.add_environment("RERANK_ENABLED","YES")
+        lambda_ws_message_handler.add_environment("RERANK_CANDIDATES","10")
+        lambda_ws_message_handler.add_environment("RERANK_MAX_K","5")
         #TODO - Remove hardcoding, pass it as a CDK param, else default
         vector_db_index_name = "docs-index"
         lambda_vector_db_ingestion_handler.add_environment("DOCUMENTS_INDEX",
@@ -306,12 +357,79 @@ class StreamingBotWebsocketsStack(Stack):
                                                            vector_collection.attr_collection_endpoint)
         
         lambda_ws_message_handler.add_environment("EVENT_BUS_NAME",messaging_app_event_bus.event_bus_name)
+        #knn (vector only) or hybrid (BM25 + kNN fused with reciprocal rank fusion)
+        lambda_ws_message_handler.add_environment("RETRIEVAL_MODE",
+                                                  config_data.get('retrieval', {}).get('mode', 'knn'))
+        #opensearch, or local to keep a small index inside the functions (see utils/vector_store.py)
+        vector_store = config_data.get('retrieval', {}).get('vector_store', 'opensearch')
+        lambda_ws_message_handler.add_environment("VECTOR_STORE",vector_store)
+        lambda_vector_db_ingestion_handler.add_environment("VECTOR_STORE",vector_store)
+        #Embedding model and index encoding, both functions must agree (see utils/index_profiles.py)
+        index_profile = config_data.get('retrieval', {}).get('index_profile', 'default')
+        lambda_ws_message_handler.add_environment("INDEX_PROFILE",index_profile)
+        lambda_vector_db_ingestion_handler.add_environment("INDEX_PROFILE",index_profile)
+        lambda_ws_message_handler.add_environment("CONTEXT_TOKEN_BUDGET",
+                                                  str(config_data.get('retrieval', {}).get('context_token_budget', 1500)))
+
+        #Conversation memory per connection (see utils/conversation.py)
+        conversation_config = config_data.get('conversation', {})
+        lambda_ws_message_handler.add_environment("CONVERSATION_ENABLED",conversation_config.get('enabled', 'NO'))
+        lambda_ws_message_handler.add_environment("CONVERSATION_WINDOW",str(conversation_config.get('window', 6)))
+        lambda_ws_message_handler.add_environment("CONVERSATION_SUMMARIZE_AFTER",
+                                                  str(conversation_config.get('summarize_after', 8)))
+        lambda_ws_message_handler.add_environment("HISTORY_TOKEN_BUDGET",
+                                                  str(conversation_config.get('history_token_budget', 400)))
+        lambda_ws_message_handler.add_environment("QUERY_REWRITE_MODE",conversation_config.get('query_rewrite', 'concat'))
+
+        #Shared Bedrock call layer (see utils/bedrock_calls.py): requests per second per model and container,
+        #fallback routes once a model keeps throttling, hedged embedding calls
+        bedrock_config = config_data.get('bedrock', {})
+        for bedrock_handler in [lambda_ws_message_handler, lambda_vector_db_ingestion_handler,
+                                lambda_sentiment_analysis_message_handler]:
+            bedrock_handler.add_environment("BEDROCK_MAX_RPS",str(bedrock_config.get('max_requests_per_second', 20)))
+            bedrock_handler.add_environment("BEDROCK_FALLBACKS",json.dumps(bedrock_config.get('fallbacks', {})))
+        lambda_ws_message_handler.add_environment("BEDROCK_HEDGING_ENABLED",bedrock_config.get('hedging', 'NO'))
+        lambda_vector_db_ingestion_handler.add_environment("BEDROCK_HEDGING_ENABLED",bedrock_config.get('hedging', 'NO'))
+
+        '''Stage timings are logged as CloudWatch Embedded Metric Format records (see Trace in utils/chatbot_utils.py)'''
+        metrics_namespace = f"Chatter/{config_data['deployment']['name']}"
+        lambda_ws_message_handler.add_environment("METRICS_NAMESPACE",metrics_namespace)
+        lambda_vector_db_ingestion_handler.add_environment("METRICS_NAMESPACE",metrics_namespace)
 
         # Create a CloudWatch Dashboard
         dashboard = cloudwatch.Dashboard(
             self, "MyChatterDashboard",
             dashboard_name=f"Chatter_Dashboard-{config_data['deployment']['name']}"
         )
+
+        def stage_metric(handler, metric_name, statistic):
+            return cloudwatch.Metric(namespace=metrics_namespace, metric_name=metric_name,
+                                     dimensions_map={"Handler": handler}, statistic=statistic,
+                                     period=Duration.minutes(5), label=f"{metric_name} {statistic}")
+
+        message_stages = ["embedding_ms", "search_ms", "rerank_ms", "ttft_ms", "llm_ms", "send_ms", "log_ms", "total_ms"]
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(title="Message latency by stage p50", width=12,
+                left=[stage_metric("ws_message_handler", name, "p50") for name in message_stages]),
+            cloudwatch.GraphWidget(title="Message latency by stage p99", width=12,
+                left=[stage_metric("ws_message_handler", name, "p99") for name in message_stages]))
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(title="Time to first token", width=8,
+                left=[stage_metric("ws_message_handler", "ttft_ms", statistic) for statistic in ["p50", "p90", "p99"]]),
+            cloudwatch.GraphWidget(title="Message end to end", width=8,
+                left=[stage_metric("ws_message_handler", "total_ms", statistic) for statistic in ["p50", "p90", "p99"]]),
+            cloudwatch.GraphWidget(title="Tokens and semantic cache hits", width=8,
+                left=[stage_metric("ws_message_handler", "output_tokens", "Average")],
+                right=[stage_metric("ws_message_handler", "semantic_cache_hit", "Sum")]))
+        ingestion_stages = ["download_ms", "ingest_ms", "embedding_ms", "flush_ms", "shard_ms", "finalize_ms"]
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(title="Ingestion latency by stage p50", width=8,
+                left=[stage_metric("vectordb_ingestion_handler", name, "p50") for name in ingestion_stages]),
+            cloudwatch.GraphWidget(title="Ingestion latency by stage p99", width=8,
+                left=[stage_metric("vectordb_ingestion_handler", name, "p99") for name in ingestion_stages]),
+            cloudwatch.GraphWidget(title="Chunks indexed", width=8,
+                left=[stage_metric("vectordb_ingestion_handler", "chunks_indexed", "Sum"),
+                      stage_metric("vectordb_ingestion_handler", "chunks_unchanged", "Sum")]))
        
        
        # print outputs
@@ -330,5 +448,6 @@ def create_dynamodb_table(self,scope, \
         billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST, 
         partition_key=dynamodb.Attribute(name=primary_key_name, type=dynamodb.AttributeType.STRING), 
         sort_key=dynamodb.Attribute(name=sort_key_name, type=dynamodb.AttributeType.STRING),
+        time_to_live_attribute="ttl",
         removal_policy=removal_policy)
     return table
\ No newline at end of file
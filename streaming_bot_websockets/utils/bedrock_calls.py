@@ -0,0 +1,282 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, wait
+
+'''Error codes Bedrock returns when we should slow down and try again'''
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException",
+                          "ServiceUnavailableException", "ModelNotReadyException"}
+
+'''Worth another attempt, on the same model or a fallback, but not a reason to slow down'''
+TRANSIENT_ERROR_CODES = {"ModelTimeoutException", "InternalServerException"}
+
+
+def is_throttling_error(ex):
+    code = getattr(ex, "response", {}).get("Error", {}).get("Code")
+    return code in THROTTLING_ERROR_CODES
+
+
+def is_retryable_error(ex):
+    code = getattr(ex, "response", {}).get("Error", {}).get("Code")
+    return code in THROTTLING_ERROR_CODES or code in TRANSIENT_ERROR_CODES or \
+        type(ex).__name__ in ("ReadTimeoutError", "ConnectTimeoutError", "EndpointConnectionError")
+
+
+def call_with_backoff(fn, *args, max_retries=5, base_delay=0.25, max_delay=8.0, retry_on=is_throttling_error,
+                      **kwargs):
+    """
+    Call fn, retrying errors retry_on accepts (throttling by default) with
+    exponential backoff and full jitter.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except Exception as ex:
+            if attempt >= max_retries or not retry_on(ex):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            # botocore raises ClientError for every service error, the code says which one
+            reason = getattr(ex, "response", {}).get("Error", {}).get("Code") or type(ex).__name__
+            print(f"Retrying after {reason} ({ex}), retry {attempt + 1} in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+class TokenBucket:
+    """
+    Rate limiter for one model: acquire() blocks until a request may go out.
+    The rate adapts, halved on every throttle (down to min_rate) and raised
+    by a twentieth of max_rate per success, so a container backs off when
+    the account quota is shared with other containers and recovers after.
+    """
+
+    def __init__(self, rate, burst=None, min_rate=None):
+        self.max_rate = self.rate = float(rate)
+        self.min_rate = min_rate or self.max_rate / 20
+        self.burst = burst or max(1.0, self.max_rate)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        '''Take a token, returns the seconds spent waiting for it'''
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def on_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class LatencyWindow:
+    '''Recent call durations of a model, for picking the hedging delay'''
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct, min_samples=20):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+_buckets = {}
+_latencies = {}
+_state_lock = threading.Lock()
+_hedge_executor = None
+
+
+def rate_limit(model_id):
+    '''Requests per second allowed for a model: BEDROCK_RATE_LIMITS (JSON, by model id) or BEDROCK_MAX_RPS'''
+    limits = json.loads(os.environ.get("BEDROCK_RATE_LIMITS", "{}"))
+    return float(limits.get(model_id, os.environ.get("BEDROCK_MAX_RPS", "20")))
+
+
+def get_bucket(model_id, region=None):
+    '''Token bucket per (model, region), shared by every client in the container'''
+    with _state_lock:
+        if (model_id, region) not in _buckets:
+            _buckets[(model_id, region)] = TokenBucket(rate_limit(model_id))
+        return _buckets[(model_id, region)]
+
+
+def get_latencies(model_id):
+    with _state_lock:
+        return _latencies.setdefault(model_id, LatencyWindow())
+
+
+def reset_call_state():
+    '''Forget buckets and latencies, for tests'''
+    with _state_lock:
+        _buckets.clear()
+        _latencies.clear()
+
+
+def _get_hedge_executor():
+    global _hedge_executor
+    with _state_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="bedrock-hedge")
+        return _hedge_executor
+
+
+class ResilientBedrockClient:
+    """
+    Drop-in for a bedrock-runtime client (invoke_model and
+    invoke_model_with_response_stream) that:
+      - waits for the model's token bucket before each request
+      - retries throttling and transient errors with backoff and jitter
+      - then moves on to the fallback routes configured for the model, each
+        a different model id and/or region ({"model_id": ..., "region": ...})
+      - optionally hedges invoke_model for models in hedge_models: if no
+        answer came back within the model's recent p95 latency, a second
+        identical request is sent when the bucket has a spare token, and the
+        first answer wins. Only for idempotent, cheap calls like embeddings.
+    Embedding fallbacks must keep the model id, vectors of different models
+    do not mix in one index.
+    """
+
+    def __init__(self, client, region=None, fallbacks=None, hedge_models=(), client_for_region=None,
+                 max_retries=3, base_delay=0.25, max_delay=4.0, hedge_percentile=95, hedge_min_delay=0.02):
+        self.client = client
+        self.region = region
+        self.fallbacks = fallbacks or {}
+        self.hedge_models = tuple(hedge_models)
+        self.client_for_region = client_for_region
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def routes(self, model_id):
+        '''(client, model id, region) to try in order, clients for other regions are only created when reached'''
+        yield self.client, model_id, self.region
+        for fallback in self.fallbacks.get(model_id, []):
+            region = fallback.get("region", self.region)
+            client = self.client if region == self.region else self.client_for_region(region)
+            yield client, fallback.get("model_id", model_id), region
+
+    def _call(self, method, model_id, kwargs, token_held=False):
+        '''With token_held the caller already took the first request's token from the bucket'''
+        last_error = None
+        for client, route_model, region in self.routes(model_id):
+            bucket = get_bucket(route_model, region)
+            latencies = get_latencies(route_model)
+
+            def attempt():
+                nonlocal token_held
+                if token_held:
+                    token_held = False
+                else:
+                    bucket.acquire()
+                start = time.perf_counter()
+                try:
+                    result = getattr(client, method)(modelId=route_model, **kwargs)
+                except Exception as ex:
+                    if is_throttling_error(ex):
+                        bucket.on_throttle()
+                    raise
+                bucket.on_success()
+                latencies.add(time.perf_counter() - start)
+                return result
+
+            try:
+                return call_with_backoff(attempt, max_retries=self.max_retries, base_delay=self.base_delay,
+                                         max_delay=self.max_delay, retry_on=is_retryable_error)
+            except Exception as ex:
+                if not is_retryable_error(ex):
+                    raise
+                last_error = ex
+                print(f"Bedrock {route_model} in {region or 'default region'} failed after retries: {ex}")
+        raise last_error
+
+    def _hedged(self, model_id, kwargs):
+        delay = get_latencies(model_id).percentile(self.hedge_percentile)
+        if delay is None:
+            return self._call("invoke_model", model_id, kwargs)
+        executor = _get_hedge_executor()
+        primary = executor.submit(self._call, "invoke_model", model_id, kwargs)
+        try:
+            return primary.result(timeout=max(self.hedge_min_delay, delay))
+        except TimeoutError:
+            pass
+        # a hedge only goes out with spare capacity, it must not add to throttling
+        if not get_bucket(model_id, self.region).try_acquire():
+            return primary.result()
+        with self._lock:
+            self.hedges += 1
+        hedge = executor.submit(self._call, "invoke_model", model_id, kwargs, token_held=True)
+        done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        first = done.pop()
+        if first.exception() is None:
+            if first is hedge:
+                with self._lock:
+                    self.hedge_wins += 1
+            return first.result()
+        other = hedge if first is primary else primary
+        return other.result()
+
+    def invoke_model(self, body, modelId, **kwargs):
+        kwargs = dict(kwargs, body=body)
+        if self.hedge_models and modelId.startswith(self.hedge_models):
+            return self._hedged(modelId, kwargs)
+        return self._call("invoke_model", modelId, kwargs)
+
+    def invoke_model_with_response_stream(self, body, modelId, **kwargs):
+        return self._call("invoke_model_with_response_stream", modelId, dict(kwargs, body=body))
+
+
+def resilient_client(client, region=None):
+    """
+    Wrap a bedrock-runtime client with the settings from the environment:
+    BEDROCK_FALLBACKS (JSON, model id to a list of routes) and
+    BEDROCK_HEDGING_ENABLED=YES to hedge embedding calls.
+    """
+    from utils.chatbot_utils import get_client
+    hedge_models = ("amazon.titan-embed", "cohere.embed") \
+        if os.environ.get("BEDROCK_HEDGING_ENABLED", "NO") == "YES" else ()
+    return ResilientBedrockClient(client, region=region,
+                                  fallbacks=json.loads(os.environ.get("BEDROCK_FALLBACKS", "{}")),
+                                  hedge_models=hedge_models,
+                                  client_for_region=lambda r: get_client('bedrock-runtime', region_name=r))
@@ -1,5 +1,111 @@
 import json
+import os
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 import boto3 
+from botocore.config import Config
+from utils.embeddings import DEFAULT_EMBEDDING_MODEL_ID, embedding_provider
+
+'''Shared by every client in the registry: bigger connection pool and TCP keep-alive
+so warm invocations reuse open connections instead of a new TLS handshake per call'''
+CLIENT_CONFIG = Config(max_pool_connections=50,
+                       tcp_keepalive=True,
+                       connect_timeout=5,
+                       read_timeout=120,
+                       retries={"mode": "standard", "max_attempts": 3})
+
+'''bedrock-runtime clients do not retry, ResilientBedrockClient (utils/bedrock_calls.py) owns retries,
+backoff and fallbacks for Bedrock and botocore retries under it would multiply its attempts'''
+BEDROCK_CLIENT_CONFIG = CLIENT_CONFIG.merge(Config(retries={"mode": "standard", "total_max_attempts": 1}))
+
+_session = boto3.session.Session()
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _registry_get(key, factory):
+    instance = _registry.get(key)
+    if instance is None:
+        #boto3 sessions are not thread safe, build under the lock
+        with _registry_lock:
+            instance = _registry.get(key)
+            if instance is None:
+                instance = factory()
+                _registry[key] = instance
+    return instance
+
+
+def get_client(service_name, **kwargs):
+    """
+    Lazily created boto3 client, one per (service, arguments) for the life of
+    the container.
+    """
+    key = ("client", service_name, tuple(sorted(kwargs.items())))
+    config = BEDROCK_CLIENT_CONFIG if service_name == 'bedrock-runtime' else CLIENT_CONFIG
+    return _registry_get(key, lambda: _session.client(service_name, config=config, **kwargs))
+
+
+def get_resource(service_name, **kwargs):
+    key = ("resource", service_name, tuple(sorted(kwargs.items())))
+    return _registry_get(key, lambda: _session.resource(service_name, config=CLIENT_CONFIG, **kwargs))
+
+
+class LazyTable:
+    """
+    DynamoDB Table that creates the resource on first use. Loading the
+    resource model takes tens of milliseconds, objects built at module load
+    hold one of these so the handler import does not pay for it.
+    """
+
+    def __init__(self, table_name, dynamodb=None):
+        self.table_name = table_name
+        self._dynamodb = dynamodb
+        self._table = None
+
+    def __getattr__(self, name):
+        if self._table is None:
+            self._table = (self._dynamodb or get_resource('dynamodb')).Table(self.table_name)
+        return getattr(self._table, name)
+
+
+def get_opensearch_client(endpoint, region, pool_maxsize=20):
+    """
+    Lazily created, SigV4 signed OpenSearch Serverless client for endpoint.
+    """
+    def create():
+        import urllib.parse
+        from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+        auth = AWSV4SignerAuth(_session.get_credentials(), region, "aoss")
+        return OpenSearch(
+            hosts = [{"host": urllib.parse.urlparse(endpoint).netloc, "port": 443}],
+            http_auth = auth,
+            use_ssl = True,
+            verify_certs = True,
+            connection_class = RequestsHttpConnection,
+            pool_maxsize = pool_maxsize
+        )
+    return _registry_get(("opensearch", endpoint, region), create)
+
+
+def register_client(key, instance):
+    """
+    Put an instance in the registry, used to swap in fakes for tests and
+    benchmarks. key is the service name for get_client/get_resource without
+    arguments, or the full registry key.
+    """
+    if isinstance(key, str):
+        key = ("client", key, ())
+    with _registry_lock:
+        _registry[key] = instance
+
+
+def clear_registry():
+    with _registry_lock:
+        _registry.clear()
+
 
 def invoke_model(bedrock_client,prompt):
 
@@ -54,18 +160,25 @@ def invoke_model_with_streaming_response(bedrock_client,prompt):
     return stream
 
 
-def text_embedding(bedrock_client,text):
-    body=json.dumps({"inputText": text})
-    response = bedrock_client.invoke_model(body=body, modelId='amazon.titan-embed-text-v1', accept='application/json', contentType='application/json')
-    response_body = json.loads(response.get('body').read())
-    embedding = response_body.get('embedding')
-    return embedding
+EMBEDDING_MODEL_ID = os.environ.get('EMBEDDING_MODEL_ID', DEFAULT_EMBEDDING_MODEL_ID)
 
 
-def search_index(client,index_name,vector,no_of_results):
-    
-    document = {
-        "size": 5,
+def text_embedding(bedrock_client,text,cache=None,model_id=EMBEDDING_MODEL_ID,dimensions=None):
+    if cache is not None:
+        return cache.embed(text, lambda t: text_embedding(bedrock_client, t, model_id=model_id, dimensions=dimensions))
+    #Titan v2 can return 256, 512 or 1024 dimensions, normalized; many texts at once go through embed_batch
+    return list(embedding_provider(model_id, dimensions, client=bedrock_client).embed([text])[0])
+
+
+def search_index(client,index_name,vector,no_of_results,query_text=None,mode="knn",size=5,rrf_k=60):
+    """
+    kNN search over doc_vector. With mode="hybrid" and the question text, a
+    BM25 match on doc_text runs alongside it in the same msearch round trip
+    and the two rankings are merged with reciprocal rank fusion, which finds
+    exact terms such as product codes that vector search misses.
+    """
+    knn_document = {
+        "size": size,
         "_source": {"excludes": ["doc_vector"]},
         "query": {
             "knn": {
@@ -76,21 +189,51 @@ def search_index(client,index_name,vector,no_of_results):
             }
         }
     }
-    response = client.search(
-    body = document,
-    index = index_name
+    if mode != "hybrid" or not query_text:
+        response = client.search(
+        body = knn_document,
+        index = index_name
+        )
+        return response
+
+    #Fetch more candidates from each side than we return, fusion reorders them
+    candidates = max(size, no_of_results) * 2
+    knn_document["size"] = candidates
+    knn_document["query"]["knn"]["doc_vector"]["k"] = candidates
+    lexical_document = {
+        "size": candidates,
+        "_source": {"excludes": ["doc_vector"]},
+        "query": {"match": {"doc_text": {"query": query_text}}}
+    }
+    response = client.msearch(
+    body = [{"index": index_name}, knn_document, {"index": index_name}, lexical_document]
     )
-    return response
+    rankings = [r.get('hits', {}).get('hits', []) for r in response['responses']]
+    return {"hits": {"hits": reciprocal_rank_fusion(rankings, k=rrf_k)[:size]}}
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Merge ranked hit lists by summing 1 / (k + rank) per document id, the
+    fused score replaces _score.
+    """
+    fused = {}
+    for hits in rankings:
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.setdefault(hit['_id'], dict(hit, _score=0.0))
+            entry['_score'] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda hit: hit['_score'], reverse=True)
 
 
 def log_to_db(pk,sk,table_name,event_json_obj):
     
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = get_resource('dynamodb')
     events_table_ref = dynamodb.Table(table_name)
     event = {}
     event['pk'] = pk
     event['sk'] = sk
-    event['body'] = event_json_obj
+    #DynamoDB rejects Python floats, metrics such as tokens_per_sec go in as Decimal
+    event['body'] = json.loads(json.dumps(event_json_obj), parse_float=Decimal)
     print(f"Logging event to DynamoDb {event}")
     events_table_ref.put_item(
         Item=event)
@@ -111,7 +254,7 @@ def send_message(ws_client,connection_id, message):
 
 
 def send_to_msg_bus(evt_bus_name,event):
-    eb_client = boto3.client('events')
+    eb_client = get_client('events')
     response = eb_client.put_events(
     Entries=[
         {
@@ -125,4 +268,118 @@ def send_to_msg_bus(evt_bus_name,event):
         }
     ]
     )
-    return response
\ No newline at end of file
+    return response
+
+
+_side_effect_executor = None
+
+
+def _get_side_effect_executor():
+    global _side_effect_executor
+    if _side_effect_executor is None:
+        _side_effect_executor = _registry_get(("executor", "side_effects"),
+                                              lambda: ThreadPoolExecutor(max_workers=4,
+                                                                         thread_name_prefix="side-effect"))
+    return _side_effect_executor
+
+
+class SideEffects:
+    """
+    Work the user doesn't wait on (logging, event publishing) started in the
+    background as soon as it is known, and awaited once at the end of the
+    invocation, since Lambda freezes the container after the handler returns.
+    """
+
+    def __init__(self):
+        self._futures = {}
+
+    def submit(self, name, fn, *args, **kwargs):
+        self._futures[_get_side_effect_executor().submit(fn, *args, **kwargs)] = name
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds, returns {name: error} for side effects
+        that raised or did not finish in time.
+        """
+        start = time.perf_counter()
+        done, not_done = wait(self._futures, timeout=max(timeout, 0))
+        errors = {}
+        for future in done:
+            if future.exception() is not None:
+                errors[self._futures[future]] = repr(future.exception())
+        for future in not_done:
+            errors[self._futures[future]] = f"not finished after {timeout:.1f}s"
+        print(f"Side effects finished in {(time.perf_counter() - start) * 1000:.1f}ms, errors: {errors}")
+        self._futures = {}
+        return errors
+
+
+'''CloudWatch namespace for request timings, the stack sets one per deployment'''
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "Chatter")
+
+
+class Trace:
+    """
+    Stage timings of one request, emitted as a single CloudWatch Embedded
+    Metric Format record: one log line, no PutMetricData call. Spans record
+    <name>_ms, a stage timed more than once (or from several threads, like
+    side effects) adds up. Counts such as tokens go in with count().
+    """
+
+    def __init__(self, handler, namespace=None, **properties):
+        self.handler = handler
+        self.namespace = namespace or METRICS_NAMESPACE
+        self.properties = properties
+        self.timings = {}
+        self.counts = {}
+        self.started_at = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def timed(self, name, fn):
+        '''fn wrapped in a span, for work handed to other threads'''
+        def run(*args, **kwargs):
+            with self.span(name):
+                return fn(*args, **kwargs)
+        return run
+
+    def record(self, name, ms):
+        if ms is None:
+            return
+        with self._lock:
+            self.timings[f"{name}_ms"] = self.timings.get(f"{name}_ms", 0.0) + ms
+
+    def count(self, name, value):
+        if value is None:
+            return
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def emf(self):
+        timings = dict(self.timings, total_ms=(time.perf_counter() - self.started_at) * 1000)
+        metrics = [{"Name": name, "Unit": "Milliseconds"} for name in timings] + \
+                  [{"Name": name, "Unit": "Count"} for name in self.counts]
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{"Namespace": self.namespace, "Dimensions": [["Handler"]],
+                                       "Metrics": metrics}],
+            },
+            "Handler": self.handler,
+            **self.properties,
+            **{name: round(ms, 1) for name, ms in timings.items()},
+            **self.counts,
+        }
+
+    def emit(self):
+        '''Print the EMF record, Lambda ships stdout to CloudWatch Logs which extracts the metrics'''
+        record = self.emf()
+        print(json.dumps(record))
+        return record
@@ -0,0 +1,163 @@
+import re
+from collections import Counter
+
+from utils.context_builder import estimate_tokens
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+NUMBERED_HEADING = re.compile(r"^(\d+(\.\d+)*\.?|[A-Z]\.|Chapter \d+|Section \d+)\s+\S")
+
+
+def is_heading(line):
+    """
+    Short line without closing punctuation that is numbered, in title case
+    or upper case, e.g. "2.1 Returns and Refunds" or "SHIPPING".
+    """
+    line = line.strip()
+    if not line or len(line) > 80 or line[-1] in ".,;:!?":
+        return False
+    if NUMBERED_HEADING.match(line) or line.isupper():
+        return True
+    words = [w for w in re.findall(r"[A-Za-z]+", line) if len(w) > 3]
+    return bool(words) and all(w[0].isupper() for w in words)
+
+
+def blocks(text):
+    """
+    Group page lines into (heading, paragraph text) blocks, joining lines
+    wrapped by the PDF layout back into running text.
+    """
+    heading, lines = None, []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            if lines:
+                yield heading, " ".join(lines)
+                lines = []
+            continue
+        if is_heading(line):
+            if lines:
+                yield heading, " ".join(lines)
+                lines = []
+            heading = line
+            continue
+        lines.append(line)
+    if lines:
+        yield heading, " ".join(lines)
+
+
+def split_sentences(paragraph):
+    return [s for s in SENTENCE_END.split(paragraph) if s.strip()]
+
+
+def split_long(sentence, max_tokens):
+    '''Break a sentence over max_tokens at word boundaries'''
+    words, piece = sentence.split(), []
+    for word in words:
+        if piece and estimate_tokens(" ".join(piece + [word])) > max_tokens:
+            yield " ".join(piece)
+            piece = []
+        piece.append(word)
+    if piece:
+        yield " ".join(piece)
+
+
+class StructuredChunker:
+    """
+    Token aware splitter: sentences are packed into chunks of about
+    target_tokens, never past max_tokens, a chunk never spans two headings
+    and starts with its section heading. The last overlap_tokens worth of
+    sentences are repeated at the start of the next chunk in a section.
+    Drop-in for CharacterTextSplitter.split_text.
+    """
+
+    def __init__(self, target_tokens=200, max_tokens=300, overlap_tokens=30, min_tokens=40):
+        self.target_tokens = target_tokens
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = min_tokens
+
+    def split_text(self, text):
+        chunks = []
+        for heading, sentences in self._sections(text):
+            chunks.extend(self._pack(heading, sentences))
+        return chunks
+
+    def _sections(self, text):
+        current, sentences = None, []
+        for heading, paragraph in blocks(text):
+            if heading != current and sentences:
+                yield current, sentences
+                sentences = []
+            current = heading
+            for sentence in split_sentences(paragraph):
+                sentences.extend(split_long(sentence, self.max_tokens))
+        if sentences:
+            yield current, sentences
+
+    def _pack(self, heading, sentences):
+        prefix = f"{heading}\n" if heading else ""
+        chunks, current = [], []
+        for sentence in sentences:
+            candidate = prefix + " ".join(current + [sentence])
+            if current and estimate_tokens(candidate) > self.target_tokens:
+                chunks.append(current)
+                current = self._overlap(current)
+                if estimate_tokens(prefix + " ".join(current + [sentence])) > self.max_tokens:
+                    current = []
+            current.append(sentence)
+        if current:
+            # fold a short tail into the previous chunk when it still fits
+            tail = [s for s in current if not chunks or s not in chunks[-1]]
+            merged = chunks[-1] + tail if chunks else None
+            if chunks and estimate_tokens(" ".join(tail)) < self.min_tokens \
+                    and estimate_tokens(prefix + " ".join(merged)) <= self.max_tokens:
+                chunks[-1] = merged
+            else:
+                chunks.append(current)
+        return [prefix + " ".join(chunk) for chunk in chunks]
+
+    def _overlap(self, sentences):
+        kept, tokens = [], 0
+        for sentence in reversed(sentences):
+            tokens += estimate_tokens(sentence)
+            if tokens > self.overlap_tokens:
+                break
+            kept.insert(0, sentence)
+        return kept
+
+
+def boilerplate_key(line):
+    '''Line with digits masked, so "Page 3 of 90" matches on every page'''
+    return re.sub(r"\d+", "#", line.strip().lower())
+
+
+def strip_boilerplate(pages, sample_pages=20, min_share=0.6, edge_lines=3):
+    """
+    Drop headers and footers from (page_number, text) pairs: lines among the
+    first or last edge_lines of a page that recur on at least min_share of
+    the first sample_pages pages. Only the sample is buffered, later pages
+    stream through.
+    """
+    pages = iter(pages)
+    sample = []
+    for page in pages:
+        sample.append(page)
+        if len(sample) >= sample_pages:
+            break
+    counts = Counter()
+    for _, text in sample:
+        lines = [line for line in text.splitlines() if line.strip()]
+        counts.update({boilerplate_key(line) for line in lines[:edge_lines] + lines[-edge_lines:]})
+    repeated = {key for key, count in counts.items() if len(sample) > 1 and count >= min_share * len(sample)}
+
+    def clean(text):
+        lines = text.splitlines()
+        content = [i for i, line in enumerate(lines) if line.strip()]
+        edges = set(content[:edge_lines] + content[-edge_lines:])
+        return "\n".join(line for i, line in enumerate(lines)
+                         if i not in edges or boilerplate_key(line) not in repeated)
+
+    for page_number, text in sample:
+        yield page_number, clean(text)
+    for page_number, text in pages:
+        yield page_number, clean(text)
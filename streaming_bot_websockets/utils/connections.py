@@ -0,0 +1,110 @@
+import json
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils.chatbot_utils import LazyTable, get_client
+from utils.stream_sender import is_gone_error
+
+'''Events with this source on the bus are posted to every connected client by the message handler'''
+BROADCAST_EVENT_SOURCE = "com.onebyzero.chatter.broadcast"
+
+'''API Gateway closes WebSocket connections after 2 hours at most'''
+CONNECTION_TTL_SECONDS = 2 * 3600
+
+
+class ConnectionRegistry:
+    """
+    Open WebSocket connections in the events table, spread over `shards`
+    partitions (pk=connections#<n>, sk=<connection id>) so thousands of
+    connects do not all write one partition. Items carry a ttl, DynamoDB
+    may take a while to expire them so expired items are skipped on read.
+    """
+
+    def __init__(self, table_name, shards=8, ttl_seconds=CONNECTION_TTL_SECONDS, dynamodb=None):
+        self.table = LazyTable(table_name, dynamodb)
+        self.shards = shards
+        self.ttl_seconds = ttl_seconds
+
+    def _key(self, connection_id):
+        shard = zlib.crc32(connection_id.encode("utf-8")) % self.shards
+        return {"pk": f"connections#{shard:02d}", "sk": connection_id}
+
+    def register(self, connection_id, **attributes):
+        now = int(time.time())
+        self.table.put_item(Item={**self._key(connection_id), "connected_at": now,
+                                  "ttl": now + self.ttl_seconds, **attributes})
+
+    def remove(self, connection_id):
+        self.table.delete_item(Key=self._key(connection_id))
+
+    def remove_many(self, connection_ids):
+        with self.table.batch_writer() as batch:
+            for connection_id in connection_ids:
+                batch.delete_item(Key=self._key(connection_id))
+
+    def connection_ids(self):
+        '''Live connection ids, read a page at a time so a broadcast can start on the first page'''
+        now = int(time.time())
+        for shard in range(self.shards):
+            query = {"KeyConditionExpression": "pk = :pk",
+                     "ExpressionAttributeValues": {":pk": f"connections#{shard:02d}"},
+                     "ExpressionAttributeNames": {"#ttl": "ttl"},
+                     "ProjectionExpression": "sk, #ttl"}
+            while True:
+                response = self.table.query(**query)
+                for item in response["Items"]:
+                    if int(item.get("ttl", now)) >= now:
+                        yield item["sk"]
+                if "LastEvaluatedKey" not in response:
+                    break
+                query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def broadcast(ws_client, connection_ids, data, registry=None, workers=48):
+    """
+    Post data to every connection with at most `workers` posts in flight,
+    connection ids are pulled lazily. Connections that are gone are removed
+    from the registry in one batch at the end, other failures are counted.
+    Keep workers under the client's connection pool (max_pool_connections).
+    Returns sent, gone, failed and seconds.
+    """
+    start = time.perf_counter()
+    stats = {"sent": 0, "gone": 0, "failed": 0}
+    gone = []
+
+    def post(connection_id):
+        try:
+            ws_client.post_to_connection(ConnectionId=connection_id, Data=data)
+            return connection_id, "sent"
+        except Exception as ex:
+            if is_gone_error(ex):
+                return connection_id, "gone"
+            print(f"Broadcast to {connection_id} failed: {ex}")
+            return connection_id, "failed"
+
+    def collect(futures):
+        for future in futures:
+            connection_id, outcome = future.result()
+            stats[outcome] += 1
+            if outcome == "gone":
+                gone.append(connection_id)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for connection_id in connection_ids:
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(executor.submit(post, connection_id))
+        collect(wait(pending).done)
+    if registry is not None and gone:
+        registry.remove_many(gone)
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return stats
+
+
+def publish_broadcast(event_bus_name, message):
+    '''Ask the message handler to post message (a JSON serializable dict) to every connected client'''
+    get_client('events').put_events(Entries=[{"Source": BROADCAST_EVENT_SOURCE, "DetailType": BROADCAST_EVENT_SOURCE,
+                                              "Detail": json.dumps(message), "EventBusName": event_bus_name}])
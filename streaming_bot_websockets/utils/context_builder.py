@@ -0,0 +1,144 @@
+import re
+
+from utils.embedding_cache import chunk_hash
+
+'''Rough characters per token for English text with Claude and Titan tokenizers'''
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """
+    Cheap token estimate, good enough for budgeting without loading a tokenizer.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def overlap_length(first, second, min_overlap=20, max_overlap=600):
+    """
+    Length of the longest suffix of first that is a prefix of second, 0 when
+    shorter than min_overlap. The splitter repeats up to chunk_overlap
+    characters between neighbouring chunks.
+    """
+    if len(first) < min_overlap or len(second) < min_overlap:
+        return 0
+    start = max(0, len(first) - min(len(second), max_overlap))
+    anchor = second[:min_overlap]
+    position = first.find(anchor, start)
+    while position != -1:
+        if second.startswith(first[position:]):
+            return len(first) - position
+        position = first.find(anchor, position + 1)
+    return 0
+
+
+def strip_shared_heading(first, second):
+    """
+    second without its first line when first starts with the same line.
+    StructuredChunker starts every chunk of a section with the section
+    heading, so the overlap between neighbours comes after it.
+    """
+    end = second.find("\n") + 1
+    if end and first.startswith(second[:end]):
+        return second[end:]
+    return second
+
+
+def merged_text(first, second, min_overlap=20):
+    '''Text of first and second joined on their overlap, or None when they do not overlap'''
+    body = strip_shared_heading(first, second)
+    if body in first:
+        return first
+    if strip_shared_heading(second, first) in second:
+        return second
+    length = overlap_length(first, body, min_overlap)
+    if length:
+        return first + body[length:]
+    other_body = strip_shared_heading(second, first)
+    length = overlap_length(second, other_body, min_overlap)
+    if length:
+        return second + other_body[length:]
+    return None
+
+
+def merge_passages(passages, min_overlap=20):
+    """
+    Merge passages of the same source whose text overlaps end to start, and
+    drop passages contained in another one. A merged passage is compared
+    again with the rest, so chunks that arrive out of order still join up.
+    A passage is a dict with text, score and ids.
+    """
+    merged = []
+    for passage in sorted(passages, key=lambda p: len(p["text"]), reverse=True):
+        passage = dict(passage, ids=list(passage["ids"]))
+        while True:
+            for n, other in enumerate(merged):
+                text = merged_text(other["text"], passage["text"], min_overlap)
+                if text is not None:
+                    del merged[n]
+                    _absorb(other, passage, text)
+                    passage = other
+                    break
+            else:
+                merged.append(passage)
+                break
+    return merged
+
+
+def _absorb(into, passage, text):
+    into["text"] = text
+    into["score"] = max(into["score"], passage["score"])
+    into["rank"] = min(into["rank"], passage["rank"])
+    into["ids"].extend(passage["ids"])
+
+
+def truncate_to_tokens(text, tokens):
+    '''Cut text at a word boundary to about tokens tokens'''
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > 0 else limit]
+
+
+def build_context(hits, token_budget=1500, separator="\n\n"):
+    """
+    Turn search hits into prompt context: exact duplicates are dropped,
+    overlapping or adjacent chunks from the same document are merged into one
+    passage, passages are taken best score first until token_budget is spent.
+    Hits from rerank() are scored by their _rerank_score, others by _score.
+    Returns the context text, the passages used, the ids of the chunks behind
+    them and the token estimates before and after.
+    """
+    seen = set()
+    by_source = {}
+    raw_tokens = 0
+    for rank, hit in enumerate(hits):
+        source = hit.get("_source", {})
+        text = re.sub(r"[ \t]+", " ", source.get("doc_text", "")).strip()
+        raw_tokens += estimate_tokens(source.get("doc_text", ""))
+        key = chunk_hash(text)
+        if not text or key in seen:
+            continue
+        seen.add(key)
+        group = source.get("doc_source") or f"hit-{rank}"
+        score = hit["_rerank_score"] if "_rerank_score" in hit else hit.get("_score")
+        by_source.setdefault(group, []).append({"text": text, "score": score or 0.0,
+                                                "ids": [hit.get("_id")], "rank": rank})
+
+    passages = [passage for group in by_source.values() for passage in merge_passages(group)]
+    passages.sort(key=lambda p: (-p["score"], p["rank"]))
+
+    used, ids, remaining = [], [], token_budget
+    for passage in passages:
+        tokens = estimate_tokens(passage["text"])
+        if tokens > remaining:
+            if used:
+                continue
+            passage = dict(passage, text=truncate_to_tokens(passage["text"], remaining))
+            tokens = estimate_tokens(passage["text"])
+        used.append(passage["text"])
+        ids.extend(passage["ids"])
+        remaining -= tokens
+    text = separator.join(used)
+    return {"text": text, "passages": used, "ids": ids,
+            "tokens": estimate_tokens(text), "raw_tokens": raw_tokens}
@@ -0,0 +1,163 @@
+import re
+import time
+from uuid import uuid4
+
+from utils.chatbot_utils import LazyTable
+from utils.context_builder import estimate_tokens, truncate_to_tokens
+from utils.query_cache import LRUCache
+
+'''Message ids sort by time within a session: msg-<epoch ms>-<random>'''
+MSG_ID_PREFIX = "msg-"
+
+'''The rolling summary sorts after every message id, so a newest first Query returns it first'''
+SUMMARY_SK = f"{MSG_ID_PREFIX}~summary"
+
+'''Words that make a message lean on the previous one, "and its warranty?"'''
+FOLLOW_UP = re.compile(r"\b(it|its|it's|they|them|their|this|that|these|those|he|she|his|her|one|ones|same|"
+                       r"also|too|else|instead|another|other)\b", re.IGNORECASE)
+
+
+def new_msg_id(now=None):
+    millis = int((time.time() if now is None else now) * 1000)
+    return f"{MSG_ID_PREFIX}{millis:013d}-{uuid4().hex[:12]}"
+
+
+def format_turns(turns, max_answer_tokens=None):
+    return "\n".join(f"User: {user_msg}\nAssistant: "
+                     f"{truncate_to_tokens(ai_msg, max_answer_tokens) if max_answer_tokens else ai_msg}"
+                     for _, user_msg, ai_msg in turns)
+
+
+class Conversation:
+    """
+    Summary of the older turns of a session plus the turns since, as
+    (msg_id, user_msg, ai_msg) oldest first.
+    """
+
+    def __init__(self, summary="", summarized_through="", turns=None):
+        self.summary = summary
+        self.summarized_through = summarized_through
+        self.turns = turns or []
+
+    def add(self, msg_id, user_msg, ai_msg):
+        self.turns = self.turns + [(msg_id, user_msg, ai_msg)]
+
+    def summarized(self, summary, through):
+        self.summary, self.summarized_through = summary, through
+        self.turns = [turn for turn in self.turns if turn[0] > through]
+
+    def history(self, token_budget=400, window=6, max_answer_tokens=120):
+        """
+        Prompt text of the conversation within token_budget: the summary,
+        given up to a third of the budget, then as many of the last `window`
+        turns as fit, newest kept first. Long answers are cut to
+        max_answer_tokens, the question matters more for a follow-up.
+        """
+        parts, budget = [], token_budget
+        if self.summary:
+            summary = truncate_to_tokens(self.summary, token_budget // 3)
+            parts.append(f"Earlier in this conversation: {summary}")
+            budget -= estimate_tokens(parts[0])
+        recent = []
+        for turn in reversed(self.turns[-window:]):
+            text = format_turns([turn], max_answer_tokens)
+            if estimate_tokens(text) > budget:
+                break
+            recent.append(text)
+            budget -= estimate_tokens(text)
+        return "\n".join(parts + recent[::-1])
+
+
+class ConversationStore:
+    """
+    Conversations in the events table: the turns log_to_db writes under
+    pk=<connection id>, sk=<msg id>, and a rolling summary of older turns
+    under sk=SUMMARY_SK. A conversation is loaded with a single newest
+    first Query and cached in the container; turns answered here are
+    appended to the cached copy. Another container may answer a turn of
+    the same connection, cache_seconds bounds how long it can be missed.
+    """
+
+    def __init__(self, table_name, window=6, summarize_after=8, cache_size=1024, cache_seconds=300,
+                 dynamodb=None):
+        self.table = LazyTable(table_name, dynamodb)
+        self.window = window
+        self.summarize_after = summarize_after
+        self.cache = LRUCache(cache_size, cache_seconds)
+
+    def load(self, session_id):
+        conversation = self.cache.get(session_id)
+        if conversation is not None:
+            return conversation
+        response = self.table.query(KeyConditionExpression="pk = :pk AND begins_with(sk, :prefix)",
+                                    ExpressionAttributeValues={":pk": session_id, ":prefix": MSG_ID_PREFIX},
+                                    ExpressionAttributeNames={"#b": "body"},
+                                    ProjectionExpression="sk, #b.user_msg, #b.ai_msg, #b.summary, "
+                                                         "#b.summarized_through",
+                                    ScanIndexForward=False,
+                                    #sentiment results share the partition, one per turn, and the summary
+                                    Limit=2 * (self.window + self.summarize_after) + 1)
+        summary, through, turns = "", "", []
+        for item in response["Items"]:
+            body = item.get("body", {})
+            if item["sk"] == SUMMARY_SK:
+                summary, through = body.get("summary", ""), body.get("summarized_through", "")
+            elif "user_msg" in body:
+                turns.append((item["sk"], body["user_msg"], body.get("ai_msg") or ""))
+        conversation = Conversation(summary, through, [turn for turn in reversed(turns) if turn[0] > through])
+        self.cache.put(session_id, conversation)
+        return conversation
+
+    def append(self, session_id, conversation, msg_id, user_msg, ai_msg):
+        '''Add the turn just answered to the cached conversation, log_to_db stores the turn itself'''
+        conversation.add(msg_id, user_msg, ai_msg)
+        self.cache.put(session_id, conversation)
+
+    def needs_summary(self, conversation):
+        return len(conversation.turns) >= self.window + self.summarize_after
+
+    def summarize(self, session_id, conversation, summarize_fn):
+        """
+        Fold every turn but the last `window` into the summary with
+        summarize_fn(previous summary, turns) and store it. Meant to run
+        after the answer is sent, it is a model call.
+        """
+        older = conversation.turns[:-self.window]
+        if not older:
+            return conversation.summary
+        summary = summarize_fn(conversation.summary, older)
+        through = older[-1][0]
+        self.table.put_item(Item={"pk": session_id, "sk": SUMMARY_SK,
+                                  "body": {"summary": summary, "summarized_through": through}})
+        conversation.summarized(summary, through)
+        return summary
+
+
+def summary_prompt(summary, turns, max_words=120):
+    return (f"Update the summary in <summary> with the conversation in <turns>. Keep what the user told us, "
+            f"the products and orders discussed and open questions, in at most {max_words} words. "
+            f"Reply with the summary only. <summary>{summary}</summary> <turns>{format_turns(turns)}</turns>")
+
+
+def rewrite_prompt(message, conversation):
+    return (f"Rewrite the question in <question> as a standalone search query, using the conversation in "
+            f"<history> to resolve what it refers to. Reply with the query only. "
+            f"<history>{conversation.history(300, window=3)}</history> <question>{message}</question>")
+
+
+def is_follow_up(message, max_words=3):
+    return bool(FOLLOW_UP.search(message)) or len(message.split()) <= max_words
+
+
+def rewrite_query(message, conversation, mode="concat", rewrite_fn=None):
+    """
+    Question to retrieve with. Messages that read as follow-ups get the
+    previous question prepended ("concat", no model call) or are rewritten
+    by rewrite_fn(prompt) ("llm"). Other messages, and the first of a
+    conversation, are used as they are.
+    """
+    if mode == "none" or conversation is None or not conversation.turns or not is_follow_up(message):
+        return message
+    if mode == "llm" and rewrite_fn is not None:
+        return rewrite_fn(rewrite_prompt(message, conversation)).strip() or message
+    return f"{conversation.turns[-1][1]} {message}"
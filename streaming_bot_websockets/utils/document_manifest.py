@@ -0,0 +1,99 @@
+import hashlib
+from collections import defaultdict
+
+from utils.embedding_cache import chunk_hash
+from utils.chatbot_utils import get_resource
+
+'''A manifest part holds this many 16 byte chunk ids, well under the 400KB DynamoDB item limit'''
+IDS_PER_MANIFEST_PART = 20000
+
+
+def document_source(bucket_name, key):
+    return f"s3://{bucket_name}/{key}"
+
+
+def chunk_id(source, text, occurrence=0):
+    """
+    Deterministic id for a chunk: same document, same content, same
+    occurrence of that content within the document gives the same id, so an
+    unchanged chunk keeps its id even when edits elsewhere shift its offset.
+    """
+    seed = f"{source}#{chunk_hash(text)}#{occurrence}"
+    return hashlib.sha256(seed.encode("utf-8")).hexdigest()[:32]
+
+
+def assign_chunk_ids(chunks, source):
+    """
+    Tag each chunk document with its source and deterministic chunk id.
+    """
+    occurrences = defaultdict(int)
+    for chunk in chunks:
+        content_hash = chunk_hash(chunk["doc_text"])
+        occurrence = occurrences[content_hash]
+        occurrences[content_hash] += 1
+        yield dict(chunk, doc_source=source, chunk_id=chunk_id(source, chunk["doc_text"], occurrence))
+
+
+class InMemoryManifestStore:
+    '''Local backend for tests'''
+
+    def __init__(self):
+        self.manifests = {}
+
+    def get(self, source):
+        return set(self.manifests.get(source, ()))
+
+    def put(self, source, chunk_ids):
+        self.manifests[source] = list(chunk_ids)
+
+    def delete(self, source):
+        self.manifests.pop(source, None)
+
+
+class DynamoDbManifestStore:
+    """
+    Chunk ids of each ingested document, in the events table under
+    pk=manifest#<source>, packed as binary ids and split over numbered parts.
+    """
+
+    def __init__(self, table_name, dynamodb=None):
+        if dynamodb is None:
+            dynamodb = get_resource('dynamodb')
+        self.table = dynamodb.Table(table_name)
+
+    def _parts(self, source):
+        parts = []
+        query = {"KeyConditionExpression": "pk = :pk",
+                 "ExpressionAttributeValues": {":pk": f"manifest#{source}"},
+                 "ProjectionExpression": "pk, sk, chunk_ids"}
+        while True:
+            response = self.table.query(**query)
+            parts.extend(response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return parts
+            query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def get(self, source):
+        chunk_ids = set()
+        for item in self._parts(source):
+            packed = bytes(item["chunk_ids"])
+            chunk_ids.update(packed[i:i + 16].hex() for i in range(0, len(packed), 16))
+        return chunk_ids
+
+    def put(self, source, chunk_ids):
+        chunk_ids = list(chunk_ids)
+        parts = [chunk_ids[i:i + IDS_PER_MANIFEST_PART]
+                 for i in range(0, len(chunk_ids), IDS_PER_MANIFEST_PART)]
+        stale = [item["sk"] for item in self._parts(source)][len(parts):]
+        with self.table.batch_writer(overwrite_by_pkeys=["pk", "sk"]) as batch:
+            for n, part in enumerate(parts):
+                batch.put_item(Item={"pk": f"manifest#{source}", "sk": f"part#{n:04d}",
+                                     "chunk_count": len(part),
+                                     "chunk_ids": b"".join(bytes.fromhex(c) for c in part)})
+            for sk in stale:
+                batch.delete_item(Key={"pk": f"manifest#{source}", "sk": sk})
+
+    def delete(self, source):
+        with self.table.batch_writer() as batch:
+            for item in self._parts(source):
+                batch.delete_item(Key={"pk": item["pk"], "sk": item["sk"]})
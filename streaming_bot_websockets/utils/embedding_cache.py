@@ -0,0 +1,126 @@
+import hashlib
+import re
+import threading
+from array import array
+
+from utils.chatbot_utils import get_resource
+
+
+def chunk_hash(text):
+    """
+    Hash of the chunk with whitespace runs collapsed, so re-extracted text that
+    only differs in spacing or line breaks maps to the same entry.
+    """
+    normalized = re.sub(r"\s+", " ", text).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class InMemoryEmbeddingStore:
+    '''Local backend, for tests and for a per-container cache'''
+
+    def __init__(self):
+        self.items = {}
+
+    def get_many(self, keys):
+        return {key: self.items[key] for key in keys if key in self.items}
+
+    def put_many(self, entries):
+        self.items.update(entries)
+
+
+class DynamoDbEmbeddingStore:
+    '''Embeddings stored as packed float32 in the events table, pk=embedding#<key>'''
+
+    def __init__(self, table_name, dynamodb=None):
+        self._dynamodb = dynamodb
+        self.table_name = table_name
+
+    @property
+    def dynamodb(self):
+        '''Resource created on first use, the handler may build this store at import'''
+        if self._dynamodb is None:
+            self._dynamodb = get_resource('dynamodb')
+        return self._dynamodb
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        for i in range(0, len(keys), 100):
+            request = {self.table_name: {
+                "Keys": [{"pk": f"embedding#{key}", "sk": "embedding"} for key in keys[i:i + 100]],
+                "ProjectionExpression": "pk, vector"}}
+            while request:
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.table_name, []):
+                    found[item["pk"][len("embedding#"):]] = array("f", bytes(item["vector"])).tolist()
+                request = response.get("UnprocessedKeys")
+        return found
+
+    def put_many(self, entries):
+        table = self.dynamodb.Table(self.table_name)
+        with table.batch_writer(overwrite_by_pkeys=["pk", "sk"]) as batch:
+            for key, vector in entries.items():
+                batch.put_item(Item={"pk": f"embedding#{key}", "sk": "embedding",
+                                     "vector": array("f", vector).tobytes()})
+
+
+class EmbeddingCache:
+    """
+    Embeddings keyed by (model id, normalized chunk hash). Lookups are batched,
+    new embeddings are buffered and written with flush().
+    """
+
+    def __init__(self, store, model_id, flush_size=25):
+        self.store = store
+        self.model_id = model_id
+        self.flush_size = flush_size
+        self.hits = 0
+        self.misses = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def key(self, text):
+        return f"{self.model_id}#{chunk_hash(text)}"
+
+    def get_many(self, texts):
+        """
+        Cached vector for each text, None where there is no entry.
+        """
+        keys = [self.key(text) for text in texts]
+        found = self.store.get_many(keys)
+        vectors = [found.get(key) for key in keys]
+        hits = sum(1 for vector in vectors if vector is not None)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(vectors) - hits
+        return vectors
+
+    def put(self, text, vector):
+        with self._lock:
+            self._pending[self.key(text)] = vector
+            ready = len(self._pending) >= self.flush_size
+        if ready:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            entries, self._pending = self._pending, {}
+        if entries:
+            self.store.put_many(entries)
+
+    def embed(self, text, embed_fn):
+        vector = self.get_many([text])[0]
+        if vector is None:
+            vector = embed_fn(text)
+            self.put(text, vector)
+            self.flush()
+        return vector
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "cache_hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "embedding_calls_saved": self.hits,
+        }
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+'''Model used when none is given, the stack sets EMBEDDING_MODEL_ID'''
+DEFAULT_EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v1"
+
+'''Concurrent embedding requests per container, shared by every embed_batch call'''
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", "8"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class EmbeddingProvider:
+    """
+    Turns texts into vectors for one model. embed(texts) takes at most
+    max_batch texts per call and returns one vector per text, embed_batch
+    does the grouping. The bedrock-runtime client is created on first use
+    when none is given.
+    """
+    max_batch = 1
+    default_dimension = None
+
+    def __init__(self, model_id, dimensions=None, client=None):
+        self.model_id = model_id
+        self.dimensions = dimensions
+        self.dimension = dimensions or self.default_dimension
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from utils.chatbot_utils import get_client
+            self._client = get_client('bedrock-runtime')
+        return self._client
+
+    def invoke(self, request):
+        response = self.client.invoke_model(body=json.dumps(request), modelId=self.model_id,
+                                            accept='application/json', contentType='application/json')
+        return json.loads(response.get('body').read())
+
+    def embed(self, texts, input_type="search_document"):
+        raise NotImplementedError
+
+
+class TitanProvider(EmbeddingProvider):
+    '''Titan text embeddings, one text per request. v2 returns `dimensions` values (256, 512 or 1024), normalized'''
+
+    def __init__(self, model_id, dimensions=None, client=None):
+        super().__init__(model_id, dimensions, client)
+        self.dimension = dimensions or (1024 if model_id.startswith("amazon.titan-embed-text-v2") else 1536)
+
+    def embed(self, texts, input_type="search_document"):
+        vectors = []
+        for text in texts:
+            request = {"inputText": text}
+            if self.dimensions:
+                request.update({"dimensions": self.dimensions, "normalize": True})
+            vectors.append(self.invoke(request)["embedding"])
+        return vectors
+
+
+class CohereProvider(EmbeddingProvider):
+    """
+    Cohere embed v3, up to 96 texts per request. Queries and documents are
+    embedded differently, input_type is search_query or search_document.
+    """
+    max_batch = 96
+    default_dimension = 1024
+
+    def embed(self, texts, input_type="search_document"):
+        return self.invoke({"texts": list(texts), "input_type": input_type, "truncate": "END"})["embeddings"]
+
+
+class LocalHashProvider(EmbeddingProvider):
+    """
+    Deterministic CPU embedder for tests and offline runs, no model behind
+    it: words and word pairs are hashed into `dimension` signed buckets and
+    the vector is normalized, so texts sharing words score as similar.
+    """
+    max_batch = 256
+    default_dimension = 256
+
+    def embed(self, texts, input_type="search_document"):
+        import numpy as np
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = re.findall(r"\w+", text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                matrix[row, digest % self.dimension] += 1.0 if digest >> 63 else -1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (matrix / norms).tolist()
+
+
+'''Provider by model id prefix'''
+PROVIDERS = {"amazon.titan-embed": TitanProvider, "cohere.embed": CohereProvider, "local.hash": LocalHashProvider}
+
+
+def embedding_provider(model_id=None, dimensions=None, client=None):
+    '''Provider for a model id, EMBEDDING_MODEL_ID when none is given'''
+    model_id = model_id or os.environ.get("EMBEDDING_MODEL_ID", DEFAULT_EMBEDDING_MODEL_ID)
+    for prefix, provider in PROVIDERS.items():
+        if model_id.startswith(prefix):
+            return provider(model_id, dimensions=dimensions, client=client)
+    raise ValueError(f"No embedding provider for {model_id}")
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="embed")
+        return _executor
+
+
+def embed_batch(texts, provider=None, input_type="search_document", cache=None):
+    """
+    Embed texts, returns a contiguous float32 matrix with one row per text.
+    Texts are grouped into requests of the provider's max_batch and the
+    requests run concurrently on a pool shared by the container. Retries are
+    left to the provider's client (a ResilientBedrockClient). With an EmbeddingCache only texts
+    without a cached vector are sent, and their vectors are added to it.
+    """
+    import numpy as np
+    provider = provider or embedding_provider()
+    texts = list(texts)
+    vectors = cache.get_many(texts) if cache is not None else [None] * len(texts)
+    missing = [n for n, vector in enumerate(vectors) if vector is None]
+    batches = [missing[i:i + provider.max_batch] for i in range(0, len(missing), provider.max_batch)]
+
+    def embed(batch):
+        return provider.embed([texts[n] for n in batch], input_type=input_type)
+
+    #a single request runs on the caller's thread
+    embedded = [embed(batches[0])] if len(batches) == 1 else list(_get_executor().map(embed, batches))
+    for batch, batch_vectors in zip(batches, embedded):
+        for n, vector in zip(batch, batch_vectors):
+            vectors[n] = vector
+    if not vectors:
+        return np.empty((0, provider.dimension or 0), dtype=np.float32)
+    matrix = np.array(vectors, dtype=np.float32)
+    if cache is not None and missing:
+        for n in missing:
+            cache.put(texts[n], matrix[n].tolist())
+        cache.flush()
+    return matrix
@@ -0,0 +1,128 @@
+import math
+import os
+
+'''
+Index profiles trade recall for storage and search latency. Changing the
+profile of an existing index needs a new index (or a reindex), the mapping
+and the embedding model both change.
+'''
+INDEX_PROFILES = {
+    #What the index was created with originally
+    "default": {"embedding_model_id": "amazon.titan-embed-text-v1", "dimension": 1536,
+                "engine": "nmslib", "space_type": "cosinesimil", "encoder": None,
+                "m": 16, "ef_construction": 512, "ef_search": 512},
+    "faiss-fp16": {"embedding_model_id": "amazon.titan-embed-text-v1", "dimension": 1536,
+                   "engine": "faiss", "space_type": "innerproduct", "encoder": "fp16",
+                   "m": 16, "ef_construction": 256, "ef_search": 128},
+    "titan-v2-512-fp16": {"embedding_model_id": "amazon.titan-embed-text-v2:0", "dimension": 512,
+                          "engine": "faiss", "space_type": "innerproduct", "encoder": "fp16",
+                          "m": 16, "ef_construction": 256, "ef_search": 100},
+    "titan-v2-256-byte": {"embedding_model_id": "amazon.titan-embed-text-v2:0", "dimension": 256,
+                          "engine": "faiss", "space_type": "innerproduct", "encoder": "byte",
+                          "m": 16, "ef_construction": 256, "ef_search": 100},
+    "cohere-1024-fp16": {"embedding_model_id": "cohere.embed-english-v3", "dimension": 1024,
+                         "engine": "faiss", "space_type": "innerproduct", "encoder": "fp16",
+                         "m": 16, "ef_construction": 256, "ef_search": 100},
+}
+
+BYTES_PER_VALUE = {None: 4, "fp16": 2, "byte": 1}
+
+
+def get_index_profile(name=None):
+    """
+    Profile named by INDEX_PROFILE, KNN_EF_SEARCH overrides its ef_search and
+    EMBEDDING_MODEL_ID its model, which must produce the profile's dimension.
+    """
+    name = name or os.environ.get("INDEX_PROFILE", "default")
+    profile = dict(INDEX_PROFILES[name], name=name)
+    if os.environ.get("KNN_EF_SEARCH"):
+        profile["ef_search"] = int(os.environ["KNN_EF_SEARCH"])
+    if os.environ.get("EMBEDDING_MODEL_ID"):
+        profile["embedding_model_id"] = os.environ["EMBEDDING_MODEL_ID"]
+    return profile
+
+
+def embedding_dimensions(profile):
+    '''Dimensions to request from the model, None for models with a fixed size'''
+    return profile["dimension"] if profile["embedding_model_id"].startswith("amazon.titan-embed-text-v2") else None
+
+
+def embedding_cache_key(profile, input_type="search_document"):
+    '''Model id the embedding cache is keyed by, vectors differ per requested size and, for Cohere, per input type'''
+    dimensions = embedding_dimensions(profile)
+    key = profile["embedding_model_id"] + (f"#{dimensions}" if dimensions else "")
+    if profile["embedding_model_id"].startswith("cohere.") and input_type != "search_document":
+        key += f"#{input_type}"
+    return key
+
+
+def index_body(profile, number_of_shards=2):
+    """
+    create_index_for_documents body for a profile. faiss profiles index unit
+    vectors with innerproduct, which ranks like cosine; "byte" stores int8
+    vectors (see prepare_vector), "fp16" lets faiss scalar-quantize floats.
+    """
+    method = {
+        "engine": profile["engine"],
+        "space_type": profile["space_type"],
+        "name": "hnsw",
+        "parameters": {"ef_construction": profile["ef_construction"], "m": profile["m"]},
+    }
+    if profile["encoder"] == "fp16":
+        method["parameters"]["encoder"] = {"name": "sq", "parameters": {"type": "fp16"}}
+    doc_vector = {"type": "knn_vector", "dimension": profile["dimension"], "method": method}
+    if profile["encoder"] == "byte":
+        doc_vector["data_type"] = "byte"
+    return {
+        "mappings": {
+            "properties": {
+                "doc_text": {"type": "text"},
+                "doc_source": {"type": "keyword"},
+                "chunk_id": {"type": "keyword"},
+                "doc_page": {"type": "integer"},
+                "doc_vector": doc_vector,
+            }
+        },
+        "settings": {
+            "index": {
+                "number_of_shards": number_of_shards,
+                "knn.algo_param": {"ef_search": profile["ef_search"]},
+                "knn": True,
+            }
+        },
+    }
+
+
+def prepare_vector(vector, profile):
+    """
+    Vector as the profile's index expects it: unit length for innerproduct,
+    and for byte indexes scaled to integers in [-127, 127]. The scale is the
+    same for every vector so inner products stay comparable, components of
+    a unit vector beyond 4 / sqrt(dimension) are clipped.
+    """
+    if profile["space_type"] != "innerproduct":
+        return vector
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    if profile["encoder"] == "byte":
+        scale = 127 * math.sqrt(len(vector)) / 4 / norm
+        return [max(-127, min(127, round(v * scale))) for v in vector]
+    return [v / norm for v in vector]
+
+
+def prepare_vectors(matrix, profile):
+    '''prepare_vector over the rows of a NumPy matrix, float32 rows or int8 for byte indexes'''
+    import numpy as np
+    if profile["space_type"] != "innerproduct":
+        return matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    if profile["encoder"] == "byte":
+        scale = 127 * math.sqrt(matrix.shape[1]) / 4 / norms
+        return np.clip(np.rint(matrix * scale), -127, 127).astype(np.int8)
+    return (matrix / norms).astype(np.float32)
+
+
+def vector_storage_bytes(profile, vectors):
+    '''Rough size of the vectors plus HNSW graph links, for comparing profiles'''
+    per_vector = profile["dimension"] * BYTES_PER_VALUE[profile["encoder"]] + profile["m"] * 2 * 4
+    return per_vector * vectors
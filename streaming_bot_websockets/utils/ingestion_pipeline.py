@@ -0,0 +1,342 @@
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from utils.document_manifest import assign_chunk_ids
+from utils.vector_store import VectorStore
+
+def ordered_map(executor, fn, items, max_in_flight):
+    """
+    Like executor.map, but pulls from items lazily and keeps at most
+    max_in_flight calls outstanding, results are yielded in input order.
+    """
+    in_flight = deque()
+    for item in items:
+        in_flight.append((item, executor.submit(fn, item)))
+        if len(in_flight) >= max_in_flight:
+            done_item, future = in_flight.popleft()
+            yield done_item, future.result()
+    while in_flight:
+        done_item, future = in_flight.popleft()
+        yield done_item, future.result()
+
+
+def bulk_index(client, actions, thread_count=4, chunk_size=100, max_chunk_bytes=5 * 1024 * 1024):
+    """
+    Flush index actions through parallel_bulk in batches bounded by document
+    count and request size, returns (succeeded, failed items). client may
+    also be a VectorStore, which applies the actions itself.
+    """
+    if isinstance(client, VectorStore):
+        return client.bulk(actions, thread_count=thread_count, chunk_size=chunk_size,
+                           max_chunk_bytes=max_chunk_bytes)
+    from opensearchpy import helpers
+    succeeded = 0
+    failed = []
+    for ok, item in helpers.parallel_bulk(client, actions,
+                                          thread_count=thread_count,
+                                          chunk_size=chunk_size,
+                                          max_chunk_bytes=max_chunk_bytes,
+                                          raise_on_error=False):
+        if ok:
+            succeeded += 1
+        else:
+            failed.append(item)
+    return succeeded, failed
+
+
+def action_ids(items):
+    '''Document ids of bulk response items, such as the failed items bulk_index returns'''
+    return {meta.get("_id") for item in items for meta in item.values()}
+
+
+def spool_s3_object(s3_client, bucket_name, key, max_memory=16 * 1024 * 1024):
+    """
+    Stream an S3 object into a spooled temp file, small objects stay in memory
+    and larger ones roll over to /tmp, the caller closes the returned file.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    body = s3_client.get_object(Bucket=bucket_name, Key=key)['Body']
+    for data in body.iter_chunks(chunk_size=1024 * 1024):
+        spooled.write(data)
+    spooled.seek(0)
+    return spooled
+
+
+def iter_pdf_pages(pdf_file, start=0, step=1, stop=None):
+    """
+    Yield (page_number, text) one page at a time, pages are parsed on demand
+    so text for the whole document is never held at once. start, step and
+    stop pick a slice of the pages, for splitting a document between workers.
+    """
+    from pypdf import PdfReader
+    reader = PdfReader(pdf_file)
+    stop = len(reader.pages) if stop is None else min(stop, len(reader.pages))
+    for page_number in range(start, stop, step):
+        page = reader.pages[page_number]
+        text = page.extract_text()
+        _release_page_contents(reader, page)
+        yield page_number, text
+
+
+def pdf_page_count(pdf_file):
+    from pypdf import PdfReader
+    count = len(PdfReader(pdf_file).pages)
+    pdf_file.seek(0)
+    return count
+
+
+def _parse_pages_worker(path, start, step, conn):
+    try:
+        # our own open file, so the workers do not share a read offset
+        with open(path, "rb") as pdf_file:
+            for page in iter_pdf_pages(pdf_file, start, step):
+                conn.send(page)
+        conn.send(None)
+    except Exception as ex:
+        conn.send(("error", repr(ex)))
+    finally:
+        conn.close()
+
+
+def iter_pdf_pages_parallel(pdf_file, workers=2, min_pages=50):
+    """
+    iter_pdf_pages spread over worker processes, worker i parses pages i,
+    i + workers, ... and the pages are read back round robin so they come
+    out in order. Uses Process and Pipe rather than a Pool or Queue, Lambda
+    has no /dev/shm for their semaphores. Pipes only buffer a few pages, so
+    memory stays bounded. Small documents are parsed in process.
+    Workers are spawned, not forked: this generator is consumed on the bulk
+    indexing thread while embedding threads are mid request, and a forked
+    child can deadlock on a lock one of those threads held.
+    """
+    if workers <= 1 or pdf_page_count(pdf_file) < min_pages:
+        yield from iter_pdf_pages(pdf_file)
+        return
+    if hasattr(pdf_file, "rollover"):
+        # a spooled file still in memory has no descriptor to share
+        pdf_file.rollover()
+    copy = None
+    try:
+        fd = pdf_file.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        # an in-memory file, the workers read a temporary copy
+        copy = tempfile.TemporaryFile()
+        pdf_file.seek(0)
+        shutil.copyfileobj(pdf_file, copy)
+        copy.flush()
+        fd = copy.fileno()
+    path = f"/proc/{os.getpid()}/fd/{fd}"
+    context = multiprocessing.get_context("spawn")
+    pipes, processes = [], []
+    for i in range(workers):
+        parent_conn, child_conn = context.Pipe(duplex=False)
+        process = context.Process(target=_parse_pages_worker, args=(path, i, workers, child_conn), daemon=True)
+        process.start()
+        child_conn.close()
+        pipes.append(parent_conn)
+        processes.append(process)
+    try:
+        active = list(range(workers))
+        while active:
+            for i in list(active):
+                page = pipes[i].recv()
+                if page is None:
+                    active.remove(i)
+                elif page[0] == "error":
+                    raise RuntimeError(f"Page parsing worker {i} failed: {page[1]}")
+                else:
+                    yield page
+    finally:
+        for conn in pipes:
+            conn.close()
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        if copy is not None:
+            copy.close()
+
+
+def _release_page_contents(reader, page):
+    """
+    pypdf caches every object it resolves, drop the page's content streams
+    once its text is extracted so memory doesn't grow with pages read.
+    """
+    from pypdf.generic import IndirectObject
+    if "/Contents" not in page:
+        return
+    contents = page.raw_get("/Contents")
+    refs = [contents] if isinstance(contents, IndirectObject) else []
+    resolved = contents.get_object()
+    if isinstance(resolved, list):
+        refs.extend(ref for ref in resolved if isinstance(ref, IndirectObject))
+    for ref in refs:
+        reader.resolved_objects.pop((ref.generation, ref.idnum), None)
+
+
+def iter_page_chunks(pages, split_fn):
+    """
+    Split each page as it arrives, yielding index documents without a vector.
+    """
+    for page_number, text in pages:
+        for chunk in split_fn(text):
+            yield {"doc_text": chunk, "doc_page": page_number}
+
+
+def index_action(index_name, chunk, vector):
+    action = {"_index": index_name, "_source": dict(chunk, doc_vector=vector)}
+    if "chunk_id" in chunk:
+        action["_id"] = chunk["chunk_id"]
+    return action
+
+
+def batched(items, size):
+    '''Lists of up to size items, pulled from items lazily'''
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def with_cached_vectors(chunks, embedding_cache, window=100):
+    """
+    Look chunks up in the embedding cache a window at a time, yielding
+    (chunk, cached vector or None).
+    """
+    for batch in batched(chunks, window):
+        yield from zip(batch, embedding_cache.get_many([c["doc_text"] for c in batch]))
+
+
+def embed_chunks(chunks, embed_fn, executor, embedding_cache=None, max_in_flight=32,
+                 embed_many_fn=None, embed_batch_size=16):
+    """
+    Yield (chunk, vector) for chunk documents, in order, embedding on
+    executor with at most max_in_flight chunks outstanding. With an
+    embedding_cache, unchanged chunks reuse their stored vector instead of
+    calling embed_fn, as do chunks that already carry a doc_vector. With
+    embed_many_fn(texts), returning one vector (or matrix row) per text,
+    chunks are embedded embed_batch_size at a time instead of with one
+    embed_fn call each. The caller flushes the cache.
+    """
+    if embedding_cache is not None:
+        pairs = with_cached_vectors(chunks, embedding_cache)
+    else:
+        pairs = ((chunk, None) for chunk in chunks)
+
+    def embed(pair):
+        chunk, vector = pair
+        if vector is None:
+            vector = chunk.get("doc_vector")
+        if vector is None:
+            vector = embed_fn(chunk["doc_text"])
+            if embedding_cache is not None:
+                embedding_cache.put(chunk["doc_text"], vector)
+        return vector
+
+    def embed_many(batch):
+        vectors = [vector if vector is not None else chunk.get("doc_vector") for chunk, vector in batch]
+        missing = [n for n, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = embed_many_fn([batch[n][0]["doc_text"] for n in missing])
+            for n, vector in zip(missing, embedded):
+                vectors[n] = vector.tolist() if hasattr(vector, "tolist") else vector
+                if embedding_cache is not None:
+                    embedding_cache.put(batch[n][0]["doc_text"], vectors[n])
+        return vectors
+
+    if embed_many_fn is None:
+        for (chunk, _), vector in ordered_map(executor, embed, pairs, max_in_flight):
+            yield chunk, vector
+        return
+    for batch, vectors in ordered_map(executor, embed_many, batched(pairs, embed_batch_size),
+                                      max(1, max_in_flight // embed_batch_size)):
+        for (chunk, _), vector in zip(batch, vectors):
+            yield chunk, vector
+
+
+def ingest_chunks(chunks, embed_fn, client, index_name, embedding_cache=None,
+                  embed_workers=8, max_in_flight=32,
+                  bulk_threads=4, bulk_chunk_size=100, bulk_max_bytes=5 * 1024 * 1024,
+                  embed_many_fn=None, embed_batch_size=16):
+    """
+    Embed and index chunk documents, dicts holding at least "doc_text", from
+    any iterable. Embedding (see embed_chunks) runs on a bounded worker pool
+    and its results stream straight into bulk requests, so indexing of early
+    chunks overlaps with parsing and embedding of later ones, and only
+    max_in_flight chunks plus the bulk queue are held in memory.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=embed_workers) as executor:
+        embedded = embed_chunks(chunks, embed_fn, executor, embedding_cache, max_in_flight,
+                                embed_many_fn, embed_batch_size)
+        actions = (index_action(index_name, chunk, vector) for chunk, vector in embedded)
+        succeeded, failed = bulk_index(client, actions,
+                                       thread_count=bulk_threads,
+                                       chunk_size=bulk_chunk_size,
+                                       max_chunk_bytes=bulk_max_bytes)
+    stats = {
+        "indexed": succeeded,
+        "failed": len(failed),
+        "failed_ids": action_ids(failed),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    if embedding_cache is not None:
+        embedding_cache.flush()
+        stats.update(embedding_cache.stats())
+    for item in failed[:5]:
+        print(f"Failed to index chunk: {item}")
+    return stats
+
+
+def delete_chunks(client, index_name, chunk_ids, **bulk_kwargs):
+    actions = ({"_op_type": "delete", "_index": index_name, "_id": chunk_id} for chunk_id in chunk_ids)
+    return bulk_index(client, actions, **bulk_kwargs)
+
+
+def ingest_document(chunks, source, manifest_store, embed_fn, client, index_name, **ingest_kwargs):
+    """
+    Incrementally (re)ingest a document. Chunks get deterministic ids, only
+    ids missing from the document's previous manifest are embedded and
+    indexed, ids that disappeared are deleted, then the manifest is replaced.
+    """
+    previous_ids = manifest_store.get(source)
+    live_ids = []
+
+    def changed_chunks():
+        for chunk in assign_chunk_ids(chunks, source):
+            live_ids.append(chunk["chunk_id"])
+            if chunk["chunk_id"] not in previous_ids:
+                yield chunk
+
+    stats = ingest_chunks(changed_chunks(), embed_fn, client, index_name, **ingest_kwargs)
+    failed_ids = stats.pop("failed_ids")
+    removed_ids = previous_ids.difference(live_ids)
+    deleted, delete_failures = delete_chunks(client, index_name, removed_ids)
+    # the manifest lists every id now in the index: chunks that failed to index are left
+    # out so the next run retries them, chunks that failed to delete (other than not found) stay in
+    undeleted_ids = action_ids(item for item in delete_failures if item["delete"].get("status") != 404)
+    manifest_store.put(source, [chunk_id for chunk_id in live_ids if chunk_id not in failed_ids] +
+                       sorted(undeleted_ids))
+    stats.update({"chunks": len(live_ids),
+                  "unchanged": len(live_ids) - stats["indexed"] - stats["failed"],
+                  "deleted": deleted})
+    return stats
+
+
+def remove_document(source, manifest_store, client, index_name):
+    """
+    Delete every chunk of a removed document along with its manifest.
+    """
+    chunk_ids = manifest_store.get(source)
+    deleted, failed = delete_chunks(client, index_name, chunk_ids)
+    manifest_store.delete(source)
+    return {"deleted": deleted, "failed": len(failed)}
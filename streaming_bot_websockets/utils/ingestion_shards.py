@@ -0,0 +1,193 @@
+import json
+import random
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.chatbot_utils import get_client, get_resource
+from utils.ingestion_pipeline import embed_chunks, ingest_document, iter_page_chunks, iter_pdf_pages
+
+SHARD_EVENT_SOURCE = "com.onebyzero.chatter.ingest_shard"
+
+'''Staged chunks per item, 40 Titan v1 vectors are ~250KB, under the 400KB item limit'''
+CHUNKS_PER_PART = 40
+
+'''Staging items expire after a day, so abandoned runs clean themselves up'''
+STAGING_TTL_SECONDS = 24 * 3600
+
+
+def plan_shards(page_count, pages_per_shard):
+    '''Page ranges [start, end) covering the document'''
+    return [(start, min(start + pages_per_shard, page_count))
+            for start in range(0, page_count, pages_per_shard)]
+
+
+class ShardStore:
+    """
+    Progress of a sharded ingestion run in the events table, under
+    pk=ingest#<source>: the run item, each shard's embedded chunks (staged
+    in parts until the run is finalized) and a done marker per shard.
+    """
+
+    def __init__(self, table_name, dynamodb=None):
+        if dynamodb is None:
+            dynamodb = get_resource('dynamodb')
+        self.table = dynamodb.Table(table_name)
+
+    def _query(self, source, prefix):
+        query = {"KeyConditionExpression": "pk = :pk AND begins_with(sk, :prefix)",
+                 "ExpressionAttributeValues": {":pk": f"ingest#{source}", ":prefix": prefix},
+                 "ConsistentRead": True}
+        while True:
+            response = self.table.query(**query)
+            yield from response["Items"]
+            if "LastEvaluatedKey" not in response:
+                return
+            query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def start_run(self, source, run_id, shard_count):
+        self.table.put_item(Item={"pk": f"ingest#{source}", "sk": f"run#{run_id}",
+                                  "shards": shard_count, "started_at": int(time.time()),
+                                  "ttl": int(time.time()) + STAGING_TTL_SECONDS})
+
+    def stage(self, source, run_id, shard, part, chunks):
+        """
+        Store (chunk, vector) pairs of a shard, vectors packed as float32.
+        """
+        self.table.put_item(Item={"pk": f"ingest#{source}", "sk": f"run#{run_id}#part#{shard:05d}#{part:05d}",
+                                  "chunks": json.dumps([chunk for chunk, _ in chunks]),
+                                  "vectors": array("f", [v for _, vector in chunks for v in vector]).tobytes(),
+                                  "ttl": int(time.time()) + STAGING_TTL_SECONDS})
+
+    def complete_shard(self, source, run_id, shard):
+        """
+        Mark a shard done, returns (shards done, shards in the run). Marking
+        is idempotent, a retried shard is not counted twice.
+        """
+        self.table.put_item(Item={"pk": f"ingest#{source}", "sk": f"run#{run_id}#done#{shard:05d}",
+                                  "ttl": int(time.time()) + STAGING_TTL_SECONDS})
+        run = self.table.get_item(Key={"pk": f"ingest#{source}", "sk": f"run#{run_id}"},
+                                  ConsistentRead=True)["Item"]
+        done = sum(1 for _ in self._query(source, f"run#{run_id}#done#"))
+        return done, int(run["shards"])
+
+    def claim_finalize(self, source, run_id, worker_id):
+        """
+        Only one worker gets to finalize a run. The claim is not released, the
+        worker holding it may claim again, so a retry of its invocation (same
+        request id) after a failed finalize still indexes the document.
+        """
+        try:
+            self.table.update_item(Key={"pk": f"ingest#{source}", "sk": f"run#{run_id}"},
+                                   UpdateExpression="SET finalized_by = :worker",
+                                   ConditionExpression="attribute_not_exists(finalized_by) OR finalized_by = :worker",
+                                   ExpressionAttributeValues={":worker": worker_id})
+            return True
+        except Exception as ex:
+            if getattr(ex, "response", {}).get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                return False
+            raise
+
+    def staged_chunks(self, source, run_id):
+        '''Staged chunks in document order, each with its doc_vector'''
+        for item in self._query(source, f"run#{run_id}#part#"):
+            chunks = json.loads(item["chunks"])
+            vectors = array("f", bytes(item["vectors"]))
+            dimension = len(vectors) // len(chunks) if chunks else 0
+            for n, chunk in enumerate(chunks):
+                yield dict(chunk, doc_vector=vectors[n * dimension:(n + 1) * dimension].tolist())
+
+    def clear(self, source, run_id):
+        with self.table.batch_writer() as batch:
+            for item in list(self._query(source, f"run#{run_id}#")):
+                batch.delete_item(Key={"pk": item["pk"], "sk": item["sk"]})
+            batch.delete_item(Key={"pk": f"ingest#{source}", "sk": f"run#{run_id}"})
+
+
+def put_events(events, entries, max_retries=3, base_delay=0.25):
+    """
+    Put entries on the bus 10 at a time. put_events reports rejected entries
+    in the response instead of raising, those are sent again with backoff
+    and an error is raised if some are still rejected after max_retries.
+    """
+    for i in range(0, len(entries), 10):
+        pending = entries[i:i + 10]
+        for attempt in range(max_retries + 1):
+            response = events.put_events(Entries=pending)
+            if not response.get("FailedEntryCount"):
+                break
+            failed = [(entry, result) for entry, result in zip(pending, response["Entries"]) if "ErrorCode" in result]
+            print(f"{len(failed)} of {len(pending)} events rejected: {failed[0][1]['ErrorCode']}")
+            pending = [entry for entry, _ in failed]
+            if attempt < max_retries:
+                time.sleep(random.uniform(0, base_delay * (2 ** attempt)))
+        else:
+            raise RuntimeError(f"{len(pending)} events not accepted by the bus after {max_retries} retries")
+
+
+def eventbridge_dispatcher(event_bus_name):
+    '''Dispatch shard messages as events on the bus, a rule routes them back to the ingestion function'''
+    def dispatch(messages):
+        #a lost shard event would leave the run unfinished without an error, put_events raises instead
+        put_events(get_client('events'),
+                   [{"Source": SHARD_EVENT_SOURCE, "DetailType": SHARD_EVENT_SOURCE,
+                     "Detail": json.dumps(message), "EventBusName": event_bus_name} for message in messages])
+    return dispatch
+
+
+def coordinate(bucket_name, key, source, page_count, run_id, shard_store, dispatch, pages_per_shard=50):
+    """
+    Split a document into page range shards and dispatch one message per
+    shard, returns the number of shards.
+    """
+    shards = plan_shards(page_count, pages_per_shard)
+    shard_store.start_run(source, run_id, len(shards))
+    dispatch([{"bucket": bucket_name, "key": key, "source": source, "run_id": run_id,
+               "shard": n, "shards": len(shards), "start_page": start, "end_page": end}
+              for n, (start, end) in enumerate(shards)])
+    return len(shards)
+
+
+def process_shard(message, pdf_file, split_fn, embed_fn, shard_store, embedding_cache=None,
+                  embed_workers=8, max_in_flight=32, pages_fn=None, embed_many_fn=None, embed_batch_size=16):
+    """
+    Parse, split and embed one shard's pages and stage the result, nothing
+    is written to the index here. Returns (shards done, shards in the run).
+    pages_fn(pages) can post-process the (page_number, text) stream.
+    Embedding goes through embed_chunks like a single invocation's ingest,
+    with the same cache lookups and embed_many_fn batching.
+    """
+    pages = iter_pdf_pages(pdf_file, message["start_page"], 1, message["end_page"])
+    if pages_fn is not None:
+        pages = pages_fn(pages)
+
+    part, batch = 0, []
+    with ThreadPoolExecutor(max_workers=embed_workers) as executor:
+        for chunk, vector in embed_chunks(iter_page_chunks(pages, split_fn), embed_fn, executor, embedding_cache,
+                                          max_in_flight, embed_many_fn, embed_batch_size):
+            batch.append((chunk, vector))
+            if len(batch) >= CHUNKS_PER_PART:
+                shard_store.stage(message["source"], message["run_id"], message["shard"], part, batch)
+                part, batch = part + 1, []
+    if batch:
+        shard_store.stage(message["source"], message["run_id"], message["shard"], part, batch)
+    if embedding_cache is not None:
+        embedding_cache.flush()
+    return shard_store.complete_shard(message["source"], message["run_id"], message["shard"])
+
+
+def finalize(source, run_id, shard_store, manifest_store, store, index_name, **ingest_kwargs):
+    """
+    Index a run once every shard is staged: chunk ids are assigned over the
+    whole document in order, exactly as a single invocation would, only new
+    ids are indexed (with their staged vectors, no embedding calls) and ids
+    no longer in the document are deleted. Until this step the index still
+    serves the previous version of the document in full.
+    """
+    def no_embedding(text):
+        raise RuntimeError("Staged chunk without a vector")
+
+    stats = ingest_document(shard_store.staged_chunks(source, run_id), source, manifest_store,
+                            no_embedding, store, index_name, **ingest_kwargs)
+    shard_store.clear(source, run_id)
+    return stats
@@ -0,0 +1,265 @@
+import io
+import os
+import re
+
+'''
+Loaders turn a document file into a stream of (page_number, text) pairs for
+iter_page_chunks. Formats without pages yield sections, split at headings
+and capped at SECTION_MAX_CHARS so a long section is never held whole.
+Parsers are imported inside each loader, importing this module is cheap.
+'''
+SECTION_MAX_CHARS = 20000
+
+
+def group_sections(blocks, max_chars=SECTION_MAX_CHARS):
+    """
+    Group (is_heading, text) blocks into (section_number, text) sections.
+    A heading starts a new section and is repeated as the first line of
+    sections continuing it, so chunks keep their heading.
+    """
+    number, heading, paragraphs, size = 0, None, [], 0
+    for is_heading, text in blocks:
+        text = text.strip()
+        if not text:
+            continue
+        if is_heading:
+            if len(paragraphs) > (1 if heading else 0):
+                yield number, "\n\n".join(paragraphs)
+                number += 1
+            heading, paragraphs, size = text, [text], len(text)
+            continue
+        if size + len(text) > max_chars and len(paragraphs) > (1 if heading else 0):
+            yield number, "\n\n".join(paragraphs)
+            number += 1
+            paragraphs, size = ([heading], len(heading)) if heading else ([], 0)
+        paragraphs.append(text)
+        size += len(text) + 2
+    if len(paragraphs) > (1 if heading else 0):
+        yield number, "\n\n".join(paragraphs)
+
+
+def text_lines(file):
+    '''Decoded lines of a binary file, without closing it afterwards'''
+    stream = io.TextIOWrapper(file, encoding="utf-8-sig", errors="replace")
+    try:
+        yield from stream
+    finally:
+        stream.detach()
+
+
+def load_pdf(file, workers=1, **options):
+    '''PDF pages, parsed by up to `workers` processes, running headers and footers removed'''
+    from utils.chunker import strip_boilerplate
+    from utils.ingestion_pipeline import iter_pdf_pages_parallel
+    return strip_boilerplate(iter_pdf_pages_parallel(file, workers=workers))
+
+
+def load_text(file, **options):
+    '''Plain text, paragraphs are separated by blank lines'''
+    def paragraphs():
+        lines = []
+        for line in text_lines(file):
+            if line.strip():
+                lines.append(line.rstrip())
+            elif lines:
+                yield False, "\n".join(lines)
+                lines = []
+        if lines:
+            yield False, "\n".join(lines)
+    return group_sections(paragraphs())
+
+
+MARKDOWN_HEADING = re.compile(r"^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+MARKDOWN_INLINE = [
+    (re.compile(r"!\[([^\]]*)\]\([^)]*\)"), r"\1"),
+    (re.compile(r"\[([^\]]*)\]\([^)]*\)"), r"\1"),
+    (re.compile(r"<[^>]+>"), ""),
+    (re.compile(r"(\*\*|__|\*|`)"), ""),
+    (re.compile(r"^\s*(>\s*)+"), ""),
+    (re.compile(r"^\s*([-*+]|\d+[.)])\s+"), ""),
+]
+
+
+def markdown_text(line):
+    for pattern, replacement in MARKDOWN_INLINE:
+        line = pattern.sub(replacement, line)
+    return line.strip()
+
+
+def load_markdown(file, **options):
+    '''Markdown split at ATX headings, links and emphasis reduced to their text'''
+    def markdown_blocks():
+        lines, fenced, front_matter = [], False, False
+        for n, line in enumerate(text_lines(file)):
+            stripped = line.strip()
+            if n == 0 and stripped == "---":
+                front_matter = True
+                continue
+            if front_matter:
+                front_matter = stripped != "---"
+                continue
+            if stripped.startswith("```") or stripped.startswith("~~~"):
+                if lines:
+                    yield False, "\n".join(lines)
+                    lines = []
+                fenced = not fenced
+                continue
+            heading = None if fenced else MARKDOWN_HEADING.match(line)
+            if heading or not stripped or re.match(r"^\|?\s*:?-{3,}", stripped):
+                if lines:
+                    yield False, "\n".join(lines)
+                    lines = []
+                if heading:
+                    yield True, markdown_text(heading.group(2))
+                continue
+            text = stripped if fenced else markdown_text(stripped.strip("|").replace(" | ", ", "))
+            if text:
+                lines.append(text)
+        if lines:
+            yield False, "\n".join(lines)
+    return group_sections(markdown_blocks())
+
+
+HTML_SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg", "nav", "header", "footer", "aside", "form"}
+HTML_HEADING_TAGS = {"h1", "h2", "h3", "h4"}
+HTML_BLOCK_TAGS = {"p", "div", "li", "tr", "br", "section", "article", "table", "ul", "ol", "dd", "dt",
+                   "blockquote", "pre", "h5", "h6"}
+
+
+def load_html(file, chunk_size=64 * 1024, **options):
+    """
+    Visible text of an HTML page split at h1-h4 headings. Navigation, header,
+    footer, scripts and styles are dropped. The page is fed to the parser in
+    chunk_size pieces and sections are yielded as soon as they are complete.
+    """
+    from html.parser import HTMLParser
+
+    class SectionParser(HTMLParser):
+        def __init__(self):
+            super().__init__(convert_charrefs=True)
+            self.blocks, self.text, self.skipped, self.in_heading = [], [], 0, False
+
+        def end_block(self, is_heading=False):
+            text = re.sub(r"\s+", " ", "".join(self.text)).strip()
+            if text:
+                self.blocks.append((is_heading, text))
+            self.text = []
+
+        def handle_starttag(self, tag, attrs):
+            if tag in HTML_SKIPPED_TAGS:
+                self.skipped += 1
+            elif not self.skipped and (tag in HTML_HEADING_TAGS or tag in HTML_BLOCK_TAGS):
+                self.end_block(self.in_heading)
+                self.in_heading = tag in HTML_HEADING_TAGS
+
+        def handle_endtag(self, tag):
+            if tag in HTML_SKIPPED_TAGS:
+                self.skipped = max(0, self.skipped - 1)
+            elif not self.skipped and (tag in HTML_HEADING_TAGS or tag in HTML_BLOCK_TAGS):
+                self.end_block(self.in_heading)
+                self.in_heading = False
+
+        def handle_data(self, data):
+            if not self.skipped:
+                self.text.append(data)
+
+    def html_blocks():
+        parser = SectionParser()
+        decoder = io.TextIOWrapper(file, encoding="utf-8-sig", errors="replace")
+        try:
+            while True:
+                data = decoder.read(chunk_size)
+                if not data:
+                    break
+                parser.feed(data)
+                yield from parser.blocks
+                parser.blocks = []
+            parser.close()
+            parser.end_block(parser.in_heading)
+            yield from parser.blocks
+        finally:
+            decoder.detach()
+    return group_sections(html_blocks())
+
+
+DOCX_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def load_docx(file, **options):
+    """
+    Paragraphs of a Word document read from word/document.xml with a
+    streaming XML parser, split at paragraphs styled Title or Heading N.
+    """
+    import zipfile
+    from xml.etree.ElementTree import iterparse
+
+    def docx_blocks():
+        with zipfile.ZipFile(file) as archive, archive.open("word/document.xml") as xml:
+            for _, element in iterparse(xml):
+                if element.tag != f"{DOCX_NS}p":
+                    continue
+                parts = []
+                for node in element.iter():
+                    if node.tag == f"{DOCX_NS}t" and node.text:
+                        parts.append(node.text)
+                    elif node.tag == f"{DOCX_NS}tab":
+                        parts.append("\t")
+                    elif node.tag in (f"{DOCX_NS}br", f"{DOCX_NS}cr"):
+                        parts.append("\n")
+                style = element.find(f"{DOCX_NS}pPr/{DOCX_NS}pStyle")
+                style = (style.get(f"{DOCX_NS}val") or "").lower() if style is not None else ""
+                yield style == "title" or style.startswith("heading"), "".join(parts)
+                element.clear()
+    return group_sections(docx_blocks())
+
+
+def load_csv(file, **options):
+    """
+    One "column: value; ..." line per row, the first row holds the column
+    names. Rows are grouped into sections of up to SECTION_MAX_CHARS.
+    """
+    import csv
+
+    def rows():
+        reader = csv.reader(text_lines(file))
+        header = next(reader, None) or []
+        for row in reader:
+            fields = [f"{name.strip()}: {value.strip()}" if name.strip() else value.strip()
+                      for name, value in zip(header + [""] * (len(row) - len(header)), row) if value.strip()]
+            if fields:
+                yield False, "; ".join(fields) + "."
+    return group_sections(rows())
+
+
+LOADERS = {"pdf": load_pdf, "html": load_html, "markdown": load_markdown, "docx": load_docx,
+           "csv": load_csv, "text": load_text}
+
+EXTENSIONS = {".pdf": "pdf", ".html": "html", ".htm": "html", ".md": "markdown", ".markdown": "markdown",
+              ".docx": "docx", ".csv": "csv", ".txt": "text", ".text": "text"}
+
+CONTENT_TYPES = {"application/pdf": "pdf", "text/html": "html", "application/xhtml+xml": "html",
+                 "text/markdown": "markdown", "text/x-markdown": "markdown", "text/csv": "csv",
+                 "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+                 "text/plain": "text"}
+
+
+def register_loader(name, loader, extensions=(), content_types=()):
+    '''Add or replace the loader for a format'''
+    LOADERS[name] = loader
+    EXTENSIONS.update({extension.lower(): name for extension in extensions})
+    CONTENT_TYPES.update({content_type.lower(): name for content_type in content_types})
+
+
+def document_format(key, content_type=None):
+    '''Format of an object by its extension, then by its content type; None when no loader handles it'''
+    extension = os.path.splitext(key)[1].lower()
+    if extension in EXTENSIONS:
+        return EXTENSIONS[extension]
+    if content_type:
+        return CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+    return None
+
+
+def load_pages(file, format_name, **options):
+    '''(page_number, text) stream of a document, options a loader does not use are ignored'''
+    return LOADERS[format_name](file, **options)
@@ -0,0 +1,317 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from utils.chatbot_utils import reciprocal_rank_fusion
+from utils.vector_store import VectorStore
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def tokenize(text):
+    return re.findall(r"\w[\w-]*", text.lower())
+
+
+def top_k(scores, k):
+    '''Indexes of the k highest scores, best first'''
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+def spherical_kmeans(vectors, n_lists, iterations=10, seed=0):
+    """
+    k-means on unit vectors using dot product similarity, returns the
+    normalized centroids.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = np.bincount(assignment, minlength=n_lists) == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted file index: rows are bucketed by their nearest k-means centroid
+    and a query only scores the rows of its nprobe nearest buckets.
+    """
+
+    def __init__(self, centroids, assignment):
+        self.centroids = centroids
+        self.order = np.argsort(assignment, kind="stable").astype(np.int64)
+        counts = np.bincount(assignment, minlength=len(centroids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.rows = len(assignment)
+
+    @classmethod
+    def build(cls, vectors, n_lists, sample_size=50000, iterations=10, batch=65536):
+        rng = np.random.default_rng(0)
+        sample = vectors if len(vectors) <= sample_size else \
+            vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+        centroids = spherical_kmeans(np.asarray(sample), n_lists, iterations)
+        assignment = np.concatenate([np.argmax(vectors[i:i + batch] @ centroids.T, axis=1)
+                                     for i in range(0, len(vectors), batch)])
+        return cls(centroids, assignment)
+
+    def candidates(self, query, nprobe):
+        lists = top_k(self.centroids @ query, nprobe)
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in lists])
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector store: a float32 matrix of unit vectors scored with one
+    matrix-vector product per query, so cosine similarity is a dot product.
+    build_ivf() adds an approximate index for larger corpora, rows added
+    after it was built are scored brute force until it is rebuilt. Scores
+    follow OpenSearch cosinesimil, (1 + cosine) / 2. With a path the store
+    is saved by flush() and reopened with the vectors memory-mapped.
+    """
+
+    def __init__(self, dimension, path=None, capacity=1024, lexical=True):
+        self.dimension = dimension
+        self.path = path
+        self.lexical = lexical
+        self.nprobe = 8
+        self._vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self._live = np.zeros(capacity, dtype=bool)
+        self._count = 0
+        self._ids = []
+        self._rows = {}
+        self._sources = []
+        self._terms = defaultdict(set)
+        self._ivf = None
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _grow(self, needed):
+        capacity = max(needed, 2 * len(self._vectors), 1024)
+        vectors = np.zeros((capacity, self.dimension), dtype=np.float32)
+        vectors[:self._count] = self._vectors[:self._count]
+        live = np.zeros(capacity, dtype=bool)
+        live[:self._count] = self._live[:self._count]
+        self._vectors, self._live = vectors, live
+
+    def add_many(self, ids, vectors, sources):
+        """
+        Insert or replace documents, vectors is an (n, dimension) array-like.
+        """
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension))
+        with self._lock:
+            start = self._count
+            if start + len(ids) > len(self._vectors):
+                self._grow(start + len(ids))
+            self._vectors[start:start + len(ids)] = vectors
+            self._live[start:start + len(ids)] = True
+            for offset, (doc_id, source) in enumerate(zip(ids, sources)):
+                row = start + offset
+                self._delete(doc_id)
+                self._rows[doc_id] = row
+                self._ids.append(doc_id)
+                self._sources.append(source)
+                if self.lexical:
+                    for term in set(tokenize(source.get("doc_text", ""))):
+                        self._terms[term].add(row)
+            self._count += len(ids)
+            self._dirty = True
+
+    def add_document(self, document, doc_id=None):
+        with self._lock:
+            doc_id = doc_id or document.get("chunk_id") or str(self._count + 1)
+            source = {k: v for k, v in document.items() if k != "doc_vector"}
+            self.add_many([doc_id], [document["doc_vector"]], [source])
+        return {"_id": doc_id, "result": "created"}
+
+    def _delete(self, doc_id):
+        row = self._rows.pop(doc_id, None)
+        if row is None:
+            return False
+        self._live[row] = False
+        if self.lexical:
+            for term in set(tokenize(self._sources[row].get("doc_text", ""))):
+                self._terms[term].discard(row)
+        self._sources[row] = None
+        self._dirty = True
+        return True
+
+    def delete(self, doc_id):
+        with self._lock:
+            return self._delete(doc_id)
+
+    def bulk(self, actions, chunk_size=500, **bulk_kwargs):
+        """
+        Apply index and delete actions, inserts are batched chunk_size at a time.
+        """
+        succeeded, failed = 0, []
+        ids, vectors, sources = [], [], []
+
+        def flush_inserts():
+            if ids:
+                self.add_many(ids, vectors, sources)
+            return len(ids)
+
+        for action in actions:
+            if action.get("_op_type") == "delete":
+                succeeded += flush_inserts()
+                ids, vectors, sources = [], [], []
+                if self.delete(action["_id"]):
+                    succeeded += 1
+                else:
+                    failed.append({"delete": {"_id": action["_id"], "status": 404}})
+                continue
+            document = action["_source"]
+            ids.append(action.get("_id") or f"auto-{self._count + len(ids) + 1}")
+            vectors.append(document["doc_vector"])
+            sources.append({k: v for k, v in document.items() if k != "doc_vector"})
+            if len(ids) >= chunk_size:
+                succeeded += flush_inserts()
+                ids, vectors, sources = [], [], []
+        succeeded += flush_inserts()
+        return succeeded, failed
+
+    def build_ivf(self, n_lists=None, nprobe=None, **build_kwargs):
+        """
+        Build the approximate index over the current rows, n_lists defaults
+        to sqrt(rows).
+        """
+        with self._lock:
+            n_lists = n_lists or max(1, int(math.sqrt(self._count)))
+            self._ivf = IVFIndex.build(self._vectors[:self._count], min(n_lists, self._count), **build_kwargs)
+            if nprobe:
+                self.nprobe = nprobe
+            self._dirty = True
+
+    def _vector_ranking(self, query, k, exact=False):
+        with self._lock:
+            count, ivf = self._count, self._ivf
+            vectors, live = self._vectors, self._live
+        if ivf is None or exact:
+            rows = None
+            scores = vectors[:count] @ query
+        else:
+            # rows added since the index was built have no bucket yet
+            rows = np.concatenate([ivf.candidates(query, self.nprobe), np.arange(ivf.rows, count)])
+            scores = vectors[rows] @ query
+        alive = live[:count] if rows is None else live[rows]
+        scores = np.where(alive, scores, -np.inf)
+        best = top_k(scores, k)
+        best = best[np.isfinite(scores[best])]
+        found = best if rows is None else rows[best]
+        return [(int(row), float(score)) for row, score in zip(found, scores[best])]
+
+    def _lexical_ranking(self, text, k):
+        terms = set(tokenize(text))
+        with self._lock:
+            total = max(1, len(self._rows))
+            scores = defaultdict(float)
+            for term in terms:
+                rows = self._terms.get(term)
+                if not rows:
+                    continue
+                idf = math.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+                for row in rows:
+                    scores[row] += idf
+        return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)[:k]
+
+    def _hits(self, ranking, score_fn):
+        with self._lock:
+            return [{"_id": self._ids[row], "_score": score_fn(score), "_source": dict(self._sources[row])}
+                    for row, score in ranking if self._sources[row] is not None]
+
+    def search(self, vector, k, query_text=None, mode="knn", size=5, exact=False):
+        query = normalize_rows(np.asarray(vector, dtype=np.float32))
+        if mode != "hybrid" or not query_text or not self.lexical:
+            ranking = self._vector_ranking(query, min(k, size), exact)
+            return {"hits": {"hits": self._hits(ranking, lambda score: (1.0 + score) / 2)}}
+        candidates = max(size, k) * 2
+        rankings = [self._hits(self._vector_ranking(query, candidates, exact), lambda score: (1.0 + score) / 2),
+                    self._hits(self._lexical_ranking(query_text, candidates), float)]
+        return {"hits": {"hits": reciprocal_rank_fusion(rankings)[:size]}}
+
+    def flush(self):
+        if self.path and self._dirty:
+            self.save(self.path)
+
+    def save(self, path):
+        """
+        Write live rows to path: vectors.f32 (raw float32, memory-mappable),
+        documents.json and ivf.npz when an index was built.
+        """
+        with self._lock:
+            rows = np.flatnonzero(self._live[:self._count])
+            os.makedirs(path, exist_ok=True)
+            self._vectors[rows].tofile(os.path.join(path, "vectors.f32.tmp"))
+            with open(os.path.join(path, "documents.json.tmp"), "w") as f:
+                json.dump({"dimension": self.dimension, "nprobe": self.nprobe,
+                           "ids": [self._ids[row] for row in rows],
+                           "sources": [self._sources[row] for row in rows]}, f)
+            ivf_file = os.path.join(path, "ivf.npz")
+            if self._ivf is not None and self._ivf.rows == self._count:
+                assignment = np.empty(self._count, dtype=np.int64)
+                for c in range(len(self._ivf.centroids)):
+                    assignment[self._ivf.order[self._ivf.offsets[c]:self._ivf.offsets[c + 1]]] = c
+                np.savez(ivf_file + ".tmp.npz", centroids=self._ivf.centroids, assignment=assignment[rows])
+                os.replace(ivf_file + ".tmp.npz", ivf_file)
+            elif os.path.exists(ivf_file):
+                os.remove(ivf_file)
+            os.replace(os.path.join(path, "vectors.f32.tmp"), os.path.join(path, "vectors.f32"))
+            os.replace(os.path.join(path, "documents.json.tmp"), os.path.join(path, "documents.json"))
+            self._dirty = False
+
+    @classmethod
+    def open(cls, path, dimension, mmap=True, lexical=True):
+        """
+        Load a store saved at path, or an empty one if there is none. With
+        mmap the vectors are mapped copy-on-write rather than read in.
+        """
+        store = cls(dimension, path=path, lexical=lexical)
+        documents_file = os.path.join(path, "documents.json")
+        if not os.path.exists(documents_file):
+            return store
+        with open(documents_file) as f:
+            saved = json.load(f)
+        count = len(saved["ids"])
+        store.dimension = saved["dimension"]
+        store.nprobe = saved.get("nprobe", store.nprobe)
+        vectors_file = os.path.join(path, "vectors.f32")
+        if count == 0:
+            return store
+        if mmap:
+            store._vectors = np.memmap(vectors_file, dtype=np.float32, mode="c", shape=(count, store.dimension))
+        else:
+            store._vectors = np.fromfile(vectors_file, dtype=np.float32).reshape(count, store.dimension)
+        store._live = np.ones(count, dtype=bool)
+        store._count = count
+        store._ids = saved["ids"]
+        store._sources = saved["sources"]
+        store._rows = {doc_id: row for row, doc_id in enumerate(store._ids)}
+        if lexical:
+            for row, source in enumerate(store._sources):
+                for term in set(tokenize(source.get("doc_text", ""))):
+                    store._terms[term].add(row)
+        ivf_file = os.path.join(path, "ivf.npz")
+        if os.path.exists(ivf_file):
+            saved_ivf = np.load(ivf_file)
+            store._ivf = IVFIndex(saved_ivf["centroids"], saved_ivf["assignment"])
+        return store
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from utils.chatbot_utils import LazyTable
+
+
+def normalize_question(question):
+    return re.sub(r"\s+", " ", question).strip().lower().rstrip("?!. ")
+
+
+def vector_key(vector):
+    return hashlib.sha1(array("f", vector).tobytes()).hexdigest()
+
+
+class LRUCache:
+    '''In-process cache, module level instances survive warm Lambda invocations'''
+
+    def __init__(self, maxsize=512, ttl_seconds=None):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        expires = time.time() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class DynamoDbTTLStore:
+    """
+    Shared cache tier in the events table, pk=qcache#<key>, values are JSON and
+    expire through the table's ttl attribute. DynamoDB removes expired items
+    lazily, so expiry is checked on read as well.
+    """
+
+    def __init__(self, table_name, ttl_seconds=3600, dynamodb=None):
+        self.table = LazyTable(table_name, dynamodb)
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        item = self.table.get_item(Key={"pk": f"qcache#{key}", "sk": "qcache"}).get("Item")
+        if item is None or int(item["ttl"]) < time.time():
+            return None
+        return json.loads(item["value"])
+
+    def put(self, key, value):
+        self.table.put_item(Item={"pk": f"qcache#{key}", "sk": "qcache",
+                                  "value": json.dumps(value),
+                                  "ttl": int(time.time()) + self.ttl_seconds})
+
+
+class IndexGeneration:
+    """
+    Counter bumped by the ingestion handler whenever the index changes, cached
+    results are keyed by it. Re-read at most every refresh_seconds.
+    """
+
+    def __init__(self, table_name, index_name, refresh_seconds=30, dynamodb=None):
+        self.table = LazyTable(table_name, dynamodb)
+        self.index_name = index_name
+        self.refresh_seconds = refresh_seconds
+        self._value = None
+        self._read_at = 0.0
+
+    def current(self):
+        if self._value is None or time.time() - self._read_at > self.refresh_seconds:
+            item = self.table.get_item(Key={"pk": "index_generation", "sk": self.index_name}).get("Item")
+            self._value = int(item["generation"]) if item else 0
+            self._read_at = time.time()
+        return self._value
+
+    def bump(self):
+        response = self.table.update_item(Key={"pk": "index_generation", "sk": self.index_name},
+                                          UpdateExpression="ADD generation :one",
+                                          ExpressionAttributeValues={":one": 1},
+                                          ReturnValues="UPDATED_NEW")
+        self._value = int(response["Attributes"]["generation"])
+        self._read_at = time.time()
+        return self._value
+
+
+class QueryCache:
+    """
+    Two tier cache for the retrieval half of a request: normalized question ->
+    embedding, and (index generation, embedding, k) -> top-k hits. The local
+    tier is an LRU, the optional shared tier is any store with get/put.
+    """
+
+    def __init__(self, maxsize=512, shared_store=None, generation=None):
+        self.embeddings = LRUCache(maxsize)
+        self.hits = LRUCache(maxsize)
+        self.shared_store = shared_store
+        self.generation = generation
+        self.counters = {"embedding_hits": 0, "embedding_misses": 0,
+                         "search_local_hits": 0, "search_shared_hits": 0, "search_misses": 0}
+        self._miss_ms = {"embedding": [], "search": []}
+
+    def _timed(self, stage, fn):
+        start = time.perf_counter()
+        value = fn()
+        samples = self._miss_ms[stage]
+        samples.append((time.perf_counter() - start) * 1000)
+        del samples[:-100]
+        return value
+
+    def _avg_miss_ms(self, stage):
+        samples = self._miss_ms[stage]
+        return sum(samples) / len(samples) if samples else 0.0
+
+    def embedding(self, question, embed_fn):
+        key = normalize_question(question)
+        vector = self.embeddings.get(key)
+        if vector is not None:
+            self.counters["embedding_hits"] += 1
+            return vector
+        self.counters["embedding_misses"] += 1
+        vector = self._timed("embedding", lambda: embed_fn(question))
+        self.embeddings.put(key, vector)
+        return vector
+
+    def search(self, vector, k, search_fn):
+        generation = self.generation.current() if self.generation is not None else 0
+        key = f"hits#{generation}#{vector_key(vector)}#{k}"
+        hits = self.hits.get(key)
+        if hits is not None:
+            self.counters["search_local_hits"] += 1
+            return hits
+        if self.shared_store is not None:
+            hits = self.shared_store.get(key)
+            if hits is not None:
+                self.counters["search_shared_hits"] += 1
+                self.hits.put(key, hits)
+                return hits
+        self.counters["search_misses"] += 1
+        hits = self._timed("search", search_fn)
+        self.hits.put(key, hits)
+        if self.shared_store is not None:
+            self.shared_store.put(key, hits)
+        return hits
+
+    def stats(self):
+        """
+        Counters since the container started, with the latency the hits saved
+        estimated from the average latency of recent misses.
+        """
+        search_hits = self.counters["search_local_hits"] + self.counters["search_shared_hits"]
+        saved_ms = (self.counters["embedding_hits"] * self._avg_miss_ms("embedding")
+                    + search_hits * self._avg_miss_ms("search"))
+        return dict(self.counters, estimated_saved_ms=round(saved_ms, 1))
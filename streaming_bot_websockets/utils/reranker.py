@@ -0,0 +1,65 @@
+import math
+import re
+
+STOPWORDS = {"a", "an", "and", "are", "can", "do", "does", "for", "from", "have", "how", "i", "in", "is",
+             "it", "long", "many", "me", "my", "of", "on", "or", "the", "to", "what", "when", "where",
+             "which", "who", "why", "with", "you", "your"}
+
+
+def query_terms(text):
+    return [term for term in re.findall(r"\w[\w-]*", text.lower()) if term not in STOPWORDS]
+
+
+def lexical_scores(question, texts):
+    """
+    Share of the question's idf weight found in each text, idf taken over the
+    candidates themselves so terms every candidate has count for little.
+    """
+    terms = set(query_terms(question))
+    if not terms:
+        return [0.0] * len(texts)
+    documents = [set(re.findall(r"\w[\w-]*", text.lower())) for text in texts]
+    idf = {term: math.log(1 + (len(documents) + 1) / (1 + sum(term in doc for doc in documents)))
+           for term in terms}
+    total = sum(idf.values())
+    return [sum(idf[term] for term in terms if term in doc) / total for doc in documents]
+
+
+def min_max(values):
+    low, high = min(values), max(values)
+    if high - low < 1e-12:
+        return [1.0] * len(values)
+    return [(value - low) / (high - low) for value in values]
+
+
+def adaptive_k(scores, min_k=1, max_k=5, min_gap=0.15):
+    """
+    Number of results to keep from scores sorted best first: cut at the
+    largest drop between neighbours within [min_k, max_k] when it is at least
+    min_gap, otherwise keep max_k. A clear winner gives k=1, a flat run of
+    similar scores (multi-part questions) keeps more.
+    """
+    limit = min(max_k, len(scores))
+    best_gap, cut = 0.0, limit
+    for i in range(max(1, min_k), limit):
+        gap = scores[i - 1] - scores[i]
+        if gap > best_gap:
+            best_gap, cut = gap, i
+    return cut if best_gap >= min_gap else limit
+
+
+def rerank(question, hits, vector_weight=0.5, min_k=1, max_k=5, min_gap=0.15):
+    """
+    Rescore over-fetched hits by lexical overlap with the question plus the
+    search score (min-max scaled over the candidates), and keep an adaptive
+    number of them. Each kept hit gets a _rerank_score, _score is untouched.
+    """
+    if not hits:
+        return []
+    lexical = lexical_scores(question, [hit["_source"].get("doc_text", "") for hit in hits])
+    vector = min_max([hit.get("_score") or 0.0 for hit in hits])
+    scored = sorted(((vector_weight * v + (1 - vector_weight) * l, rank, hit)
+                     for rank, (hit, v, l) in enumerate(zip(hits, vector, lexical))),
+                    key=lambda entry: (-entry[0], entry[1]))
+    k = adaptive_k([score for score, _, _ in scored], min_k, max_k, min_gap)
+    return [dict(hit, _rerank_score=round(score, 4)) for score, _, hit in scored[:k]]
@@ -0,0 +1,89 @@
+import math
+import threading
+from collections import OrderedDict
+
+
+def unit_vector(vector):
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class LocalSemanticStore:
+    """
+    In-process store of answered questions grouped by the context ids they
+    were answered from, so a lookup only scores questions that saw the same
+    context. Oldest context groups are evicted past max_groups.
+    """
+
+    def __init__(self, max_groups=1000, max_per_group=20):
+        self.max_groups = max_groups
+        self.max_per_group = max_per_group
+        self._groups = OrderedDict()
+        self._lock = threading.Lock()
+
+    def candidates(self, context_key):
+        with self._lock:
+            entries = self._groups.get(context_key)
+            if entries is None:
+                return []
+            self._groups.move_to_end(context_key)
+            return list(entries)
+
+    def add(self, context_key, vector, answer):
+        with self._lock:
+            entries = self._groups.setdefault(context_key, [])
+            entries.append((vector, answer))
+            del entries[:-self.max_per_group]
+            self._groups.move_to_end(context_key)
+            while len(self._groups) > self.max_groups:
+                self._groups.popitem(last=False)
+
+
+class SemanticAnswerCache:
+    """
+    Reuses an earlier answer when a question's embedding is within threshold
+    cosine similarity of one already answered and retrieval returned the same
+    context. Chunk ids are content derived, so a changed document changes the
+    context ids and naturally misses.
+    """
+
+    def __init__(self, store, threshold=0.95):
+        self.store = store
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def context_key(context_ids):
+        return tuple(sorted(context_ids))
+
+    def lookup(self, vector, context_ids):
+        query = unit_vector(vector)
+        best_score, best_answer = 0.0, None
+        for candidate, answer in self.store.candidates(self.context_key(context_ids)):
+            score = sum(q * c for q, c in zip(query, candidate))
+            if score > best_score:
+                best_score, best_answer = score, answer
+        if best_answer is not None and best_score >= self.threshold:
+            self.hits += 1
+            print(f"Semantic cache hit, similarity {best_score:.3f}")
+            return best_answer
+        self.misses += 1
+        return None
+
+    def add(self, vector, context_ids, answer):
+        self.store.add(self.context_key(context_ids), unit_vector(vector), answer)
+
+    def stats(self):
+        return {"semantic_cache_hits": self.hits, "semantic_cache_misses": self.misses}
+
+
+def answer_pieces(answer, words_per_piece=20):
+    """
+    Split a cached answer into pieces to send like a streamed response.
+    Clients join frames as they come, so every piece after the first
+    starts with the space that separated it from the previous one.
+    """
+    words = answer.split(" ")
+    for i in range(0, len(words), words_per_piece):
+        yield ("" if i == 0 else " ") + " ".join(words[i:i + words_per_piece])
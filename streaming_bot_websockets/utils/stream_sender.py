@@ -0,0 +1,157 @@
+import json
+import queue
+import threading
+import time
+
+_CLOSE = object()
+
+
+def is_gone_error(ex):
+    return getattr(ex, "response", {}).get("Error", {}).get("Code") == "GoneException"
+
+
+class CoalescingStreamSender:
+    """
+    Sends streamed tokens to a WebSocket connection from a background thread.
+    Tokens go through a bounded queue, so reading the LLM stream is not held up
+    by post_to_connection latency (until the queue fills, which applies back
+    pressure), and are coalesced into one frame per flush_interval seconds or
+    max_frame_bytes, whichever comes first. The first token is sent on its
+    own to keep time to first token low. If the client has gone away send()
+    returns False so the caller can stop generating.
+    """
+
+    def __init__(self, ws_client, connection_id, flush_interval=0.05, max_frame_bytes=4096, queue_size=256):
+        self.ws_client = ws_client
+        self.connection_id = connection_id
+        self.flush_interval = flush_interval
+        self.max_frame_bytes = max_frame_bytes
+        self.gone = threading.Event()
+        self.posts = 0
+        self.post_seconds = 0.0
+        self.started_at = None
+        self.first_post_at = None
+        self._first_sent = False
+        self._parts = []
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+
+    def send(self, token):
+        if self.gone.is_set():
+            return False
+        self._parts.append(token)
+        self._queue.put(token)
+        return True
+
+    def text(self):
+        '''Everything sent so far, joined once rather than concatenated per token'''
+        return "".join(self._parts)
+
+    def close(self, timeout=10):
+        self._queue.put(_CLOSE)
+        self._thread.join(timeout)
+
+    def _post(self, frame):
+        if not frame or self.gone.is_set():
+            return
+        start = time.perf_counter()
+        try:
+            self.ws_client.post_to_connection(ConnectionId=self.connection_id, Data=frame)
+            self.posts += 1
+            if self.first_post_at is None:
+                self.first_post_at = time.perf_counter()
+        except Exception as ex:
+            if is_gone_error(ex):
+                print(f"Connection {self.connection_id} is gone, stopping the stream")
+                self.gone.set()
+            else:
+                print("Error sending message:", ex)
+        finally:
+            self.post_seconds += time.perf_counter() - start
+
+    def _run(self):
+        buffer, size, deadline = [], 0, None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            try:
+                token = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                token = None
+            if token is _CLOSE:
+                self._post("".join(buffer))
+                return
+            if token is not None:
+                if not self._first_sent:
+                    self._first_sent = True
+                    self._post(token)
+                    continue
+                buffer.append(token)
+                size += len(token)
+                if deadline is None:
+                    deadline = time.perf_counter() + self.flush_interval
+            if size >= self.max_frame_bytes or (deadline is not None and time.perf_counter() >= deadline):
+                self._post("".join(buffer))
+                buffer, size, deadline = [], 0, None
+
+    def time_to_first_token_ms(self):
+        if self.first_post_at is None:
+            return None
+        return (self.first_post_at - self.started_at) * 1000
+
+
+def relay_stream(stream, sender):
+    """
+    Read a Bedrock Claude completion stream into sender. Stops reading and
+    closes the stream once the connection is gone, so we stop paying for
+    tokens nobody will receive. Returns the number of chunks read and the
+    output token count Bedrock reports with the last chunk (None when the
+    stream was cut short). A chunk can hold more than one token.
+    """
+    chunks, output_tokens = 0, None
+    for event in stream:
+        chunk = event.get('chunk')
+        if not chunk:
+            continue
+        chunks += 1
+        data = json.loads(chunk.get('bytes').decode())
+        metrics = data.get('amazon-bedrock-invocationMetrics')
+        if metrics:
+            output_tokens = metrics.get('outputTokenCount')
+        if not sender.send(data['completion']):
+            if hasattr(stream, "close"):
+                stream.close()
+            break
+    return chunks, output_tokens
+
+
+def stream_metrics(sender, chunks_read, llm_start, output_tokens=None):
+    """
+    Latency figures for a streamed answer, llm_start is perf_counter() taken
+    just before the model was invoked. Token figures are None without the
+    token count from Bedrock's invocation metrics.
+    """
+    llm_seconds = time.perf_counter() - llm_start
+    ttft_ms = None
+    if sender.first_post_at is not None:
+        ttft_ms = round((sender.first_post_at - llm_start) * 1000)
+    return {
+        "ttft_ms": ttft_ms,
+        "llm_ms": round(llm_seconds * 1000),
+        "send_ms": round(sender.post_seconds * 1000),
+        "output_chunks": chunks_read,
+        "output_tokens": output_tokens,
+        "tokens_per_sec": round(output_tokens / llm_seconds, 1) if output_tokens and llm_seconds > 0 else None,
+        "client_gone": sender.gone.is_set(),
+    }
@@ -0,0 +1,86 @@
+import os
+import threading
+
+from utils.chatbot_utils import get_opensearch_client, search_index
+from utils.index_profiles import get_index_profile
+
+
+class VectorStore:
+    """
+    What the handlers need from a vector index: search returns an OpenSearch
+    style response ({"hits": {"hits": [...]}}, _source without doc_vector),
+    bulk applies index/delete actions shaped like the ones passed to
+    opensearchpy.helpers.bulk and returns (succeeded, failed items).
+    """
+
+    def search(self, vector, k, query_text=None, mode="knn", size=5):
+        raise NotImplementedError
+
+    def add_document(self, document, doc_id=None):
+        raise NotImplementedError
+
+    def bulk(self, actions, **bulk_kwargs):
+        raise NotImplementedError
+
+    def flush(self):
+        '''Persist pending writes, a no-op for remote stores'''
+
+
+class OpenSearchVectorStore(VectorStore):
+    """
+    An index in the AOSS collection, the default backend. Given connect
+    instead of a client, the client (opensearchpy import, credential lookup)
+    is created on first use, so cached answers never pay for it.
+    """
+
+    def __init__(self, client, index_name, connect=None):
+        self._client = client
+        self._connect = connect
+        self.index_name = index_name
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._connect()
+        return self._client
+
+    def search(self, vector, k, query_text=None, mode="knn", size=5):
+        return search_index(self.client, self.index_name, vector, no_of_results=k,
+                            query_text=query_text, mode=mode, size=size)
+
+    def add_document(self, document, doc_id=None):
+        return self.client.index(index=self.index_name, body=document, id=doc_id)
+
+    def bulk(self, actions, **bulk_kwargs):
+        from utils.ingestion_pipeline import bulk_index
+        return bulk_index(self.client, actions, **bulk_kwargs)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_vector_store(index_name, region=None):
+    """
+    Vector store for index_name picked by VECTOR_STORE: "opensearch" (the
+    default) uses the collection at OPENSEARCH_EP, "local" an in-process
+    LocalVectorStore persisted under LOCAL_VECTOR_STORE_PATH. Stores are
+    shared across invocations like the clients in chatbot_utils.
+    """
+    backend = os.environ.get("VECTOR_STORE", "opensearch")
+    if backend == "local":
+        path = os.path.join(os.environ.get("LOCAL_VECTOR_STORE_PATH", "/tmp/vector-store"), index_name)
+        with _stores_lock:
+            if path not in _stores:
+                from utils.local_vector_store import LocalVectorStore
+                _stores[path] = LocalVectorStore.open(path, get_index_profile()["dimension"])
+            return _stores[path]
+    region = region or os.environ['AWS_DEFAULT_REGION']
+    endpoint = os.environ['OPENSEARCH_EP']
+    return OpenSearchVectorStore(None, index_name, connect=lambda: get_opensearch_client(endpoint, region))
+
+
+def close_vector_stores():
+    '''Forget the local stores, for tests'''
+    with _stores_lock:
+        _stores.clear()
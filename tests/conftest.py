@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The Lambda handlers import shared code as `utils.<module>` (the layer puts
+# streaming_bot_websockets/ on the path), so mirror that layout for the tests.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "streaming_bot_websockets"))
@@ -0,0 +1,520 @@
+'''In-process stand-ins for the AWS services used by the Lambdas, shared by the
+unit tests and the scripts under benchmarks/.'''
+import hashlib
+import importlib.util
+import io
+import json
+import math
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+
+class FakeClientError(Exception):
+    '''Looks like a botocore ClientError to code that inspects `.response`.'''
+
+    def __init__(self, code, message=""):
+        super().__init__(f"{code}: {message}")
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+
+def hash_embedding(text, dimension=64):
+    '''Deterministic bag-of-words embedding, texts sharing words end up close.'''
+    vector = [0.0] * dimension
+    for word in text.lower().split():
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        vector[int.from_bytes(digest[:4], "little") % dimension] += 1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class FakeBedrockClient:
+    '''Answers invoke_model for Titan and Cohere embeddings with hash embeddings and for
+    Claude prompts with a canned completion, with an optional latency per
+    call and a number of throttles to inject first. Models in
+    throttled_models are always throttled and the calls numbered in
+    slow_calls take slow_latency, for the tail.'''
+
+    def __init__(self, latency=0.0, dimension=64, throttles=0, stream_tokens=50, token_delay=0.0,
+                 throttled_models=(), slow_calls=(), slow_latency=0.0):
+        self.latency = latency
+        self.throttled_models = set(throttled_models)
+        self.slow_calls = set(slow_calls)
+        self.slow_latency = slow_latency
+        self.models = []
+        self.stream_tokens = stream_tokens
+        self.token_delay = token_delay
+        self.last_stream = None
+        self.dimension = dimension
+        self.throttles = throttles
+        self.calls = 0
+        self.completions = 0
+        self._lock = threading.Lock()
+
+    def invoke_model(self, body, modelId, accept=None, contentType=None):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+            self.models.append(modelId)
+            if self.throttles > 0 or modelId in self.throttled_models:
+                self.throttles = max(0, self.throttles - 1)
+                raise FakeClientError("ThrottlingException", "Rate exceeded")
+        if call in self.slow_calls:
+            time.sleep(self.slow_latency)
+        elif self.latency:
+            time.sleep(self.latency)
+        request = json.loads(body)
+        if "prompt" in request:
+            with self._lock:
+                self.completions += 1
+            payload = {"completion": f"Answer {self.completions} from the provided context."}
+        elif "texts" in request:
+            payload = {"embeddings": [hash_embedding(text, self.dimension) for text in request["texts"]]}
+        else:
+            payload = {"embedding": hash_embedding(request["inputText"], request.get("dimensions", self.dimension))}
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8"))}
+
+    def invoke_model_with_response_stream(self, body, modelId, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.models.append(modelId)
+            if modelId in self.throttled_models:
+                raise FakeClientError("ThrottlingException", "Rate exceeded")
+            self.completions += 1
+        tokens = [f" token{i}" for i in range(self.stream_tokens)]
+        self.last_stream = FakeCompletionStream(tokens, self.token_delay)
+        return {"body": self.last_stream}
+
+
+def jittered(latency):
+    '''Latency with a long-ish tail, so percentiles mean something'''
+    return latency * random.lognormvariate(0, 0.5) if latency else 0.0
+
+
+class FakeCompletionStream:
+    '''Iterable like the body of invoke_model_with_response_stream, one Claude
+    completion chunk per token with a delay between them. The last chunk
+    carries Bedrock's invocation metrics, counting two tokens per chunk.'''
+
+    def __init__(self, tokens, delay=0.0):
+        self.tokens = tokens
+        self.delay = delay
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        for token in self.tokens:
+            if self.closed:
+                return
+            if self.delay:
+                time.sleep(self.delay)
+            self.read += 1
+            data = {"completion": token}
+            if self.read == len(self.tokens):
+                data["amazon-bedrock-invocationMetrics"] = {"outputTokenCount": 2 * len(self.tokens)}
+            yield {"chunk": {"bytes": json.dumps(data).encode("utf-8")}}
+
+    def close(self):
+        self.closed = True
+
+
+class FakeOpenSearch:
+    '''Records documents written through index() and bulk(), with an optional
+    latency per HTTP request. Bulk index actions of documents whose doc_text
+    is in rejected_texts fail like a mapping error.'''
+
+    def __init__(self, latency=0.0, keep_documents=True, rejected_texts=()):
+        from opensearchpy.serializer import JSONSerializer
+        self.transport = SimpleNamespace(serializer=JSONSerializer())
+        self.latency = latency
+        self.keep_documents = keep_documents
+        self.rejected_texts = set(rejected_texts)
+        self.documents = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def _request(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _new_id(self):
+        with self._lock:
+            self._next_id += 1
+            return str(self._next_id)
+
+    def index(self, index, body, id=None, **kwargs):
+        self._request()
+        doc_id = id or self._new_id()
+        self.documents[doc_id] = body
+        return {"_index": index, "_id": doc_id, "result": "created"}
+
+    def search(self, body, index=None, **kwargs):
+        self._request()
+        return self._search(body, index)
+
+    def msearch(self, body, index=None, **kwargs):
+        self._request()
+        pairs = zip(body[0::2], body[1::2])
+        return {"responses": [self._search(search, header.get("index", index)) for header, search in pairs]}
+
+    def _search(self, body, index):
+        query = body["query"]
+        size = body.get("size", 10)
+        if "match" in query:
+            scored = self._bm25(query["match"]["doc_text"]["query"])
+        else:
+            knn = query["knn"]["doc_vector"]
+            size = min(knn["k"], size)
+            scored = [(doc_id, sum(q * d for q, d in zip(knn["vector"], doc["doc_vector"])))
+                      for doc_id, doc in list(self.documents.items())]
+        scored.sort(key=lambda pair: pair[1], reverse=True)
+        hits = []
+        for doc_id, score in scored[:size]:
+            source = {k: v for k, v in self.documents[doc_id].items() if k != "doc_vector"}
+            hits.append({"_index": index, "_id": doc_id, "_score": score, "_source": source})
+        return {"hits": {"hits": hits}}
+
+    def _bm25(self, text, k1=1.2, b=0.75):
+        '''Plain BM25 over doc_text with lowercase whitespace tokens.'''
+        docs = {doc_id: doc["doc_text"].lower().split() for doc_id, doc in list(self.documents.items())}
+        if not docs:
+            return []
+        avg_len = sum(len(words) for words in docs.values()) / len(docs)
+        terms = set(text.lower().split())
+        frequency = {term: sum(1 for words in docs.values() if term in words) for term in terms}
+        scored = []
+        for doc_id, words in docs.items():
+            score = 0.0
+            for term in terms:
+                tf = words.count(term)
+                if not tf:
+                    continue
+                idf = math.log(1 + (len(docs) - frequency[term] + 0.5) / (frequency[term] + 0.5))
+                score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(words) / avg_len))
+            if score > 0:
+                scored.append((doc_id, score))
+        return scored
+
+    def bulk(self, body, index=None, **kwargs):
+        self._request()
+        lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+        items = []
+        i = 0
+        while i < len(lines):
+            op_type, meta = next(iter(lines[i].items()))
+            doc_id = meta.get("_id") or self._new_id()
+            if op_type == "delete":
+                self.documents.pop(doc_id, None)
+                i += 1
+            elif lines[i + 1].get("doc_text") in self.rejected_texts:
+                items.append({op_type: {"_id": doc_id, "status": 400,
+                                        "error": {"type": "mapper_parsing_exception"}}})
+                i += 2
+                continue
+            else:
+                if self.keep_documents:
+                    self.documents[doc_id] = lines[i + 1]
+                i += 2
+            items.append({op_type: {"_id": doc_id, "status": 200}})
+        return {"errors": any(item[next(iter(item))]["status"] >= 300 for item in items), "items": items}
+
+
+def make_pdf(num_pages, lines_per_page=40, line_text="Synthetic retail manual line {page}-{line} with product details.",
+             page_lines=None):
+    '''Build a PDF with one text line per row, pages are independent objects so
+    readers can parse them one at a time. page_lines(page) overrides the
+    generated lines of a page.'''
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for page in range(num_pages):
+        lines = page_lines(page) if page_lines else [line_text.format(page=page, line=line)
+                                                     for line in range(lines_per_page)]
+        rows = [f"BT /F1 10 Tf 40 {800 - 18 * n} Td ({text}) Tj ET" for n, text in enumerate(lines)]
+        content = "\n".join(rows).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        content_ref = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref)
+        page_refs.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % ref for ref in page_refs)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, num_pages)
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+class FakeWebSocketClient:
+    '''Records post_to_connection calls, connections in `gone` raise GoneException'''
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.gone = set()
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def post_to_connection(self, ConnectionId, Data):
+        if self.latency:
+            time.sleep(jittered(self.latency))
+        if ConnectionId in self.gone:
+            raise FakeClientError("GoneException", f"{ConnectionId} is gone")
+        with self._lock:
+            self.messages.append((ConnectionId, Data, time.perf_counter()))
+        return {}
+
+
+class FakeEventsClient:
+    '''Records put events. The first `failures` entries sent are rejected
+    the way EventBridge does, in the response and without raising.'''
+
+    def __init__(self, latency=0.0, failures=0):
+        self.latency = latency
+        self.failures = failures
+        self.entries = []
+
+    def put_events(self, Entries):
+        if self.latency:
+            time.sleep(jittered(self.latency))
+        results = []
+        for entry in Entries:
+            if self.failures > 0:
+                self.failures -= 1
+                results.append({"ErrorCode": "InternalFailure", "ErrorMessage": "Internal failure"})
+            else:
+                self.entries.append(entry)
+                results.append({"EventId": str(len(self.entries))})
+        return {"FailedEntryCount": sum(1 for result in results if "ErrorCode" in result), "Entries": results}
+
+
+class FakeStreamingBody:
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def read(self, amt=None):
+        return self._data.read(amt)
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            data = self._data.read(chunk_size)
+            if not data:
+                return
+            yield data
+
+
+class FakeS3Client:
+    '''Objects kept in memory by (bucket, key), with an optional latency per request'''
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, ContentType="binary/octet-stream"):
+        self.objects[(Bucket, Key)] = (Body, ContentType)
+
+    def get_object(self, Bucket, Key):
+        if self.latency:
+            time.sleep(jittered(self.latency))
+        body, content_type = self.objects[(Bucket, Key)]
+        return {"Body": FakeStreamingBody(body), "ContentType": content_type, "ContentLength": len(body)}
+
+    def head_object(self, Bucket, Key):
+        body, content_type = self.objects[(Bucket, Key)]
+        return {"ContentType": content_type, "ContentLength": len(body)}
+
+
+class FakeTable:
+    '''Enough of a boto3 DynamoDB Table for the code in utils/, items keyed by (pk, sk)'''
+
+    def __init__(self, name, latency=0.0):
+        self.name = name
+        self.latency = latency
+        self.items = {}
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(jittered(self.latency))
+
+    def put_item(self, Item, **kwargs):
+        self._wait()
+        with self._lock:
+            self.items[(Item["pk"], Item["sk"])] = dict(Item)
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        self._wait()
+        item = self.items.get((Key["pk"], Key["sk"]))
+        return {"Item": dict(item)} if item is not None else {}
+
+    def delete_item(self, Key, **kwargs):
+        self._wait()
+        with self._lock:
+            self.items.pop((Key["pk"], Key["sk"]), None)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ConditionExpression=None, **kwargs):
+        self._wait()
+        # supports "ADD <attr> :value" and "SET <attr> = :value" clauses, and conditions
+        # of "attribute_not_exists(<attr>)" and "<attr> = :value" clauses joined by OR
+        with self._lock:
+            existing = self.items.get((Key["pk"], Key["sk"]), {})
+            if ConditionExpression and not any(
+                    clause[len("attribute_not_exists("):-1] not in existing
+                    if clause.startswith("attribute_not_exists(")
+                    else existing.get(clause.split(" = ")[0]) == ExpressionAttributeValues[clause.split(" = ")[1]]
+                    for clause in ConditionExpression.split(" OR ")):
+                raise FakeClientError("ConditionalCheckFailedException", "The conditional request failed")
+            item = self.items.setdefault((Key["pk"], Key["sk"]), dict(Key))
+            action, assignments = UpdateExpression.split(" ", 1)
+            for assignment in assignments.split(","):
+                parts = assignment.replace("=", " ").split()
+                attr, value = parts[0], ExpressionAttributeValues[parts[-1]]
+                item[attr] = item.get(attr, 0) + value if action == "ADD" else value
+            return {"Attributes": dict(item)}
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, ScanIndexForward=True,
+              Limit=None, ExclusiveStartKey=None, **kwargs):
+        self._wait()
+        self.queries += 1
+        # supports "pk = :pk" optionally followed by "AND begins_with(sk, :prefix)"
+        pk = ExpressionAttributeValues[":pk"]
+        prefix = ExpressionAttributeValues.get(":prefix", "")
+        items = sorted((item for (item_pk, sk), item in list(self.items.items())
+                        if item_pk == pk and sk.startswith(prefix)),
+                       key=lambda item: item["sk"], reverse=not ScanIndexForward)
+        return {"Items": [dict(item) for item in items[:Limit]]}
+
+    def batch_writer(self, **kwargs):
+        table = self
+
+        class BatchWriter:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def put_item(self, Item):
+                table.put_item(Item=Item)
+
+            def delete_item(self, Key):
+                table.delete_item(Key=Key)
+        return BatchWriter()
+
+
+class LocalDispatcher:
+    '''Local stand-in for the shard event bus: each dispatched message is
+    handled on a pool of `workers` threads, like parallel invocations.'''
+
+    def __init__(self, handler, workers=4):
+        from concurrent.futures import ThreadPoolExecutor
+        self.handler = handler
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = []
+
+    def __call__(self, messages):
+        self.futures.extend(self.executor.submit(self.handler, message) for message in messages)
+
+    def results(self):
+        return [future.result() for future in self.futures]
+
+
+class FakeDynamoDb:
+    '''Stands in for boto3.resource('dynamodb')'''
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.tables = {}
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name, self.latency)
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            found = [table.items.get((key["pk"], key["sk"])) for key in request["Keys"]]
+            responses[name] = [dict(item) for item in found if item is not None]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+
+HANDLER_ENV = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "WS_API_URL": "https://ws.example.com/dev",
+    "EVENT_BUS_NAME": "MessagingAppEventBus",
+    "OPENSEARCH_EP": "https://collection.example.com",
+    "EVENTS_TABLE_NAME": "events_table",
+    "LLM_STREAMING_ENABLED": "NO",
+    "DOCUMENTS_INDEX": "docs-index",
+}
+
+
+def install_fakes(bedrock=None, opensearch=None, websocket=None, events=None, dynamodb=None, s3=None):
+    '''Register fakes in the chatbot_utils client registry, returns them by service name'''
+    from utils.chatbot_utils import clear_registry, register_client
+    fakes = {
+        "bedrock-runtime": bedrock or FakeBedrockClient(),
+        "opensearch": opensearch or FakeOpenSearch(),
+        "apigatewaymanagementapi": websocket or FakeWebSocketClient(),
+        "events": events or FakeEventsClient(),
+        "dynamodb": dynamodb or FakeDynamoDb(),
+        "s3": s3 or FakeS3Client(),
+    }
+    clear_registry()
+    region = HANDLER_ENV["AWS_DEFAULT_REGION"]
+    register_client(("client", "bedrock-runtime", (("region_name", region),)), fakes["bedrock-runtime"])
+    register_client(("client", "bedrock-runtime", ()), fakes["bedrock-runtime"])
+    register_client(("client", "apigatewaymanagementapi", (("endpoint_url", HANDLER_ENV["WS_API_URL"]),)),
+                    fakes["apigatewaymanagementapi"])
+    register_client(("client", "events", ()), fakes["events"])
+    register_client(("resource", "dynamodb", ()), fakes["dynamodb"])
+    register_client(("client", "s3", ()), fakes["s3"])
+    register_client(("opensearch", HANDLER_ENV["OPENSEARCH_EP"], region), fakes["opensearch"])
+    return fakes
+
+
+def load_lambda(name, monkeypatch=None, **env):
+    '''Import lambdas/<name>/app.py as a fresh module with the handler environment set.
+    Tests pass pytest's monkeypatch so the environment is restored afterwards,
+    without it (benchmarks) the variables stay set for the process.'''
+    for key, value in dict(HANDLER_ENV, **env).items():
+        if monkeypatch is not None:
+            monkeypatch.setenv(key, value)
+        else:
+            os.environ[key] = value
+    root = os.path.join(os.path.dirname(os.path.dirname(__file__)), "streaming_bot_websockets", "lambdas")
+    spec = importlib.util.spec_from_file_location(f"{name}_app", os.path.join(root, name, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def websocket_event(connection_id, event_type="MESSAGE", body=None):
+    return {"requestContext": {"connectionId": connection_id, "eventType": event_type,
+                               "domainName": "ws.example.com", "stage": "dev"},
+            "body": body}
+
+
+def s3_event(bucket, key, event_name="ObjectCreated:Put"):
+    return {"Records": [{"eventName": event_name,
+                         "s3": {"bucket": {"name": bucket}, "object": {"key": key}}}]}
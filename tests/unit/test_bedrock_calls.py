@@ -0,0 +1,94 @@
+import pytest
+
+from tests.fakes import FakeBedrockClient, FakeClientError
+from utils.bedrock_calls import ResilientBedrockClient, TokenBucket, get_bucket, reset_call_state
+from utils.chatbot_utils import get_client, invoke_model, text_embedding
+from utils.embeddings import TitanProvider, embed_batch
+
+EMBEDDING_MODEL = "amazon.titan-embed-text-v1"
+
+
+@pytest.fixture(autouse=True)
+def fresh_call_state():
+    reset_call_state()
+    yield
+    reset_call_state()
+
+
+def test_token_bucket_halves_on_throttle_and_recovers():
+    bucket = TokenBucket(rate=10)
+    bucket.on_throttle()
+    bucket.on_throttle()
+    assert bucket.rate == 2.5
+    for _ in range(100):
+        bucket.on_success()
+    assert bucket.rate == 10
+    for _ in range(100):
+        bucket.on_throttle()
+    assert bucket.rate == bucket.min_rate
+
+
+def test_token_bucket_paces_requests():
+    bucket = TokenBucket(rate=100, burst=1)
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert bucket.acquire() > 0
+
+
+def test_throttles_are_retried_and_slow_the_bucket_down():
+    bedrock = FakeBedrockClient(throttles=2)
+    client = ResilientBedrockClient(bedrock, base_delay=0.001)
+    assert len(text_embedding(client, "hello")) == bedrock.dimension
+    assert bedrock.calls == 3
+    assert get_bucket(EMBEDDING_MODEL).rate < get_bucket(EMBEDDING_MODEL).max_rate
+
+
+def test_falls_back_to_another_region_then_another_model():
+    primary = FakeBedrockClient(throttled_models={"anthropic.claude-v2:1"})
+    secondary = FakeBedrockClient(throttled_models={"anthropic.claude-v2:1"})
+    fallbacks = {"anthropic.claude-v2:1": [{"region": "us-west-2"}, {"model_id": "anthropic.claude-instant-v1"}]}
+    client = ResilientBedrockClient(primary, region="us-east-1", fallbacks=fallbacks, max_retries=1,
+                                    base_delay=0.001, client_for_region=lambda region: secondary)
+    assert invoke_model(client, "hi").startswith("Answer")
+    assert secondary.models == ["anthropic.claude-v2:1"] * 2
+    assert primary.models == ["anthropic.claude-v2:1"] * 2 + ["anthropic.claude-instant-v1"]
+
+
+def test_non_retryable_errors_are_raised_at_once():
+    class Broken(FakeBedrockClient):
+        def invoke_model(self, body, modelId, **kwargs):
+            self.calls += 1
+            raise FakeClientError("ValidationException")
+    bedrock = Broken()
+    client = ResilientBedrockClient(bedrock, fallbacks={EMBEDDING_MODEL: [{"region": "us-west-2"}]},
+                                    client_for_region=lambda region: pytest.fail("no fallback expected"))
+    with pytest.raises(FakeClientError):
+        text_embedding(client, "hello")
+    assert bedrock.calls == 1
+
+
+def test_hedged_request_wins_over_a_slow_call(monkeypatch):
+    # hedges only go out with spare tokens, keep the bucket out of the way
+    monkeypatch.setenv("BEDROCK_MAX_RPS", "1000")
+    bedrock = FakeBedrockClient(latency=0.002, slow_calls={31}, slow_latency=1.0)
+    client = ResilientBedrockClient(bedrock, hedge_models=("amazon.titan-embed",))
+    for n in range(30):
+        text_embedding(client, f"warm up {n}")
+    assert client.hedges == 0
+    bucket = get_bucket(EMBEDDING_MODEL)
+    tokens = []
+    for name in ("acquire", "try_acquire"):
+        monkeypatch.setattr(bucket, name, lambda take=getattr(bucket, name): tokens.append(1) or take())
+    assert len(text_embedding(client, "tail")) == bedrock.dimension
+    assert client.hedges == 1 and client.hedge_wins == 1
+    # one token for the primary request, one for the hedge
+    assert len(tokens) == 2
+
+
+def test_embed_batch_retries_only_in_the_resilient_client():
+    bedrock = FakeBedrockClient(throttled_models={EMBEDDING_MODEL})
+    client = ResilientBedrockClient(bedrock, max_retries=3, base_delay=0.001)
+    with pytest.raises(FakeClientError):
+        embed_batch(["hello"], TitanProvider(EMBEDDING_MODEL, client=client))
+    assert bedrock.calls == 4
+    assert get_client('bedrock-runtime', region_name="us-east-1").meta.config.retries["total_max_attempts"] == 1
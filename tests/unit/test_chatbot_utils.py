@@ -0,0 +1,60 @@
+import threading
+import time
+
+from utils.chatbot_utils import SideEffects, Trace, clear_registry, get_client, get_resource, register_client
+
+
+def test_clients_are_created_once_and_reused():
+    clear_registry()
+    bedrock = get_client('bedrock-runtime', region_name='us-east-1')
+    assert get_client('bedrock-runtime', region_name='us-east-1') is bedrock
+    assert get_client('bedrock-runtime', region_name='us-west-2') is not bedrock
+    assert bedrock.meta.config.max_pool_connections == 50
+    assert get_resource('dynamodb', region_name='us-east-1') is get_resource('dynamodb', region_name='us-east-1')
+
+
+def test_register_client_swaps_in_a_fake():
+    clear_registry()
+    fake = object()
+    register_client('events', fake)
+    assert get_client('events') is fake
+    clear_registry()
+
+
+def test_side_effects_report_errors_and_missed_deadlines():
+
+    def fail():
+        raise ValueError("table missing")
+
+    side_effects = SideEffects()
+    side_effects.submit("ok", lambda: None)
+    side_effects.submit("log_to_db", fail)
+    side_effects.submit("slow", time.sleep, 0.5)
+    errors = side_effects.wait(timeout=0.1)
+    assert set(errors) == {"log_to_db", "slow"}
+    assert "table missing" in errors["log_to_db"]
+
+
+def test_trace_emits_one_emf_record_with_stage_timings():
+    trace = Trace("ws_message_handler", namespace="Chatter/test", request_id="r-1")
+    with trace.span("search"):
+        time.sleep(0.01)
+    log = trace.timed("log", lambda: time.sleep(0.005))
+    threads = [threading.Thread(target=log) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    trace.record("ttft", 42)
+    trace.record("llm", None)
+    trace.count("tokens", 120)
+
+    record = trace.emf()
+    [directive] = record["_aws"]["CloudWatchMetrics"]
+    assert directive["Namespace"] == "Chatter/test" and directive["Dimensions"] == [["Handler"]]
+    units = {metric["Name"]: metric["Unit"] for metric in directive["Metrics"]}
+    assert units == {"search_ms": "Milliseconds", "log_ms": "Milliseconds", "ttft_ms": "Milliseconds",
+                     "total_ms": "Milliseconds", "tokens": "Count"}
+    assert record["Handler"] == "ws_message_handler" and record["request_id"] == "r-1"
+    assert record["search_ms"] >= 10 and record["log_ms"] >= 10 and record["ttft_ms"] == 42
+    assert record["tokens"] == 120
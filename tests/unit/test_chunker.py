@@ -0,0 +1,45 @@
+import io
+import tempfile
+
+from utils.chunker import StructuredChunker, strip_boilerplate
+from utils.context_builder import estimate_tokens
+from utils.ingestion_pipeline import iter_pdf_pages, iter_pdf_pages_parallel
+from tests.fakes import make_pdf
+
+TEXT = """2.1 Returns
+Items can be returned within 30 days of delivery. The receipt is required for every
+return. Refunds go back to the original payment method within five business days.
+Clearance items are final sale.
+
+2.2 Shipping
+Standard shipping takes three to five business days. Express shipping takes one to
+two business days and costs extra."""
+
+
+def test_chunks_follow_headings_and_sentences():
+    chunks = StructuredChunker(target_tokens=30, max_tokens=45, overlap_tokens=0, min_tokens=5).split_text(TEXT)
+    assert chunks[0].startswith("2.1 Returns\nItems can be returned")
+    assert all(chunk.rstrip().endswith(".") for chunk in chunks)
+    assert not any("2.1 Returns" in chunk and "Standard shipping" in chunk for chunk in chunks)
+    assert any(chunk.startswith("2.2 Shipping\n") for chunk in chunks)
+    assert all(estimate_tokens(chunk) <= 45 for chunk in chunks)
+
+
+def test_repeated_headers_and_footers_are_removed():
+    topics = ["returns", "shipping", "warranty", "gift cards", "price matching"]
+    pages = [(n, f"ACME Retail Handbook\nThis page covers {topics[n % 5]}.\nPage {n + 1} of 30")
+             for n in range(30)]
+    cleaned = list(strip_boilerplate(pages, sample_pages=10))
+    assert cleaned[0] == (0, "This page covers returns.")
+    assert cleaned[26] == (26, "This page covers shipping.")
+
+
+def test_parallel_parsing_returns_pages_in_order():
+    pdf = make_pdf(23, lines_per_page=3)
+    expected = list(iter_pdf_pages(io.BytesIO(pdf)))
+    assert list(iter_pdf_pages_parallel(io.BytesIO(pdf), workers=3, min_pages=1)) == expected
+
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as spooled:
+        spooled.write(pdf)
+        spooled.seek(0)
+        assert list(iter_pdf_pages_parallel(spooled, workers=2, min_pages=1)) == expected
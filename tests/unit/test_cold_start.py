@@ -0,0 +1,9 @@
+import pytest
+
+from benchmarks.cold_start import import_profile
+
+
+@pytest.mark.parametrize("handler", ["ws_message_handler", "vectordb_ingestion_handler", "billing_message_handler"])
+def test_handler_import_defers_heavy_modules(handler):
+    profile = import_profile(handler)
+    assert profile["deferred_loaded"] == []
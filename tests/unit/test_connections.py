@@ -0,0 +1,74 @@
+import json
+import threading
+import time
+
+from tests.fakes import FakeDynamoDb, FakeWebSocketClient, install_fakes, load_lambda, websocket_event
+from utils.connections import BROADCAST_EVENT_SOURCE, ConnectionRegistry, broadcast
+
+
+def test_registry_spreads_connections_and_skips_expired_ones():
+    dynamodb = FakeDynamoDb()
+    registry = ConnectionRegistry("events_table", shards=4, dynamodb=dynamodb)
+    for n in range(40):
+        registry.register(f"conn-{n}")
+    registry.remove("conn-3")
+    expired = ConnectionRegistry("events_table", shards=4, ttl_seconds=-60, dynamodb=dynamodb)
+    expired.register("conn-stale")
+
+    assert sorted(registry.connection_ids()) == sorted(f"conn-{n}" for n in range(40) if n != 3)
+    assert len({pk for pk, _ in dynamodb.Table("events_table").items}) == 4
+
+
+def test_broadcast_bounds_concurrency_and_prunes_gone_connections():
+    class CountingClient(FakeWebSocketClient):
+        in_flight = peak = 0
+        counter = threading.Lock()
+
+        def post_to_connection(self, ConnectionId, Data):
+            with self.counter:
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+            try:
+                time.sleep(0.002)
+                return super().post_to_connection(ConnectionId, Data)
+            finally:
+                with self.counter:
+                    self.in_flight -= 1
+
+    registry = ConnectionRegistry("events_table", dynamodb=FakeDynamoDb())
+    for n in range(300):
+        registry.register(f"conn-{n}")
+    ws_client = CountingClient()
+    ws_client.gone = {f"conn-{n}" for n in range(0, 300, 10)}
+
+    stats = broadcast(ws_client, registry.connection_ids(), "notice", registry=registry, workers=8)
+    assert (stats["sent"], stats["gone"], stats["failed"]) == (270, 30, 0)
+    assert ws_client.peak <= 8
+    assert len(list(registry.connection_ids())) == 270
+
+
+def test_connect_registers_and_broadcast_events_reach_open_connections(monkeypatch):
+    fakes = install_fakes()
+    app = load_lambda("ws_message_handler", monkeypatch)
+    for connection_id in ["conn-1", "conn-2", "conn-3"]:
+        app.lambda_handler(websocket_event(connection_id, event_type="CONNECT"), None)
+    app.lambda_handler(websocket_event("conn-2", event_type="DISCONNECT"), None)
+    fakes["apigatewaymanagementapi"].gone.add("conn-3")
+
+    notice = {"type": "ingestion_complete", "source": "s3://knowledge-bucket/manual.pdf"}
+    response = app.lambda_handler({"source": BROADCAST_EVENT_SOURCE, "detail": notice}, None)
+
+    assert json.loads(response["body"])["sent"] == 1
+    assert [(c, json.loads(data)) for c, data, _ in fakes["apigatewaymanagementapi"].messages] == [("conn-1", notice)]
+    assert list(app.connection_registry.connection_ids()) == ["conn-1"]
+
+
+def test_connection_found_gone_while_streaming_is_removed(monkeypatch):
+    fakes = install_fakes()
+    app = load_lambda("ws_message_handler", monkeypatch, LLM_STREAMING_ENABLED="YES")
+    for connection_id in ["conn-1", "conn-2"]:
+        app.lambda_handler(websocket_event(connection_id, event_type="CONNECT"), None)
+    fakes["apigatewaymanagementapi"].gone.add("conn-2")
+
+    app.lambda_handler(websocket_event("conn-2", body="how do I return a tent"), None)
+    assert list(app.connection_registry.connection_ids()) == ["conn-1"]
@@ -0,0 +1,49 @@
+from utils.chunker import StructuredChunker
+from utils.context_builder import build_context, estimate_tokens, overlap_length
+
+
+def hit(doc_id, text, score, source="s3://docs/a.pdf"):
+    return {"_id": doc_id, "_score": score, "_source": {"doc_text": text, "doc_source": source}}
+
+
+def test_overlapping_chunks_from_one_source_are_merged():
+    text = " ".join(f"word{i}" for i in range(200))
+    first, second = text[:600], text[450:1100]
+    assert overlap_length(first, second) == 150
+
+    built = build_context([hit("1", second, 0.9), hit("2", first, 0.8)])
+    assert built["passages"] == [text[:1100]]
+    assert sorted(built["ids"]) == ["1", "2"]
+    assert built["tokens"] < built["raw_tokens"]
+
+
+def test_duplicates_dropped_and_budget_respected_in_score_order():
+    hits = [hit("1", "alpha " * 50, 0.5, "s3://docs/a.pdf"),
+            hit("2", "alpha " * 50, 0.4, "s3://docs/b.pdf"),
+            hit("3", "bravo " * 50, 0.9, "s3://docs/c.pdf"),
+            hit("4", "charlie " * 50, 0.7, "s3://docs/d.pdf")]
+    built = build_context(hits, token_budget=160)
+    # charlie no longer fits after bravo, the smaller alpha passage still does
+    assert built["ids"] == ["3", "1"]
+    assert built["tokens"] <= 160
+
+    built = build_context(hits, token_budget=20)
+    assert built["ids"] == ["3"] and estimate_tokens(built["text"]) <= 20
+
+
+def test_reranked_hits_are_taken_in_rerank_order():
+    a = hit("a", "alpha " * 80, 0.9, "s3://docs/a.pdf")
+    b = hit("b", "bravo " * 80, 0.2, "s3://docs/b.pdf")
+    reranked = [dict(b, _rerank_score=0.99), dict(a, _rerank_score=0.5)]
+    assert build_context(reranked, token_budget=120)["ids"] == ["b"]
+
+
+def test_structured_chunks_of_a_section_are_merged_back():
+    sentences = [f"Sentence {n} explains the tent warranty terms in detail." for n in range(30)]
+    chunks = StructuredChunker(target_tokens=60, max_tokens=90, overlap_tokens=20).split_text(
+        "WARRANTY\n" + " ".join(sentences))
+    assert len(chunks) > 2 and all(chunk.startswith("WARRANTY\n") for chunk in chunks)
+
+    built = build_context([hit(str(n), chunk, 1.0 - n / 100) for n, chunk in enumerate(chunks)])
+    assert built["passages"] == ["WARRANTY\n" + " ".join(sentences)]
+    assert sorted(built["ids"]) == sorted(str(n) for n in range(len(chunks)))
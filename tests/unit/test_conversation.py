@@ -0,0 +1,97 @@
+import json
+
+from tests.fakes import FakeDynamoDb, install_fakes, load_lambda, websocket_event
+from utils.conversation import Conversation, ConversationStore, new_msg_id, rewrite_query
+
+
+def log_turns(table, session_id, count, start=1_700_000_000):
+    ids = []
+    for n in range(count):
+        msg_id = new_msg_id(start + n)
+        table.put_item(Item={"pk": session_id, "sk": msg_id,
+                             "body": {"user_msg": f"question {n}", "ai_msg": f"answer {n}"}})
+        table.put_item(Item={"pk": session_id, "sk": f"{msg_id}#sentiment_analysis", "body": {"sentiment": "positive"}})
+        ids.append(msg_id)
+    return ids
+
+
+def test_msg_ids_sort_by_time():
+    ids = [new_msg_id(1_700_000_000 + n / 1000) for n in range(50)]
+    assert sorted(ids) == ids
+
+
+def test_conversation_loads_with_one_query_and_stays_cached():
+    dynamodb = FakeDynamoDb()
+    table = dynamodb.Table("events_table")
+    log_turns(table, "conn-1", 3)
+    table.put_item(Item={"pk": "conn-1", "sk": "3f2b9c4e-legacy-uuid", "body": {"user_msg": "old", "ai_msg": "old"}})
+    store = ConversationStore("events_table", dynamodb=dynamodb)
+
+    conversation = store.load("conn-1")
+    assert [user_msg for _, user_msg, _ in conversation.turns] == ["question 0", "question 1", "question 2"]
+    store.append("conn-1", conversation, new_msg_id(), "question 3", "answer 3")
+    assert len(store.load("conn-1").turns) == 4
+    assert table.queries == 1
+
+
+def test_history_keeps_the_newest_turns_within_the_budget():
+    turns = [(new_msg_id(1_700_000_000 + n), f"question {n} " + "word " * 40, "answer " * 200) for n in range(6)]
+    history = Conversation("The user is asking about tent sku-42.", turns=turns).history(token_budget=400)
+    assert history.startswith("Earlier in this conversation: The user is asking about tent sku-42.")
+    assert "question 5" in history and "question 0" not in history
+    assert "question 4" in history and len(history) <= 400 * 4
+
+
+def test_older_turns_are_summarized_and_the_summary_is_loaded_back():
+    dynamodb = FakeDynamoDb()
+    ids = log_turns(dynamodb.Table("events_table"), "conn-1", 7)
+    store = ConversationStore("events_table", window=3, summarize_after=4, dynamodb=dynamodb)
+    conversation = store.load("conn-1")
+    assert store.needs_summary(conversation)
+
+    seen = []
+    store.summarize("conn-1", conversation,
+                    lambda summary, turns: seen.extend(turns) or f"summary of {len(turns)} turns")
+    assert [msg_id for msg_id, _, _ in seen] == ids[:4]
+    assert len(conversation.turns) == 3
+
+    reloaded = ConversationStore("events_table", window=3, summarize_after=4, dynamodb=dynamodb).load("conn-1")
+    assert reloaded.summary == "summary of 4 turns"
+    assert [msg_id for msg_id, _, _ in reloaded.turns] == ids[4:]
+
+
+def test_only_follow_ups_are_rewritten():
+    conversation = Conversation(turns=[(new_msg_id(), "does the trail tent sku-42 have a warranty", "Yes, 2 years.")])
+    assert rewrite_query("and is it waterproof?", conversation) == \
+        "does the trail tent sku-42 have a warranty and is it waterproof?"
+    assert rewrite_query("how long does shipping take to canada", conversation) == \
+        "how long does shipping take to canada"
+    assert rewrite_query("is it waterproof?", Conversation()) == "is it waterproof?"
+    assert rewrite_query("is it waterproof?", conversation, mode="llm",
+                         rewrite_fn=lambda prompt: "is trail tent sku-42 waterproof") == "is trail tent sku-42 waterproof"
+
+
+def test_follow_up_prompt_carries_the_conversation(monkeypatch):
+    fakes = install_fakes()
+    app = load_lambda("ws_message_handler", monkeypatch, CONVERSATION_ENABLED="YES")
+
+    app.lambda_handler(websocket_event("conn-7", body="does the trail tent sku-42 have a warranty"), None)
+    app.lambda_handler(websocket_event("conn-7", body="and is it waterproof?"), None)
+
+    first, second = [json.loads(entry["Detail"]) for entry in fakes["events"].entries]
+    assert "<history>" not in first["query_with_prompt"]
+    assert "User: does the trail tent sku-42 have a warranty" in second["query_with_prompt"]
+    assert first["msg_id"] < second["msg_id"]
+
+
+def test_answers_built_on_history_are_not_shared_through_the_semantic_cache(monkeypatch):
+    fakes = install_fakes()
+    app = load_lambda("ws_message_handler", monkeypatch, CONVERSATION_ENABLED="YES", SEMANTIC_CACHE_ENABLED="YES")
+
+    app.lambda_handler(websocket_event("conn-1", body="my order 1234 is late, I live at 5 Elm St"), None)
+    app.lambda_handler(websocket_event("conn-1", body="how long does shipping take to canada"), None)
+    app.lambda_handler(websocket_event("conn-2", body="how long does shipping take to canada"), None)
+
+    cache_hits = [json.loads(entry["Detail"])["semantic_cache_hit"] for entry in fakes["events"].entries]
+    assert cache_hits == [False, False, False]
+    assert app.semantic_cache.stats()["semantic_cache_hits"] == 0
@@ -0,0 +1,60 @@
+from tests.fakes import FakeBedrockClient, FakeOpenSearch
+from utils.chatbot_utils import text_embedding
+from utils.document_manifest import InMemoryManifestStore, assign_chunk_ids
+from utils.ingestion_pipeline import ingest_document, remove_document
+
+SOURCE = "s3://knowledge-bucket/manual.pdf"
+
+
+def test_chunk_ids_are_stable_and_unique_for_repeated_text():
+    chunks = [{"doc_text": "Header"}, {"doc_text": "Body"}, {"doc_text": "Header"}]
+    ids = [c["chunk_id"] for c in assign_chunk_ids(chunks, SOURCE)]
+    assert len(set(ids)) == 3
+    shifted = [c["chunk_id"] for c in assign_chunk_ids([{"doc_text": "New intro"}] + chunks, SOURCE)]
+    assert shifted[1:] == ids
+
+
+def test_reingestion_upserts_changed_and_deletes_removed_chunks():
+    bedrock = FakeBedrockClient()
+    client = FakeOpenSearch()
+    manifests = InMemoryManifestStore()
+
+    def ingest(texts):
+        return ingest_document(({"doc_text": t} for t in texts), SOURCE, manifests,
+                               lambda t: text_embedding(bedrock, t), client, "docs-index")
+
+    ingest([f"section {i}" for i in range(20)])
+    assert len(client.documents) == 20
+
+    stats = ingest([f"section {i}" for i in range(15)] + ["revised section 15"])
+    assert stats["indexed"] == 1 and stats["unchanged"] == 15 and stats["deleted"] == 5
+    assert bedrock.calls == 21
+    assert sorted(d["doc_text"] for d in client.documents.values()) == \
+        sorted([f"section {i}" for i in range(15)] + ["revised section 15"])
+
+    removed = remove_document(SOURCE, manifests, client, "docs-index")
+    assert removed["deleted"] == 16
+    assert client.documents == {}
+    assert manifests.get(SOURCE) == set()
+
+
+def test_failed_chunks_are_retried_and_indexed_ones_stay_in_the_manifest():
+    bedrock = FakeBedrockClient()
+    client = FakeOpenSearch(rejected_texts={"section 3"})
+    manifests = InMemoryManifestStore()
+
+    def ingest(texts):
+        return ingest_document(({"doc_text": t} for t in texts), SOURCE, manifests,
+                               lambda t: text_embedding(bedrock, t), client, "docs-index")
+
+    stats = ingest([f"section {i}" for i in range(5)])
+    assert stats["indexed"] == 4 and stats["failed"] == 1
+    assert len(manifests.get(SOURCE)) == 4
+
+    client.rejected_texts.clear()
+    stats = ingest([f"section {i}" for i in range(5)])
+    assert stats["indexed"] == 1 and stats["unchanged"] == 4
+    assert len(manifests.get(SOURCE)) == 5
+
+    assert remove_document(SOURCE, manifests, client, "docs-index")["deleted"] == 5
+    assert client.documents == {}
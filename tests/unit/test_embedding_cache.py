@@ -0,0 +1,38 @@
+from tests.fakes import FakeBedrockClient, FakeOpenSearch
+from utils.chatbot_utils import text_embedding
+from utils.embedding_cache import EmbeddingCache, InMemoryEmbeddingStore, chunk_hash
+from utils.ingestion_pipeline import ingest_chunks
+
+
+def test_chunk_hash_ignores_whitespace_differences():
+    assert chunk_hash("Return  policy:\n30 days ") == chunk_hash("Return policy: 30 days")
+    assert chunk_hash("Return policy: 30 days") != chunk_hash("Return policy: 60 days")
+
+
+def test_reingesting_unchanged_chunks_skips_embedding_calls():
+    bedrock = FakeBedrockClient()
+    cache = EmbeddingCache(InMemoryEmbeddingStore(), "amazon.titan-embed-text-v1")
+    texts = [f"chunk {i}" for i in range(40)]
+
+    def ingest(chunk_texts):
+        return ingest_chunks(({"doc_text": t} for t in chunk_texts), lambda t: text_embedding(bedrock, t),
+                             FakeOpenSearch(), "docs-index", embedding_cache=cache)
+
+    ingest(texts)
+    assert bedrock.calls == 40
+
+    edited = texts[:35] + [f"edited chunk {i}" for i in range(5)]
+    stats = ingest(edited)
+    assert bedrock.calls == 45
+    assert stats["indexed"] == 40
+    assert stats["embedding_calls_saved"] == 35
+
+
+def test_text_embedding_consults_cache():
+    bedrock = FakeBedrockClient()
+    cache = EmbeddingCache(InMemoryEmbeddingStore(), "amazon.titan-embed-text-v1")
+    first = text_embedding(bedrock, "where is my order", cache=cache)
+    second = text_embedding(bedrock, "where is my order", cache=cache)
+    assert bedrock.calls == 1
+    assert first == second
+    assert cache.stats()["cache_hit_rate"] == 0.5
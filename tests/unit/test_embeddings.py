@@ -0,0 +1,70 @@
+import numpy as np
+
+from tests.fakes import FakeBedrockClient, FakeOpenSearch
+from utils.chatbot_utils import text_embedding
+from utils.embedding_cache import EmbeddingCache, InMemoryEmbeddingStore
+from utils.embeddings import CohereProvider, LocalHashProvider, TitanProvider, embed_batch, embedding_provider
+from utils.index_profiles import get_index_profile, prepare_vector, prepare_vectors
+from utils.ingestion_pipeline import ingest_chunks
+
+
+def test_embed_batch_returns_a_float32_matrix_matching_single_calls():
+    bedrock = FakeBedrockClient()
+    texts = [f"chunk {i}" for i in range(20)]
+    matrix = embed_batch(texts, TitanProvider("amazon.titan-embed-text-v1", client=bedrock))
+    assert matrix.shape == (20, bedrock.dimension) and matrix.dtype == np.float32
+    assert matrix.flags["C_CONTIGUOUS"]
+    assert np.allclose(matrix[3], text_embedding(bedrock, "chunk 3"))
+    assert bedrock.calls == 21
+
+
+def test_cohere_sends_up_to_96_texts_per_request():
+    bedrock = FakeBedrockClient()
+    matrix = embed_batch([f"chunk {i}" for i in range(200)], CohereProvider("cohere.embed-english-v3", client=bedrock))
+    assert matrix.shape == (200, bedrock.dimension)
+    assert bedrock.calls == 3
+
+
+def test_provider_follows_embedding_model_id(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_MODEL_ID", "cohere.embed-multilingual-v3")
+    assert isinstance(embedding_provider(), CohereProvider)
+    assert get_index_profile("default")["embedding_model_id"] == "cohere.embed-multilingual-v3"
+    assert isinstance(embedding_provider("amazon.titan-embed-text-v2:0", 512), TitanProvider)
+
+
+def test_local_provider_is_deterministic_and_ranks_shared_words_higher():
+    provider = LocalHashProvider("local.hash")
+    matrix = embed_batch(["return a tent", "return a tent please", "gift card balance"], provider)
+    assert np.array_equal(matrix, embed_batch(["return a tent", "return a tent please", "gift card balance"],
+                                              LocalHashProvider("local.hash")))
+    assert np.allclose(np.linalg.norm(matrix, axis=1), 1.0)
+    assert matrix[0] @ matrix[1] > matrix[0] @ matrix[2]
+
+
+def test_embed_batch_only_sends_texts_missing_from_the_cache():
+    bedrock = FakeBedrockClient()
+    cache = EmbeddingCache(InMemoryEmbeddingStore(), "amazon.titan-embed-text-v1")
+    provider = TitanProvider("amazon.titan-embed-text-v1", client=bedrock)
+    embed_batch(["a", "b"], provider, cache=cache)
+    matrix = embed_batch(["a", "b", "c"], provider, cache=cache)
+    assert bedrock.calls == 3 and matrix.shape == (3, bedrock.dimension)
+
+
+def test_prepare_vectors_matches_prepare_vector():
+    matrix = embed_batch(["return a tent", "gift card balance"], LocalHashProvider("local.hash"))
+    for name in ("default", "titan-v2-256-byte", "titan-v2-512-fp16"):
+        profile = get_index_profile(name)
+        prepared = prepare_vectors(matrix, profile)
+        assert np.allclose(prepared[1].tolist(), prepare_vector(matrix[1].tolist(), profile), atol=1e-5)
+
+
+def test_ingest_chunks_embeds_in_batches():
+    bedrock = FakeBedrockClient()
+    provider = CohereProvider("cohere.embed-english-v3", client=bedrock)
+    client = FakeOpenSearch()
+    texts = [f"chunk number {i}" for i in range(100)]
+    stats = ingest_chunks(({"doc_text": t} for t in texts), None, client, "docs-index",
+                          embed_many_fn=lambda batch: embed_batch(batch, provider), embed_batch_size=25)
+    assert stats["indexed"] == 100 and bedrock.calls == 4
+    assert sorted(doc["doc_text"] for doc in client.documents.values()) == sorted(texts)
+    assert all(isinstance(doc["doc_vector"], list) for doc in client.documents.values())
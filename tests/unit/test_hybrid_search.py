@@ -0,0 +1,26 @@
+from utils.chatbot_utils import reciprocal_rank_fusion, search_index
+from tests.fakes import FakeOpenSearch, hash_embedding
+
+
+def test_rrf_prefers_documents_ranked_by_both_lists():
+    knn = [{"_id": "a", "_score": 0.9}, {"_id": "b", "_score": 0.8}]
+    lexical = [{"_id": "b", "_score": 12.0}, {"_id": "c", "_score": 3.0}]
+    fused = reciprocal_rank_fusion([knn, lexical], k=60)
+    assert [hit["_id"] for hit in fused] == ["b", "a", "c"]
+    assert fused[0]["_score"] == 1 / 61 + 1 / 62
+
+
+def test_hybrid_finds_exact_product_code_in_one_round_trip():
+    client = FakeOpenSearch()
+    texts = [f"product sku-{n} is a waterproof jacket with a two year warranty" for n in range(50)]
+    for n, text in enumerate(texts):
+        client.index("docs-index", {"doc_text": text, "doc_vector": hash_embedding(text, 16)}, id=str(n))
+    question = "warranty on sku-37"
+    vector = hash_embedding(question, 16)
+
+    hits = search_index(client, "docs-index", vector, 2, query_text=question, mode="hybrid", size=2)
+    requests = client.requests
+
+    assert "37" in [hit["_id"] for hit in hits["hits"]["hits"]]
+    assert "doc_vector" not in hits["hits"]["hits"][0]["_source"]
+    assert requests == 51
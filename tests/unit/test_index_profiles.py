@@ -0,0 +1,40 @@
+import json
+
+from utils.chatbot_utils import text_embedding
+from utils.index_profiles import get_index_profile, index_body, prepare_vector
+from tests.fakes import FakeBedrockClient, hash_embedding
+
+
+def test_default_profile_keeps_the_original_mapping():
+    body = index_body(get_index_profile("default"))
+    doc_vector = body["mappings"]["properties"]["doc_vector"]
+    assert doc_vector["dimension"] == 1536 and doc_vector["method"]["engine"] == "nmslib"
+    assert body["settings"]["index"]["knn.algo_param"]["ef_search"] == 512
+
+
+def test_quantized_profiles(monkeypatch):
+    monkeypatch.setenv("KNN_EF_SEARCH", "64")
+    fp16 = index_body(get_index_profile("titan-v2-512-fp16"))
+    method = fp16["mappings"]["properties"]["doc_vector"]["method"]
+    assert method["engine"] == "faiss"
+    assert method["parameters"]["encoder"] == {"name": "sq", "parameters": {"type": "fp16"}}
+    assert fp16["settings"]["index"]["knn.algo_param"]["ef_search"] == 64
+
+    byte = get_index_profile("titan-v2-256-byte")
+    assert index_body(byte)["mappings"]["properties"]["doc_vector"]["data_type"] == "byte"
+    query = prepare_vector(hash_embedding("return a tent", 256), byte)
+    near = prepare_vector(hash_embedding("return a tent please", 256), byte)
+    far = prepare_vector(hash_embedding("gift card balance", 256), byte)
+    assert all(isinstance(v, int) and -127 <= v <= 127 for v in query)
+    assert sum(q * n for q, n in zip(query, near)) > sum(q * f for q, f in zip(query, far))
+
+
+def test_titan_v2_embedding_requests_dimensions():
+    bedrock = FakeBedrockClient()
+    calls = []
+    invoke = bedrock.invoke_model
+    bedrock.invoke_model = lambda **kw: calls.append(kw) or invoke(**kw)
+    vector = text_embedding(bedrock, "hello", model_id="amazon.titan-embed-text-v2:0", dimensions=256)
+    assert len(vector) == 256
+    assert calls[0]["modelId"] == "amazon.titan-embed-text-v2:0"
+    assert json.loads(calls[0]["body"])["dimensions"] == 256
@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tests.fakes import FakeBedrockClient, FakeClientError, FakeOpenSearch
+from utils.chatbot_utils import text_embedding
+from utils.bedrock_calls import call_with_backoff
+from utils.ingestion_pipeline import ingest_chunks, ordered_map
+
+
+def test_ordered_map_keeps_input_order():
+    texts = [f"text {i}" for i in range(50)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(ordered_map(executor, str.upper, iter(texts), max_in_flight=4))
+    assert results == [(t, t.upper()) for t in texts]
+
+
+def test_call_with_backoff_retries_throttling_only():
+    bedrock = FakeBedrockClient(throttles=2)
+    vector = call_with_backoff(text_embedding, bedrock, "hello", base_delay=0.001)
+    assert len(vector) == bedrock.dimension
+    assert bedrock.calls == 3
+
+    def broken():
+        raise FakeClientError("ValidationException")
+    with pytest.raises(FakeClientError):
+        call_with_backoff(broken, base_delay=0.001)
+
+
+def test_ingest_chunks_flushes_bounded_bulk_batches():
+    bedrock = FakeBedrockClient()
+    client = FakeOpenSearch()
+    texts = [f"chunk number {i}" for i in range(250)]
+    stats = ingest_chunks(({"doc_text": t} for t in texts), lambda t: text_embedding(bedrock, t),
+                          client, "docs-index", bulk_chunk_size=100)
+    assert stats["indexed"] == 250 and stats["failed"] == 0
+    assert client.requests == 3
+    assert sorted(doc["doc_text"] for doc in client.documents.values()) == sorted(texts)
@@ -0,0 +1,104 @@
+import io
+
+import pytest
+
+from utils.chunker import StructuredChunker
+from utils.document_manifest import InMemoryManifestStore
+from utils.embedding_cache import EmbeddingCache, InMemoryEmbeddingStore
+from utils.ingestion_pipeline import ingest_document, iter_page_chunks, iter_pdf_pages
+from utils.ingestion_shards import ShardStore, coordinate, finalize, process_shard, put_events
+from tests.fakes import FakeDynamoDb, FakeEventsClient, FakeOpenSearch, LocalDispatcher, hash_embedding, make_pdf
+
+SOURCE = "s3://docs/manual.pdf"
+
+
+def test_sharded_run_indexes_the_same_chunks_once_all_shards_are_done():
+    pdf = make_pdf(30, lines_per_page=6, line_text="Manual page {page} line {line} covers returns and refunds.")
+    split = StructuredChunker(target_tokens=40).split_text
+    shard_store = ShardStore("events_table", dynamodb=FakeDynamoDb())
+    manifests, client = InMemoryManifestStore(), FakeOpenSearch()
+    finalized = []
+
+    def worker(message):
+        done, total = process_shard(message, io.BytesIO(pdf), split, hash_embedding, shard_store)
+        if done < total:
+            assert client.documents == {}
+        elif shard_store.claim_finalize(SOURCE, message["run_id"], f"worker-{message['shard']}"):
+            finalized.append(finalize(SOURCE, message["run_id"], shard_store, manifests, client, "docs-index"))
+
+    dispatcher = LocalDispatcher(worker, workers=3)
+    assert coordinate("docs", "manual.pdf", SOURCE, 30, "run-1", shard_store, dispatcher, pages_per_shard=7) == 5
+    dispatcher.results()
+
+    expected = FakeOpenSearch()
+    chunks = iter_page_chunks(iter_pdf_pages(io.BytesIO(pdf)), split)
+    stats = ingest_document(chunks, SOURCE, InMemoryManifestStore(), hash_embedding, expected, "docs-index")
+    [final] = finalized
+    assert final["indexed"] == stats["indexed"]
+    assert set(client.documents) == set(expected.documents)
+    assert shard_store.table.items == {}
+
+
+def test_rejected_events_are_sent_again_or_raise():
+    entries = [{"Detail": str(n)} for n in range(25)]
+    events = FakeEventsClient(failures=4)
+    put_events(events, entries, base_delay=0.001)
+    assert sorted(int(entry["Detail"]) for entry in events.entries) == list(range(25))
+
+    with pytest.raises(RuntimeError):
+        put_events(FakeEventsClient(failures=100), entries, max_retries=2, base_delay=0.001)
+
+
+def test_failed_finalize_is_retried_by_the_worker_holding_the_claim():
+    pdf = make_pdf(10, lines_per_page=6)
+    split = StructuredChunker(target_tokens=40).split_text
+    shard_store = ShardStore("events_table", dynamodb=FakeDynamoDb())
+    client = FakeOpenSearch()
+
+    class FailingOnce(InMemoryManifestStore):
+        failures = 1
+
+        def put(self, source, chunk_ids):
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError("manifest write failed")
+            super().put(source, chunk_ids)
+    manifests = FailingOnce()
+
+    message = {"source": SOURCE, "run_id": "run-1", "shard": 0, "start_page": 0, "end_page": 10}
+    shard_store.start_run(SOURCE, "run-1", 1)
+    assert process_shard(message, io.BytesIO(pdf), split, hash_embedding, shard_store) == (1, 1)
+    assert shard_store.claim_finalize(SOURCE, "run-1", "request-1")
+    with pytest.raises(RuntimeError):
+        finalize(SOURCE, "run-1", shard_store, manifests, client, "docs-index")
+
+    # the retried invocation keeps its request id, another worker still cannot claim
+    assert process_shard(message, io.BytesIO(pdf), split, hash_embedding, shard_store) == (1, 1)
+    assert not shard_store.claim_finalize(SOURCE, "run-1", "request-2")
+    assert shard_store.claim_finalize(SOURCE, "run-1", "request-1")
+    stats = finalize(SOURCE, "run-1", shard_store, manifests, client, "docs-index")
+    assert stats["indexed"] == len(client.documents) > 0
+    assert len(manifests.get(SOURCE)) == stats["indexed"]
+
+
+def test_shards_embed_in_batches_and_reuse_cached_vectors():
+    pdf = make_pdf(10, lines_per_page=6)
+    split = StructuredChunker(target_tokens=40).split_text
+    cache = EmbeddingCache(InMemoryEmbeddingStore(), "amazon.titan-embed-text-v1")
+    calls = []
+
+    def embed_many(texts):
+        calls.append(len(texts))
+        return [hash_embedding(text) for text in texts]
+
+    def run(run_id):
+        shard_store = ShardStore("events_table", dynamodb=FakeDynamoDb())
+        shard_store.start_run(SOURCE, run_id, 1)
+        message = {"source": SOURCE, "run_id": run_id, "shard": 0, "start_page": 0, "end_page": 10}
+        process_shard(message, io.BytesIO(pdf), split, lambda text: pytest.fail("single embed call"), shard_store,
+                      embedding_cache=cache, embed_many_fn=embed_many, embed_batch_size=16)
+        return list(shard_store.staged_chunks(SOURCE, run_id))
+
+    staged = run("run-1")
+    assert sum(calls) == len(staged) and len(calls) == -(-len(staged) // 16)
+    assert run("run-2") == staged and sum(calls) == len(staged)
@@ -0,0 +1,15 @@
+from benchmarks.load_test import regressions, run_load_test
+
+
+def test_load_test_drives_both_handlers_end_to_end():
+    results = run_load_test(requests=12, concurrency=3, files=3, products=30, embed_ms=0, token_ms=0, tokens=5,
+                            post_ms=0, dynamodb_ms=0, events_ms=0, s3_ms=0)
+    assert results["ingest"]["requests"] == 3 and results["ingest"]["errors"] == 0
+    assert results["query"]["requests"] == 12 and results["query"]["errors"] == 0
+    assert {"embedding_ms", "search_ms", "llm_ms", "send_ms", "log_ms", "total_ms"} <= set(results["query"]["stages"])
+    assert "ingest_ms" in results["ingest"]["stages"]
+
+    slower = {phase: dict(results[phase], requests_per_sec=results[phase]["requests_per_sec"] * 4)
+              for phase in ("ingest", "query")}
+    assert regressions(results, results, tolerance=1.5) == []
+    assert len(regressions(results, slower, tolerance=1.5)) == 2
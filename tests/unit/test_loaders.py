@@ -0,0 +1,83 @@
+import io
+import tempfile
+import zipfile
+
+from utils.chunker import StructuredChunker
+from utils.ingestion_pipeline import iter_page_chunks
+from utils.loaders import EXTENSIONS, LOADERS, document_format, group_sections, load_pages, register_loader
+from tests.fakes import make_pdf
+
+W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+
+def make_docx(paragraphs):
+    body = "".join(f'<w:p><w:pPr><w:pStyle w:val="{style}"/></w:pPr><w:r><w:t>{text}</w:t></w:r></w:p>'
+                   if style else f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>' for style, text in paragraphs)
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as archive:
+        archive.writestr("word/document.xml", f'<?xml version="1.0"?><w:document {W}><w:body>{body}</w:body></w:document>')
+    return data.getvalue()
+
+
+def spooled(data):
+    file = tempfile.SpooledTemporaryFile()
+    file.write(data)
+    file.seek(0)
+    return file
+
+
+def test_document_format_by_extension_then_content_type():
+    assert document_format("docs/Manual.PDF") == "pdf"
+    assert document_format("faq.md") == "markdown"
+    assert document_format("export", "text/csv; charset=utf-8") == "csv"
+    assert document_format("archive.zip", "application/zip") is None
+    register_loader("json", lambda file, **options: iter([(0, file.read().decode())]), extensions=[".json"])
+    try:
+        assert list(load_pages(io.BytesIO(b'{"a": 1}'), document_format("data.json"))) == [(0, '{"a": 1}')]
+    finally:
+        LOADERS.pop("json")
+        EXTENSIONS.pop(".json")
+
+
+def test_markdown_sections_split_at_headings_without_markup():
+    text = ("---\ntitle: FAQ\n---\n# Returns\nItems can be **returned** within [30 days](http://x/returns).\n\n"
+            "## Shipping\n- Orders ship in `2` days.\n```\n# not a heading\n```\n")
+    sections = list(load_pages(spooled(text.encode()), "markdown"))
+    assert sections == [(0, "Returns\n\nItems can be returned within 30 days."),
+                        (1, "Shipping\n\nOrders ship in 2 days.\n\n# not a heading")]
+
+
+def test_html_drops_navigation_and_scripts():
+    html = ("<html><head><style>p {}</style></head><body><nav><a>Home</a></nav>"
+            "<h1>Warranty</h1><p>Two years on all tents.</p><script>track()</script>"
+            "<h2>Claims</h2><p>Send the receipt &amp; photos.</p><footer>Copyright</footer></body></html>")
+    sections = list(load_pages(spooled(html.encode()), "html", chunk_size=16))
+    assert sections == [(0, "Warranty\n\nTwo years on all tents."), (1, "Claims\n\nSend the receipt & photos.")]
+
+
+def test_docx_csv_and_text_loaders():
+    docx = make_docx([("Heading1", "Returns"), (None, "Refunds take five days."), ("Title", "Shipping"),
+                      (None, "Free over 50 dollars.")])
+    assert list(load_pages(spooled(docx), "docx")) == [(0, "Returns\n\nRefunds take five days."),
+                                                       (1, "Shipping\n\nFree over 50 dollars.")]
+    csv_text = "sku,name,price\nA-1,Trail tent,199\nB-2,\"Sleeping bag, down\",149\n"
+    assert list(load_pages(spooled(csv_text.encode()), "csv")) == [
+        (0, "sku: A-1; name: Trail tent; price: 199.\n\nsku: B-2; name: Sleeping bag, down; price: 149.")]
+    assert list(load_pages(spooled(b"First line\nwrapped.\n\n\nSecond paragraph.\n"), "text")) == [
+        (0, "First line\nwrapped.\n\nSecond paragraph.")]
+
+
+def test_long_sections_are_capped_and_keep_their_heading():
+    blocks = [(True, "Policies")] + [(False, f"Paragraph {n} " + "x" * 40) for n in range(10)]
+    sections = list(group_sections(blocks, max_chars=200))
+    assert len(sections) > 1
+    assert all(text.startswith("Policies\n\n") and len(text) <= 200 for _, text in sections)
+    assert sum(text.count("Paragraph") for _, text in sections) == 10
+
+
+def test_every_format_feeds_the_same_chunk_pipeline():
+    split = StructuredChunker(target_tokens=40).split_text
+    pdf = list(iter_page_chunks(load_pages(spooled(make_pdf(3, page_lines=lambda page: [["Tents", "Boots", "Stoves"][page] + " have a warranty."])), "pdf"), split))
+    md = list(iter_page_chunks(load_pages(spooled(b"# A\nOne.\n# B\nTwo.\n"), "markdown"), split))
+    assert [chunk["doc_page"] for chunk in pdf] == [0, 1, 2]
+    assert [chunk["doc_page"] for chunk in md] == [0, 1]
@@ -0,0 +1,71 @@
+import numpy as np
+
+from utils.document_manifest import InMemoryManifestStore
+from utils.ingestion_pipeline import ingest_document, remove_document
+from utils.local_vector_store import LocalVectorStore
+from tests.fakes import hash_embedding
+
+
+def clustered_vectors(count, dimension, clusters=20, seed=1):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dimension))
+    return centres[rng.integers(clusters, size=count)] + 0.3 * rng.normal(size=(count, dimension))
+
+
+def test_search_ranks_by_cosine_and_skips_deleted():
+    store = LocalVectorStore(dimension=3)
+    store.add_many(["x", "y", "z"], [[1, 0, 0], [0, 1, 0], [1, 1, 0]],
+                   [{"doc_text": "x"}, {"doc_text": "y"}, {"doc_text": "z"}])
+    hits = store.search([2, 0.1, 0], k=2)["hits"]["hits"]
+    assert [hit["_id"] for hit in hits] == ["x", "z"]
+    assert 0.99 < hits[0]["_score"] <= 1.0
+
+    store.delete("x")
+    hits = store.search([2, 0.1, 0], k=2)["hits"]["hits"]
+    assert [hit["_id"] for hit in hits] == ["z", "y"]
+
+
+def test_ivf_recall_against_brute_force():
+    vectors = clustered_vectors(5000, 32)
+    store = LocalVectorStore(dimension=32, lexical=False)
+    store.add_many([str(i) for i in range(5000)], vectors, [{}] * 5000)
+    store.build_ivf(nprobe=8)
+    queries = clustered_vectors(50, 32, seed=2)
+    recall = []
+    for query in queries:
+        exact = {hit["_id"] for hit in store.search(query, 10, size=10, exact=True)["hits"]["hits"]}
+        approx = {hit["_id"] for hit in store.search(query, 10, size=10)["hits"]["hits"]}
+        recall.append(len(exact & approx) / 10)
+    assert np.mean(recall) > 0.9
+
+
+def test_saved_store_reopens_memory_mapped(tmp_path):
+    store = LocalVectorStore(dimension=8, path=str(tmp_path))
+    store.add_many(["a", "b", "c"], clustered_vectors(3, 8), [{"doc_text": t} for t in ("red", "green", "blue")])
+    store.delete("b")
+    store.build_ivf(n_lists=2)
+    store.flush()
+
+    reopened = LocalVectorStore.open(str(tmp_path), dimension=8)
+    assert isinstance(reopened._vectors, np.memmap)
+    assert len(reopened) == 2
+    query = store._vectors[0]
+    assert reopened.search(query, 1)["hits"]["hits"][0]["_id"] == "a"
+    reopened.add_document({"doc_text": "yellow", "doc_vector": [1.0] * 8}, doc_id="d")
+    assert len(reopened) == 3
+
+
+def test_ingest_and_remove_document_through_local_store():
+    store = LocalVectorStore(dimension=64)
+    manifests = InMemoryManifestStore()
+    texts = [f"returns policy section {n} for order sku-{n}" for n in range(30)]
+    stats = ingest_document(({"doc_text": t} for t in texts), "s3://docs/policy.pdf", manifests,
+                            lambda t: hash_embedding(t), store, "docs-index")
+    assert stats["indexed"] == 30 and len(store) == 30
+
+    question = "policy for sku-17"
+    hits = store.search(hash_embedding(question), 2, query_text=question, mode="hybrid", size=2)["hits"]["hits"]
+    assert hits[0]["_source"]["doc_text"] == texts[17]
+
+    assert remove_document("s3://docs/policy.pdf", manifests, store, "docs-index")["deleted"] == 30
+    assert len(store) == 0
@@ -0,0 +1,64 @@
+from utils.query_cache import LRUCache, QueryCache
+
+
+class FakeGeneration:
+    def __init__(self):
+        self.value = 0
+
+    def current(self):
+        return self.value
+
+
+class DictStore:
+    def __init__(self):
+        self.items = {}
+
+    def get(self, key):
+        return self.items.get(key)
+
+    def put(self, key, value):
+        self.items[key] = value
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_repeated_question_skips_embedding_and_search():
+    generation = FakeGeneration()
+    cache = QueryCache(generation=generation)
+    calls = {"embed": 0, "search": 0}
+
+    def embed(question):
+        calls["embed"] += 1
+        return [0.1, 0.2, 0.3]
+
+    def search():
+        calls["search"] += 1
+        return [{"_id": "1", "_source": {"doc_text": "30 day returns"}}]
+
+    for question in ["What is the return policy?", "  what is the RETURN policy "]:
+        vector = cache.embedding(question, embed)
+        hits = cache.search(vector, 2, search)
+    assert calls == {"embed": 1, "search": 1}
+    assert hits[0]["_id"] == "1"
+    assert cache.stats()["search_local_hits"] == 1
+
+    generation.value += 1
+    cache.search(vector, 2, search)
+    assert calls["search"] == 2
+
+
+def test_shared_tier_serves_other_containers():
+    shared = DictStore()
+    QueryCache(shared_store=shared).search([1.0], 2, lambda: [{"_id": "7"}])
+    other_container = QueryCache(shared_store=shared)
+    hits = other_container.search([1.0], 2, lambda: [])
+    assert hits == [{"_id": "7"}]
+    assert other_container.stats()["search_shared_hits"] == 1
@@ -0,0 +1,20 @@
+from utils.reranker import adaptive_k, rerank
+
+
+def hit(doc_id, text, score):
+    return {"_id": doc_id, "_score": score, "_source": {"doc_text": text}}
+
+
+def test_adaptive_k_cuts_at_the_largest_gap():
+    assert adaptive_k([0.95, 0.4, 0.38, 0.2]) == 1
+    assert adaptive_k([0.9, 0.88, 0.86, 0.3, 0.2]) == 3
+    assert adaptive_k([0.9, 0.85, 0.8, 0.75, 0.7, 0.65], max_k=4) == 4
+
+
+def test_exact_term_match_outranks_a_higher_vector_score():
+    hits = [hit("1", "warranty for sku-100 is one year", 0.91),
+            hit("2", "warranty for sku-200 is five years", 0.90),
+            hit("3", "shipping takes three days", 0.60)]
+    reranked = rerank("what is the warranty on sku-200", hits)
+    assert reranked[0]["_id"] == "2"
+    assert "3" not in [h["_id"] for h in reranked]
@@ -0,0 +1,36 @@
+from tests.fakes import FakeBedrockClient
+from utils.chatbot_utils import invoke_model, text_embedding
+from utils.semantic_cache import LocalSemanticStore, SemanticAnswerCache, answer_pieces
+
+
+def ask(cache, bedrock, question, context_ids):
+    vector = text_embedding(bedrock, question)
+    answer = cache.lookup(vector, context_ids)
+    if answer is None:
+        answer = invoke_model(bedrock, question)
+        cache.add(vector, context_ids, answer)
+    return answer
+
+
+def test_paraphrase_with_same_context_reuses_answer():
+    bedrock = FakeBedrockClient()
+    cache = SemanticAnswerCache(LocalSemanticStore(), threshold=0.75)
+    first = ask(cache, bedrock, "what is your return policy", ["c1", "c2"])
+    second = ask(cache, bedrock, "what is the return policy", ["c2", "c1"])
+    assert first == second
+    assert bedrock.completions == 1
+    assert cache.stats() == {"semantic_cache_hits": 1, "semantic_cache_misses": 1}
+
+
+def test_different_context_or_question_calls_the_llm():
+    bedrock = FakeBedrockClient()
+    cache = SemanticAnswerCache(LocalSemanticStore(), threshold=0.75)
+    ask(cache, bedrock, "what is your return policy", ["c1"])
+    ask(cache, bedrock, "what is your return policy", ["c9"])
+    ask(cache, bedrock, "how long does shipping take", ["c1"])
+    assert bedrock.completions == 3
+
+
+def test_answer_pieces_rebuild_the_answer():
+    answer = " ".join(f"word{i}" for i in range(45))
+    assert "".join(answer_pieces(answer)) == answer
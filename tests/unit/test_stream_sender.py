@@ -0,0 +1,29 @@
+from tests.fakes import FakeCompletionStream, FakeWebSocketClient
+from utils.stream_sender import CoalescingStreamSender, relay_stream
+
+
+def test_tokens_are_coalesced_into_few_frames():
+    tokens = [f" word{i}" for i in range(300)]
+    stream = FakeCompletionStream(tokens)
+    socket = FakeWebSocketClient(latency=0.005)
+    # frames are cut by size only, so the split does not depend on timing
+    with CoalescingStreamSender(socket, "conn-1", flush_interval=60, max_frame_bytes=1000) as sender:
+        relay_stream(stream, sender)
+
+    frames = [data for _, data, _ in socket.messages]
+    assert frames[0] == tokens[0]
+    assert "".join(frames) == "".join(tokens)
+    assert all(len(frame) < 1000 + len(tokens[-1]) for frame in frames)
+    assert len(frames) <= 2 + len("".join(tokens)) // 1000
+    assert sender.time_to_first_token_ms() is not None
+
+
+def test_gone_connection_stops_reading_the_stream():
+    stream = FakeCompletionStream([f" t{i}" for i in range(500)], delay=0.001)
+    socket = FakeWebSocketClient()
+    socket.gone.add("conn-2")
+    with CoalescingStreamSender(socket, "conn-2") as sender:
+        relay_stream(stream, sender)
+    assert sender.gone.is_set()
+    assert stream.closed
+    assert stream.read < 500
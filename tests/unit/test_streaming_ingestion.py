@@ -0,0 +1,66 @@
+import io
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from tests.fakes import FakeBedrockClient, FakeOpenSearch, make_pdf
+from utils.chatbot_utils import text_embedding
+from utils.ingestion_pipeline import ingest_chunks, iter_page_chunks, iter_pdf_pages, iter_pdf_pages_parallel
+
+
+def split_text(text):
+    return [text[i:i + 500] for i in range(0, len(text), 400)]
+
+
+def traced_peak(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def streaming_peak(pdf_bytes, bedrock):
+    def run():
+        chunks = iter_page_chunks(iter_pdf_pages(io.BytesIO(pdf_bytes)), split_text)
+        stats = ingest_chunks(chunks, lambda t: text_embedding(bedrock, t),
+                              FakeOpenSearch(keep_documents=False), "docs-index",
+                              max_in_flight=8, bulk_threads=2, bulk_chunk_size=20)
+        assert stats["failed"] == 0
+    return traced_peak(run)
+
+
+def materialized_peak(pdf_bytes, bedrock):
+    def run():
+        chunks = list(iter_page_chunks(iter_pdf_pages(io.BytesIO(pdf_bytes)), split_text))
+        vectors = [text_embedding(bedrock, chunk["doc_text"]) for chunk in chunks]
+        assert len(vectors) == len(chunks)
+    return traced_peak(run)
+
+
+def test_iter_pdf_pages_yields_every_page_in_order():
+    pages = list(iter_pdf_pages(io.BytesIO(make_pdf(3, lines_per_page=2))))
+    assert [number for number, _ in pages] == [0, 1, 2]
+    assert "line 2-1" in pages[2][1]
+
+
+def test_parallel_parsing_matches_in_process_parsing():
+    pdf = make_pdf(12, lines_per_page=5)
+    # read on a pool thread, the way parallel_bulk consumes the chunk stream
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        pages = executor.submit(lambda: list(iter_pdf_pages_parallel(io.BytesIO(pdf), workers=3, min_pages=5))).result()
+    assert pages == list(iter_pdf_pages(io.BytesIO(pdf)))
+
+
+def test_streaming_ingestion_peak_memory_stays_flat():
+    bedrock = FakeBedrockClient(dimension=256)
+    small, large = make_pdf(40, lines_per_page=20), make_pdf(120, lines_per_page=20)
+    streaming_peak(make_pdf(2), bedrock)  # warm up lazy imports and caches
+
+    small_peak = streaming_peak(small, bedrock)
+    large_peak = streaming_peak(large, bedrock)
+    materialized = materialized_peak(large, bedrock)
+
+    # 3x the document must not mean 3x the memory, the in-flight window bounds it
+    assert large_peak < 1.5 * small_peak
+    assert large_peak < materialized / 2
@@ -0,0 +1,59 @@
+import json
+
+from tests.fakes import FakeBedrockClient, hash_embedding, install_fakes, load_lambda, websocket_event
+
+
+def test_streaming_answer_is_logged_and_published(monkeypatch):
+    fakes = install_fakes(bedrock=FakeBedrockClient(stream_tokens=120, token_delay=0.001))
+    app = load_lambda("ws_message_handler", monkeypatch, LLM_STREAMING_ENABLED="YES")
+
+    response = app.lambda_handler(websocket_event("conn-1", body="what is the return policy"), None)
+    assert response["statusCode"] == 200
+
+    expected_answer = "".join(f" token{i}" for i in range(120))
+    [published] = fakes["events"].entries
+    event = json.loads(published["Detail"])
+    assert published["Source"] == "com.onebyzero.chatter.chat_message"
+    assert event["ai_msg"] == expected_answer
+    assert event["streaming"] is True
+    assert event["output_chunks"] == 120 and event["output_tokens"] == 240
+    assert event["ttft_ms"] is not None and event["tokens_per_sec"] > 0
+
+    [logged] = fakes["dynamodb"].Table("events_table").items.values()
+    assert logged["pk"] == "conn-1" and logged["body"]["ai_msg"] == expected_answer
+
+    # answer frames only, the client joins them as they come
+    frames = [data for _, data, _ in fakes["apigatewaymanagementapi"].messages]
+    assert "".join(frames) == expected_answer
+
+
+def test_non_streaming_answer_is_logged_and_published(monkeypatch, capsys):
+    fakes = install_fakes()
+    app = load_lambda("ws_message_handler", monkeypatch, LLM_STREAMING_ENABLED="NO")
+
+    app.lambda_handler(websocket_event("conn-2", body="how long does shipping take"), None)
+
+    [published] = fakes["events"].entries
+    event = json.loads(published["Detail"])
+    assert event["streaming"] is False
+    assert event["ai_msg"] == "Answer 1 from the provided context."
+    answer, echo = [data for _, data, _ in fakes["apigatewaymanagementapi"].messages]
+    assert answer == event["ai_msg"] and json.loads(echo)["msg_id"] == event["msg_id"]
+
+    [emf] = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')]
+    assert emf["request_id"] == event["msg_id"]
+    for stage in ["embedding_ms", "search_ms", "llm_ms", "send_ms", "log_ms", "publish_ms", "total_ms"]:
+        assert emf[stage] >= 0
+
+
+def test_rerank_keeps_an_adaptive_number_of_hits(monkeypatch):
+    fakes = install_fakes(bedrock=FakeBedrockClient())
+    app = load_lambda("ws_message_handler", monkeypatch, RERANK_ENABLED="YES", RERANK_CANDIDATES="8", RETRIEVAL_MODE="hybrid")
+    texts = [f"returns for sku-{n} are accepted within 30 days" for n in range(20)]
+    for n, text in enumerate(texts):
+        fakes["opensearch"].index("docs-index", {"doc_text": text, "doc_vector": hash_embedding(text, 64)}, id=str(n))
+
+    app.lambda_handler(websocket_event("conn-1", body="returns for sku-12"), None)
+
+    [published] = fakes["events"].entries
+    assert json.loads(published["Detail"])["context"] == [texts[12]]